@@ -8,33 +8,65 @@
 5.  功能扩展：保留 v7.0 的数据质量检查、CSV导出支持和可视化图表功能。
 """
 
+from __future__ import annotations  # 注解不在定义时求值，避免触发 pandas 等惰性模块的导入
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta, date
+from decimal import Decimal, InvalidOperation
 import os
+import json
+import hashlib
 import calendar
 import threading
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import re
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import warnings
+import weakref
 import subprocess
 import sys
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.table import Table, TableStyleInfo, TableColumn
-from openpyxl.chart import BarChart, Reference, LineChart
+import time
+import argparse
+import bisect
+import glob
+import contextlib
+import cProfile
+import pstats
+import platform
+import shutil
+import tracemalloc
+import importlib.util
+
+def lazy_import(name):
+    """登记惰性模块：首次访问其属性时才真正执行导入"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# pandas/numpy 的导入占启动耗时的大头，延迟到首次使用时再导入，界面可以先显示出来；
+# openpyxl 在用到它的函数内导入。GUI 在数据加载线程开始时调用 warm_up_imports 在后台完成导入
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
 
 # ==================== 配置管理 ====================
 class Config:
     """配置管理类"""
-    FOLDERS = {'data': '主数据', 'reports': '报表'}
+    FOLDERS = {'data': '主数据', 'reports': '报表', 'cache': '缓存'}
     STD_COLS = {
         'BRAND': '品牌', 'BARCODE': '条码', 'NAME': '名称', 'SPEC': '规格', 'PRICE': '定价',
         'STOCK': '库存量', 'LAST_INBOUND_DATE': '最后进货日', 'REMARK': '备注',
         'TOTAL_REVENUE': '总实收', 'TOTAL_ORDERS': '总笔数', 'TOTAL_SALES_QTY': '总销量',
         'WEEK_PERIOD': '周度期间', 'SALES_TIME': '销售时间', 'SALES_QTY': '销售数量',
-        'REVENUE': '实收金额', 'ORDER_ID': '流水号'
+        'REVENUE': '实收金额', 'ORDER_ID': '流水号', 'WEEK_CODE': '周序号', 'STORE': '门店'
     }
     COLUMN_MAPPINGS = {
         'brand': ['商品品牌', '品牌', 'Brand'],
@@ -44,7 +76,8 @@ class Config:
         'price': ['销售价（必填）', '销售价', '定价', '商品原价'],
         'received_qty': ['实收量'],
         'flow_qty': ['货流量'],
-        'check_diff': ['差异库存']
+        'check_diff': ['差异库存'],
+        'store': ['门店', '门店名称', '店铺', '店铺名称', 'Store']
     }
     FILE_PATTERNS = {
         'product': '商品资料',
@@ -57,6 +90,52 @@ class Config:
         'check': ['盘点时间', '日期'],
         'sales': ['销售时间']
     }
+    # 缓存设置：预处理逻辑变化时需递增 version，使旧缓存整体失效
+    CACHE_SETTINGS = {'enabled': True, 'version': 4, 'keep_generations': 2}
+    # 超过阈值的文件改用 openpyxl 只读模式流式读取，并按批次预处理
+    CHUNKED_LOAD = {'threshold_mb': 50, 'chunk_size': 50000}
+    # 列裁剪：读取源文件时只解析报表用到的列。mappings 为 COLUMN_MAPPINGS 的键（按候选名顺序取表头中第一个匹配的列），
+    # dates 为 DATE_COLUMNS 的键，columns 为原始列名；str 中的 mappings 键按字符串读取。enabled 关闭时读取全部列
+    SOURCE_COLUMNS = {
+        'enabled': True,
+        'product': {'mappings': ['brand', 'barcode', 'name', 'spec', 'price']},
+        'sales': {'mappings': ['barcode', 'brand', 'store'], 'dates': 'sales', 'columns': ['实收金额', '销售数量', '流水号']},
+        'inventory_flow': {'mappings': ['barcode', 'received_qty', 'flow_qty'], 'dates': 'flow', 'str': ['barcode']},
+        'inventory_check': {'mappings': ['barcode', 'check_diff'], 'dates': 'check', 'str': ['barcode']}
+    }
+    # 销售数据可拆分为多个文件（如按月、按门店导出）：FILE_PATTERNS['sales'] 为文件夹时读取其中（含子文件夹）全部 .xlsx，
+    # 也可写通配符如 '销售/*/*.xlsx'；每个文件单独缓存、并行加载。门店优先取文件中的门店列，没有时 store_from 为 'folder'
+    # 取文件所在子文件夹名，为 'filename' 时取 filename_pattern 的 store 分组，都取不到时记为 unknown_store；
+    # 只有一个销售文件时不区分门店。store_columns 开启且报表包含多个门店时，每个门店增加一列销量
+    SALES_SOURCES = {'store_from': 'folder', 'filename_pattern': r'^(?P<store>[^_-]+)[_-]',
+                     'unknown_store': '未指定门店', 'store_columns': True}
+    # 四个源文件互不依赖，使用进程池并行解析
+    PARALLEL_LOAD = {'enabled': True, 'max_workers': 4}
+    # 销售/货流/盘点数据加载后的紧凑列类型（列名可写 STD_COLS 的键）：
+    # category 列字典编码；float32 列仅在可无损表示时收窄，金额列保持 float64；
+    # 其余纯文本列不同值占比不超过 category_ratio 时字典编码，否则转为 Arrow 字符串
+    COMPACT_SCHEMA = {
+        'enabled': True,
+        'category': ['BARCODE', 'BRAND', 'ORDER_ID'],
+        'float32': ['SALES_QTY', '库存变动量', '差异库存'],
+        'category_ratio': 0.5
+    }
+    # Excel 报表使用流式（write_only）工作簿写出，样式以命名样式共享
+    EXCEL_WRITER = {'write_only': True}
+    # 命令行批量生成报表时，每个品牌一个任务，分发到进程池
+    BATCH_REPORT = {'max_workers': 4}
+    # 总笔数（订单去重数）默认精确统计；approximate 开启后，日期范围不短于 approximate_min_days
+    # 的总笔数按订单号哈希抽样估算，抽样订单数不足 min_sampled_orders 的商品仍精确统计
+    DISTINCT_ORDERS = {'approximate': False, 'approximate_min_days': 180, 'sample_rate': 1 / 16, 'min_sampled_orders': 1000}
+    # 运行监测：加载和报表各阶段的耗时、CPU 时间和行数追加写入缓存文件夹下的 JSON 行日志（log_file 为空则不写）；
+    # trace_memory 用 tracemalloc 记录内存峰值（纯 Python 部分会慢数倍），profile 用 cProfile 保存最慢阶段的分析结果
+    INSTRUMENTATION = {'trace_memory': False, 'profile': False, 'log_file': 'run_log.jsonl'}
+    # 报表中间结果缓存（GUI 中同一品牌和期间改排序或换导出格式时复用）：内存中最多占用 max_memory_mb，
+    # 超出后淘汰最久未使用的条目；spill_to_disk 开启时淘汰条目写入缓存文件夹，磁盘上最多保留 max_disk_mb
+    REPORT_CACHE = {'enabled': True, 'max_memory_mb': 512, 'spill_to_disk': True, 'max_disk_mb': 2048}
+    # 数据质量检查：行数超过 sample_threshold 的表按 sample_rate 抽样（计数按抽样比例估算），
+    # 每类问题保留 max_examples 条示例行；销售时间跨度超过 max_span_days 天时提示
+    DATA_QUALITY = {'sample_threshold': 2000000, 'sample_rate': 0.1, 'max_examples': 5, 'max_span_days': 730}
 
     @staticmethod
     def get_file_path(file_type):
@@ -65,6 +144,23 @@ class Config:
             return DataProcessor.find_file_in_data_folder(pattern)
         return os.path.join(Config.FOLDERS['data'], pattern)
 
+    @staticmethod
+    def get_sales_paths():
+        """解析 FILE_PATTERNS['sales']（单个文件、文件夹或通配符）为销售文件路径列表
+
+        单个文件即使不存在也原样返回，由加载时报告错误；文件夹和通配符按路径排序，
+        忽略 Excel 的临时文件。
+        """
+        pattern = Config.FILE_PATTERNS['sales']
+        path = DataProcessor.resolve_file_path(pattern)
+        if os.path.isdir(path):
+            paths = glob.glob(os.path.join(path, '**', '*.xlsx'), recursive=True)
+        elif glob.has_magic(pattern):
+            paths = glob.glob(pattern, recursive=True) or glob.glob(os.path.join(Config.FOLDERS['data'], pattern), recursive=True)
+        else:
+            return [path]
+        return sorted(p for p in paths if os.path.isfile(p) and not os.path.basename(p).startswith('~$'))
+
     @staticmethod
     def get_report_path(filename):
         return os.path.join(Config.FOLDERS['reports'], filename)
@@ -76,8 +172,254 @@ class Config:
                 os.makedirs(folder)
                 print(f"📁 创建文件夹: {folder}")
 
-# ==================== 缓存管理已移除 ====================
-# 根据用户要求，移除缓存机制，直接从主数据文件夹读取数据
+# ==================== 缓存管理 ====================
+class CacheManager:
+    """预处理数据的持久化缓存
+
+    将预处理后的数据表以列式格式(Parquet，缺少 pyarrow 或列类型不兼容时退回 pickle)
+    保存到缓存文件夹。缓存以源文件路径、大小、修改时间和内容哈希为键，
+    源文件变化后自动失效，每个源文件只保留最近几代缓存。
+    """
+    META_FILE = 'meta.json'
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or Config.FOLDERS['cache']
+        self.settings = Config.CACHE_SETTINGS
+
+    def get_or_load(self, kind, file_path, loader, append_loader=None):
+        """读取缓存；未命中时调用 loader 加载并写入缓存
+
+        Args:
+            kind (str): 数据类型，如 'sales'，同一文件按不同方式处理时用于区分
+            file_path (str): 源文件路径
+            loader (callable): 无参函数，返回预处理后的 DataFrame
+            append_loader (callable, optional): 增量加载函数 (上次结果, 上次增量状态)。
+                提供时 loader 与 append_loader 均返回 (DataFrame, 增量状态)；
+                append_loader 校验失败时应抛出异常，随后回退为全量加载. Defaults to None.
+
+        Returns:
+            pd.DataFrame: 预处理后的数据
+        """
+        def unwrap(result):
+            return result if append_loader else (result, None)
+
+        if not self.settings['enabled'] or not file_path or not os.path.exists(file_path):
+            return unwrap(loader())[0]
+        entry_dir = self._entry_dir(kind, file_path)
+        meta = self._read_meta(entry_dir)
+        stat = os.stat(file_path)
+        generations = meta.get('generations', [])
+        latest = generations[0] if generations else None
+
+        content_hash = None
+        if latest and latest['size'] == stat.st_size:
+            if latest['mtime_ns'] != stat.st_mtime_ns:
+                # 修改时间变化但大小相同（如文件被复制），以内容哈希为准
+                content_hash = self.file_hash(file_path)
+            if latest['mtime_ns'] == stat.st_mtime_ns or latest['hash'] == content_hash:
+                df = self._read_frame(entry_dir, latest)
+                if df is not None:
+                    if latest['mtime_ns'] != stat.st_mtime_ns:
+                        latest['mtime_ns'] = stat.st_mtime_ns
+                        self._write_meta(entry_dir, meta)
+                    print(f"⚡ 命中缓存: {os.path.basename(file_path)} ({len(df)} 条记录)")
+                    return df
+
+        result = None
+        if append_loader and latest and latest.get('append_state'):
+            previous = self._read_frame(entry_dir, latest)
+            if previous is not None:
+                try:
+                    result = append_loader(previous, latest['append_state'])
+                except Exception as e:
+                    print(f"⚠️ 增量加载不可用，改为全量重建 ({os.path.basename(file_path)}): {e}")
+        df, append_state = result or unwrap(loader())
+        if df is None or df.empty:
+            return df
+        try:
+            self._store(entry_dir, meta, file_path, stat, content_hash or self.file_hash(file_path), df, append_state)
+        except Exception as e:
+            print(f"⚠️ 写入缓存失败 ({os.path.basename(file_path)}): {e}")
+        return df
+
+    @staticmethod
+    def file_hash(file_path, chunk_size=8 * 1024 * 1024):
+        h = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(chunk_size), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def _entry_dir(self, kind, file_path):
+        key = f"v{self.settings['version']}|{kind}|{os.path.abspath(file_path)}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+    def _read_meta(self, entry_dir):
+        try:
+            with open(os.path.join(entry_dir, self.META_FILE), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, entry_dir, meta):
+        path = os.path.join(entry_dir, self.META_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    def _read_frame(self, entry_dir, generation):
+        path = os.path.join(entry_dir, generation['file'])
+        try:
+            if generation['format'] == 'parquet':
+                return pd.read_parquet(path)
+            return pd.read_pickle(path)
+        except Exception as e:
+            print(f"⚠️ 缓存文件损坏，将重新加载: {e}")
+            return None
+
+    def _store(self, entry_dir, meta, file_path, stat, content_hash, df, append_state=None):
+        os.makedirs(entry_dir, exist_ok=True)
+        gen_id = f"{content_hash[:12]}_{stat.st_mtime_ns}"
+        try:
+            file_name, fmt = f"{gen_id}.parquet", 'parquet'
+            df.to_parquet(os.path.join(entry_dir, file_name))
+        except Exception:
+            # pyarrow 未安装或存在混合类型的对象列时，退回 pickle
+            file_name, fmt = f"{gen_id}.pkl", 'pickle'
+            df.to_pickle(os.path.join(entry_dir, file_name))
+
+        generations = [g for g in meta.get('generations', []) if g['file'] != file_name]
+        generations.insert(0, {
+            'file': file_name, 'format': fmt, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'hash': content_hash, 'rows': len(df), 'created': datetime.now().isoformat(timespec='seconds'),
+            'append_state': append_state
+        })
+        keep = max(1, self.settings['keep_generations'])
+        for old in generations[keep:]:
+            try:
+                os.remove(os.path.join(entry_dir, old['file']))
+            except OSError:
+                pass
+        meta.update({'source': os.path.abspath(file_path), 'generations': generations[:keep]})
+        self._write_meta(entry_dir, meta)
+        print(f"💾 已写入缓存: {os.path.basename(file_path)} ({fmt})")
+
+class ReportCache:
+    """报表中间结果缓存（内存 LRU，可溢出到磁盘）
+
+    以 (所选品牌, 起止日期, 数据版本[, 所选门店]) 为键，保存排序前的总表、商品主数据、
+    筛选后的销售数据和各周报表数据。同一品牌和期间只改排序或导出格式时直接
+    复用，不再重新计算库存和销售汇总。内存占用超过 max_memory_mb 时淘汰最久
+    未使用的条目；开启 spill_to_disk 时被淘汰的条目写入缓存文件夹，再次命中时读回。
+    """
+    SPILL_DIR = 'reports'
+
+    def __init__(self, settings=None, cache_dir=None):
+        self.settings = settings or Config.REPORT_CACHE
+        self.spill_dir = os.path.join(cache_dir or Config.FOLDERS['cache'], self.SPILL_DIR)
+        self._entries = OrderedDict()  # 键 -> (结果, 字节数)，按最近使用排序
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def make_key(selected_brands, start_date, end_date, data_version, stores=None):
+        """生成缓存键；品牌和门店的顺序不影响计算结果，排序后参与哈希"""
+        brands = '\x1f'.join(sorted(str(b) for b in selected_brands))
+        raw = f"{data_version}|{pd.Timestamp(start_date).date()}|{pd.Timestamp(end_date).date()}|{brands}"
+        if stores:
+            raw += '|' + '\x1f'.join(sorted(str(s) for s in stores))
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def entry_size(result):
+        """估算一个缓存条目中所有数据表占用的字节数"""
+        frames = [v for v in result.values() if isinstance(v, pd.DataFrame)]
+        frames += list(result.get('weekly_frames', {}).values())
+        return sum(int(df.memory_usage(deep=True).sum()) for df in frames)
+
+    def get(self, key):
+        """读取缓存条目，未命中返回 None"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+        result = self._load_spilled(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.put(key, result)
+        return result
+
+    def put(self, key, result):
+        """写入或更新缓存条目，超出内存上限时淘汰最久未使用的条目"""
+        size = self.entry_size(result)
+        limit = self.settings['max_memory_mb'] * 1024 * 1024
+        evicted = []
+        with self._lock:
+            self._entries[key] = (result, size)
+            self._entries.move_to_end(key)
+            total = sum(s for _, s in self._entries.values())
+            while self._entries and total > limit:
+                old_key, (old_result, old_size) = self._entries.popitem(last=False)
+                evicted.append((old_key, old_result))
+                total -= old_size
+        for old_key, old_result in evicted:
+            self._spill(old_key, old_result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.pkl")
+
+    def _spill(self, key, result):
+        if not self.settings['spill_to_disk']:
+            return
+        path = self._spill_path(key)
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            pd.to_pickle(result, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            self._prune_spilled()
+        except Exception as e:
+            print(f"⚠️ 报表缓存写入磁盘失败: {e}")
+
+    def _load_spilled(self, key):
+        if not self.settings['spill_to_disk']:
+            return None
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            result = pd.read_pickle(path)
+            os.utime(path)
+            print("💽 从磁盘读回报表缓存")
+            return result
+        except Exception as e:
+            print(f"⚠️ 报表缓存文件损坏，将重新计算: {e}")
+            return None
+
+    def _prune_spilled(self):
+        """磁盘上的溢出文件超过 max_disk_mb 时，按最后使用时间删除最旧的文件"""
+        limit = self.settings['max_disk_mb'] * 1024 * 1024
+        files = []
+        for name in os.listdir(self.spill_dir):
+            if name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.spill_dir, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= limit:
+                break
+            try:
+                os.remove(os.path.join(self.spill_dir, name))
+                total -= size
+            except OSError:
+                pass
 
 # ==================== 通用工具 ====================
 EXCEL_FORMATS = {
@@ -86,6 +428,9 @@ EXCEL_FORMATS = {
     'date': 'yyyy-mm-dd'
 }
 
+# 中文字符，按 GBK 字节数估算列宽时使用
+CJK_PATTERN = re.compile('[\u4e00-\u9fff]')
+
 def open_file_or_folder(path):
     """跨平台打开文件或文件夹"""
     try:
@@ -101,14 +446,299 @@ def open_file_or_folder(path):
     except Exception as e:
         messagebox.showerror("错误", f"无法打开路径: {e}")
 
+def warm_up_imports():
+    """在当前（后台）线程完成 pandas、numpy 和 openpyxl 的实际导入"""
+    pd.DataFrame, np.ndarray  # 访问属性即触发惰性模块的导入
+    import openpyxl.chart, openpyxl.styles, openpyxl.worksheet.table  # noqa: F401
+
+class OperationCancelled(Exception):
+    """用户取消了正在进行的数据加载或报表生成"""
+
+class ProgressChannel:
+    """工作线程与 Tk 主循环之间的进度/事件通道
+
+    Tk 不是线程安全的，工作线程只向队列投递消息，由主循环按固定帧率取出：
+    同一帧内的多条进度只保留最后一条，回调按投递顺序在主线程执行。
+    通道同时携带取消标志，工作线程每次汇报进度时检查，实现协作式取消。
+    """
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._cancelled = threading.Event()
+
+    def progress(self, value, status):
+        """汇报进度（任意线程），可直接作为 progress_callback；已请求取消时抛出 OperationCancelled"""
+        self.check()
+        self._queue.put(('progress', (value, status)))
+
+    def post(self, callback, *args):
+        """请求在主线程执行 callback(*args)（任意线程）"""
+        self._queue.put(('call', (callback, args)))
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise OperationCancelled("操作已取消")
+
+    def drain(self):
+        """取出当前积压的全部消息（主线程）
+
+        Returns:
+            tuple: (最新进度 (百分比, 状态文本) 或 None, 按投递顺序排列的 (回调, 参数) 列表)
+        """
+        latest, calls = None, []
+        while True:
+            try:
+                kind, payload = self._queue.get_nowait()
+            except queue.Empty:
+                return latest, calls
+            if kind == 'progress':
+                latest = payload
+            else:
+                calls.append(payload)
+
+# ==================== 消息通知 ====================
+class Notifier(ABC):
+    """错误/警告通知的统一入口
+
+    数据加载和报表生成通过 notifier 报告问题，而不是直接弹出对话框，
+    这样同一套逻辑既能在 GUI 中运行，也能在无界面的批处理中运行。
+    子类实现 notify 决定消息的去向。
+    """
+    def error(self, title, message):
+        self.notify('error', title, message)
+
+    def warning(self, title, message):
+        self.notify('warning', title, message)
+
+    @abstractmethod
+    def notify(self, level, title, message):
+        """发出一条通知；level 为 'error' 或 'warning'"""
+
+class DialogNotifier(Notifier):
+    """GUI 模式：以 Tk 消息框提示
+
+    在工作线程中调用时，若已关联 ProgressChannel，则把消息框转交主线程弹出。
+    """
+    def __init__(self, channel=None):
+        self.channel = channel
+
+    def notify(self, level, title, message):
+        if self.channel is not None and threading.current_thread() is not threading.main_thread():
+            self.channel.post(self.notify, level, title, message)
+            return
+        if level == 'error':
+            messagebox.showerror(title, message)
+        else:
+            messagebox.showwarning(title, message)
+
+class ConsoleNotifier(Notifier):
+    """无界面模式：打印到控制台并记录，供批处理汇总为结构化结果"""
+    def __init__(self):
+        self.messages = []
+
+    def notify(self, level, title, message):
+        self.messages.append({'level': level, 'title': title, 'message': message})
+        print(f"{'❌' if level == 'error' else '⚠️'} {title}: {message}")
+
+# ==================== 运行监测 ====================
+class StageTimer:
+    """分阶段运行监测
+
+    记录每个阶段的墙钟时间、CPU 时间、输入/输出行数，以及 tracemalloc 开启时的内存峰值。
+    阶段可以嵌套，也可以来自同时工作的多个计时器（如基准测试包着报表生成）。
+    tracemalloc 的峰值是全局的：进入子阶段前把外层阶段当前的峰值记入共享栈再重置，
+    退出时外层阶段取两者较大值。
+
+    开启 cProfile 时只分析最外层阶段（cProfile 不能嵌套），保存日志时另存最慢阶段的分析结果。
+    """
+    _peak_stack = []
+
+    def __init__(self, kind, trace_memory=None, profile=None):
+        settings = Config.INSTRUMENTATION
+        self.kind = kind
+        self.trace_memory = settings['trace_memory'] if trace_memory is None else trace_memory
+        self.profile = settings['profile'] if profile is None else profile
+        self.stages = {}
+        self.started = None
+        self.seconds = None
+        self.profile_path = None
+        self._depth = 0
+        self._slowest = None  # (耗时, 阶段名, cProfile.Profile)
+        self._owns_tracing = False
+
+    def start(self):
+        """开始一次运行：记录起始时间，按配置开启 tracemalloc"""
+        self.started = datetime.now()
+        self._wall = time.perf_counter()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+        return self
+
+    def stop(self):
+        if self.started is not None:
+            self.seconds = time.perf_counter() - self._wall
+        if self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+        return self
+
+    @contextlib.contextmanager
+    def stage(self, name, unit='rows'):
+        """计时一个阶段；在 with 块内给 record['rows_in'] / record['rows_out'] 赋值记录行数"""
+        record = {'rows_in': None, 'rows_out': None}
+        stack = StageTimer._peak_stack
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            if stack:
+                stack[-1] = max(stack[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(0)
+        profiler = None
+        if self.profile and self._depth == 0:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # 已有其他分析器在运行
+                profiler = None
+        depth = self._depth
+        self._entry(name, unit, depth)
+        self._depth += 1
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            seconds, cpu_seconds = time.perf_counter() - wall, time.process_time() - cpu
+            self._depth -= 1
+            if profiler is not None:
+                profiler.disable()
+                if self._slowest is None or seconds > self._slowest[0]:
+                    self._slowest = (seconds, name, profiler)
+            peak = stack.pop()
+            if tracing and tracemalloc.is_tracing():
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+            self.add(name, unit, seconds, cpu_seconds, record['rows_in'], record['rows_out'],
+                     round(peak / 1024 ** 2, 1) if tracing else None, depth=depth)
+
+    def _entry(self, name, unit, depth):
+        # 进入阶段时就登记，使结果按阶段开始的顺序排列（外层在前）
+        return self.stages.setdefault(name, {
+            'stage': name, 'depth': depth, 'unit': unit, 'calls': 0, 'seconds': 0.0, 'cpu_seconds': 0.0,
+            'rows_in': None, 'rows_out': None, 'peak_mb': None})
+
+    def add(self, name, unit, seconds, cpu_seconds, rows_in=None, rows_out=None, peak_mb=None, calls=1, depth=0):
+        """累加一个阶段的记录（同名阶段合并次数、耗时和行数）"""
+        entry = self._entry(name, unit, depth)
+        entry['calls'] += calls
+        entry['seconds'] += seconds
+        entry['cpu_seconds'] += cpu_seconds
+        for key, value in (('rows_in', rows_in), ('rows_out', rows_out)):
+            if value is not None:
+                entry[key] = (entry[key] or 0) + int(value)
+        if peak_mb is not None:
+            entry['peak_mb'] = max(entry['peak_mb'] or 0, peak_mb)
+
+    def merge(self, results):
+        """合并其他计时器（如加载子进程）的阶段结果"""
+        for entry in results:
+            self.add(entry['stage'], entry['unit'], entry['seconds'], entry['cpu_seconds'], entry['rows_in'],
+                     entry['rows_out'], entry['peak_mb'], entry['calls'], entry['depth'] + self._depth)
+
+    def wrap(self, obj, method_name, name, count, unit='rows'):
+        """把对象的方法替换为计时版本；count(args, kwargs, 返回值) 给出 (输入行数, 输出行数)"""
+        original = getattr(obj, method_name)
+
+        def timed(*args, **kwargs):
+            with self.stage(name, unit) as record:
+                result = original(*args, **kwargs)
+                record['rows_in'], record['rows_out'] = count(args, kwargs, result)
+            return result
+        setattr(obj, method_name, timed)
+
+    def results(self):
+        """返回各阶段结果列表（按首次进入的顺序），附带按输入（无则按输出）行数计算的吞吐量"""
+        rows = []
+        for entry in self.stages.values():
+            entry = dict(entry, seconds=round(entry['seconds'], 3), cpu_seconds=round(entry['cpu_seconds'], 3))
+            count = entry['rows_in'] if entry['rows_in'] is not None else entry['rows_out']
+            entry['throughput'] = round(count / entry['seconds'], 1) if count and entry['seconds'] > 0 else None
+            rows.append(entry)
+        return rows
+
+    def summary_text(self, title):
+        """多行文本摘要，子阶段按层级缩进"""
+        lines = [f"⏱️ {title}: {self.seconds:.2f}s" if self.seconds is not None else f"⏱️ {title}"]
+        for entry in self.results():
+            parts = [f"{entry['seconds']:.2f}s", f"CPU {entry['cpu_seconds']:.2f}s"]
+            if entry['calls'] > 1:
+                parts.append(f"{entry['calls']} 次")
+            if entry['rows_in'] is not None or entry['rows_out'] is not None:
+                rows_in = f"{entry['rows_in']:,}" if entry['rows_in'] is not None else '-'
+                rows_out = f"{entry['rows_out']:,}" if entry['rows_out'] is not None else '-'
+                parts.append(f"行 {rows_in} → {rows_out}")
+            if entry['peak_mb'] is not None:
+                parts.append(f"峰值 {entry['peak_mb']:,.1f} MB")
+            lines.append(f"{'   ' * (entry['depth'] + 1)}{entry['stage']}: {' | '.join(parts)}")
+        return '\n'.join(lines)
+
+    def summary_line(self, title):
+        """单行摘要：总耗时和最外层阶段的耗时"""
+        parts = [f"{entry['stage']} {entry['seconds']:.2f}s" for entry in self.results() if entry['depth'] == 0]
+        total = f" {self.seconds:.2f}s" if self.seconds is not None else ''
+        return f"⏱️ {title}{total}: {' | '.join(parts)}"
+
+    def save(self, context=None):
+        """把本次运行追加写入 JSON 运行日志；开启 cProfile 时另存最慢阶段的分析结果
+
+        Returns:
+            dict: 写入日志的记录
+        """
+        folder = Config.FOLDERS['cache']
+        started = self.started or datetime.now()
+        if self._slowest is not None:
+            seconds, name, profiler = self._slowest
+            profile_dir = os.path.join(folder, 'profiles')
+            os.makedirs(profile_dir, exist_ok=True)
+            safe_name = re.sub(r'[^\w]+', '_', name)
+            base = os.path.join(profile_dir, f"{self.kind}_{started:%Y%m%d_%H%M%S}_{safe_name}")
+            profiler.dump_stats(base + '.prof')
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(40)
+            self.profile_path = base + '.prof'
+            print(f"🔬 最慢阶段「{name}」({seconds:.2f}s) 的性能分析已保存至 {self.profile_path}")
+        entry = {
+            'kind': self.kind,
+            'started': started.isoformat(timespec='seconds'),
+            'seconds': round(self.seconds, 3) if self.seconds is not None else None,
+            'context': context or {},
+            'stages': self.results(),
+            'profile': self.profile_path,
+        }
+        log_file = Config.INSTRUMENTATION['log_file']
+        if log_file:
+            try:
+                os.makedirs(folder, exist_ok=True)
+                with open(os.path.join(folder, log_file), 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            except OSError as e:
+                print(f"⚠️ 写入运行日志失败: {e}")
+        return entry
+
 # ==================== 数据处理 ====================
 class DataProcessor:
     """数据加载、清洗和列名查找
 
     该类负责从Excel文件加载数据，进行清洗和列映射。
     """
-    def __init__(self) -> None:
-        pass  # 移除缓存管理器
+    def __init__(self, notifier=None) -> None:
+        self.cache_manager = CacheManager()
+        self.notifier = notifier or DialogNotifier()
     
     @staticmethod
     def clean_numeric_column(series: pd.Series, remove_chars: list[str] = None) -> pd.Series:
@@ -141,39 +771,348 @@ class DataProcessor:
                 return name
         return None
 
-    def load_excel_with_mapping(self, file_path_or_pattern, dtype_mapping=None, chunked=False):
-        # 直接从文件加载，不使用缓存
+    @staticmethod
+    def source_columns(source, header=None):
+        """按 Config.SOURCE_COLUMNS 解析源文件需要读取的列
+
+        Args:
+            source (str): 源文件类型（SOURCE_COLUMNS 的键）
+            header (list, optional): 表头列名；给定时每个映射只取表头中第一个匹配的候选列，
+                结果按表头顺序排列；否则返回全部候选列名. Defaults to None.
+
+        Returns:
+            tuple: (列名列表, 按字符串读取的列类型映射)；未开启列裁剪时列名列表为 None（读取全部列），
+                没有该类型的配置时为 (None, {})
+        """
+        settings = Config.SOURCE_COLUMNS
+        spec = settings.get(source) if source else None
+        if not spec:
+            return None, {}
+
+        def resolve(candidates):
+            if header is None:
+                return list(candidates)
+            return [next((name for name in candidates if name in header), None)]
+
+        groups = [Config.COLUMN_MAPPINGS[key] for key in spec.get('mappings', [])]
+        if spec.get('dates'):
+            groups.append(Config.DATE_COLUMNS[spec['dates']])
+        groups.extend([name] for name in spec.get('columns', []))
+        columns = list(dict.fromkeys(name for group in groups for name in resolve(group) if name is not None))
+        if header is not None:
+            columns.sort(key=list(header).index)
+        str_cols = [name for key in spec.get('str', []) for name in resolve(Config.COLUMN_MAPPINGS[key]) if name is not None]
+        if not settings.get('enabled'):
+            return None, {name: str for name in str_cols}
+        return columns, {name: str for name in str_cols if name in columns}
+
+    @staticmethod
+    def compact_frame(df):
+        """按 Config.COMPACT_SCHEMA 将预处理后的数据表转换为紧凑列类型（就地修改并返回）
+
+        Args:
+            df (pd.DataFrame): 预处理后的销售、货流或盘点数据
+
+        Returns:
+            pd.DataFrame: 转换后的数据表
+        """
+        schema = Config.COMPACT_SCHEMA
+        if not schema['enabled'] or df.empty:
+            return df
+        C = Config.STD_COLS
+        category_cols = {C.get(name, name) for name in schema['category']}
+        float32_cols = {C.get(name, name) for name in schema['float32']}
+
+        for col in df.columns:
+            series = df[col]
+            if col in category_cols:
+                if not isinstance(series.dtype, pd.CategoricalDtype):
+                    df[col] = series.astype('category')
+            elif col in float32_cols:
+                if series.dtype == np.float64:
+                    narrowed = series.astype(np.float32)
+                    # 只有全部取值都能被 float32 精确表示时才收窄，避免改变数量
+                    if np.array_equal(narrowed.to_numpy(dtype=np.float64), series.to_numpy(), equal_nan=True):
+                        df[col] = narrowed
+            elif series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) == 'string':
+                if series.nunique() <= len(series) * schema['category_ratio']:
+                    df[col] = series.astype('category')
+                else:
+                    try:
+                        df[col] = series.astype('string[pyarrow]')
+                    except ImportError:
+                        pass  # 未安装 pyarrow 时保留对象列
+        return df
+
+    @staticmethod
+    def normalize_barcodes(values):
+        """规范化条码文本：去除首尾空白，并还原被 Excel 存成浮点数或科学计数法的条码
+
+        例如 '6901234567890.0' 和 '6.90123456789E+12' 都还原为 '6901234567890'。
+
+        Args:
+            values (array-like): 条码
+
+        Returns:
+            np.ndarray: 规范化后的条码字符串（object 数组）
+        """
+        s = pd.Series(values, dtype=object).astype(str).str.strip()
+        float_like = s.str.fullmatch(r'\d+\.0*')
+        s[float_like] = s[float_like].str.split('.').str[0]
+        scientific = s.str.fullmatch(r'\d+(\.\d+)?[eE]\+?\d+')
+        if scientific.any():
+            def expand(text):
+                try:
+                    return str(int(Decimal(text)))
+                except (InvalidOperation, ValueError):
+                    return text
+            s[scientific] = s[scientific].map(expand)
+        return s.to_numpy(dtype=object)
+
+    @staticmethod
+    def share_barcode_dictionary(data_frames):
+        """为四个数据表的条码列建立一份共享的条码字典（就地修改）
+
+        各表的条码列统一转换为同一个 CategoricalDtype，之后的分组、筛选和台账
+        都可以直接使用整数编码；规范化只作用于每个表的不同条码值，而不是逐行处理。
+
+        Returns:
+            pd.CategoricalDtype | None: 共享的条码类型，没有任何条码列时为 None
+        """
+        C, M = Config.STD_COLS, Config.COLUMN_MAPPINGS
+        columns = []
+        for key, df in data_frames.items():
+            if df is None or df.empty:
+                continue
+            col = DataProcessor.find_column(df, M['barcode']) if key == 'product' else C['BARCODE']
+            if col in df.columns:
+                series = df[col]
+                cat = series.array if isinstance(series.dtype, pd.CategoricalDtype) else pd.Categorical(series.astype(str))
+                columns.append((df, col, cat, DataProcessor.normalize_barcodes(cat.categories)))
+        if not columns:
+            return None
+
+        categories = pd.Index(sorted(set().union(*(normalized for *_, normalized in columns))), dtype=object)
+        dtype = pd.CategoricalDtype(categories)
+        for df, col, cat, normalized in columns:
+            mapping = categories.get_indexer(normalized)
+            codes = np.asarray(cat.codes)
+            df[col] = pd.Categorical.from_codes(np.where(codes >= 0, mapping[codes.clip(0)], -1), dtype=dtype)
+        print(f"🔑 共享条码字典: {len(categories)} 个条码")
+        return dtype
+
+    @staticmethod
+    def record_dropped_rows(df, counts):
+        """在 df.attrs['dropped_rows'] 中按原因累加预处理丢弃的行数（随数据一起缓存）"""
+        dropped = dict(df.attrs.get('dropped_rows', {}))
+        for reason, count in counts.items():
+            if count:
+                dropped[reason] = dropped.get(reason, 0) + int(count)
+        if dropped:
+            df.attrs['dropped_rows'] = dropped
+        return df
+
+    @staticmethod
+    def concat_frames(frames):
+        """合并分批预处理的结果，并汇总各批记录的丢弃行数"""
+        df = pd.concat(frames, ignore_index=True)
+        df.attrs = {}
+        for frame in frames:
+            DataProcessor.record_dropped_rows(df, frame.attrs.get('dropped_rows', {}))
+        return df
+
+    @staticmethod
+    def barcode_mask(series, barcodes):
+        """返回条码列中属于给定条码集合的行（布尔数组）
+
+        条码列为字典编码时按整数编码查表，否则退回字符串比较。
+        """
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories
+            wanted = categories.get_indexer(pd.Index(pd.unique(np.asarray(barcodes, dtype=object))))
+            # 多留一个位置给编码 -1（空值），始终为 False
+            table = np.zeros(len(categories) + 1, dtype=bool)
+            table[wanted[wanted >= 0]] = True
+            return table[series.cat.codes.to_numpy()]
+        return series.astype(str).isin(barcodes).to_numpy()
+
+    @staticmethod
+    def resolve_file_path(file_path_or_pattern):
+        """相对路径在当前目录不存在时，尝试在主数据文件夹中查找"""
         file_path = file_path_or_pattern
-        if not os.path.isabs(file_path) and not os.path.exists(file_path):
+        if file_path and not os.path.isabs(file_path) and not os.path.exists(file_path):
             full_path = os.path.join(Config.FOLDERS['data'], file_path)
             if os.path.exists(full_path):
                 file_path = full_path
+        return file_path
+
+    def load_excel_with_mapping(self, file_path_or_pattern, dtype_mapping=None, chunked=False, prep_func=None, source=None):
+        """加载Excel文件
+
+        Args:
+            file_path_or_pattern (str): 文件路径或主数据文件夹中的文件名
+            dtype_mapping (dict, optional): 列类型映射. Defaults to None.
+            chunked (bool, optional): 大文件是否流式分批读取. Defaults to False.
+            prep_func (callable, optional): 预处理函数；分批读取时逐批调用. Defaults to None.
+            source (str, optional): 源文件类型，给定时按 Config.SOURCE_COLUMNS 只读取需要的列. Defaults to None.
+
+        Returns:
+            pd.DataFrame: 加载（并预处理）后的数据
+        """
+        # 直接从文件加载；预处理结果的缓存由 CacheManager 负责
+        file_path = self.resolve_file_path(file_path_or_pattern)
         if not os.path.exists(file_path):
             print(f"⚠️ 文件不存在: {file_path}")
             return pd.DataFrame()
         try:
-            if chunked and os.path.getsize(file_path) > 50 * 1024 * 1024:  # >50MB
-                df = self.load_excel_chunked(file_path, dtype_mapping)
+            if chunked and os.path.getsize(file_path) > Config.CHUNKED_LOAD['threshold_mb'] * 1024 * 1024:
+                df = self.load_excel_chunked(file_path, dtype_mapping, Config.CHUNKED_LOAD['chunk_size'], prep_func, source)
             else:
-                df = pd.read_excel(file_path, dtype=dtype_mapping or {})
+                usecols, str_dtypes = self.source_columns(source)
+                batches = []
+                if usecols and file_path.lower().endswith(('.xlsx', '.xlsm')):
+                    # 裁剪列时用只读模式逐行解析，只为需要的列组装数据（整个文件组装为一个批次）；
+                    # pd.read_excel 会先把所有列都转换成表再按 usecols 丢弃，省不下解析开销
+                    batches = list(self.iter_excel_batches(file_path, dtype_mapping, sys.maxsize, source=source))
+                if batches:
+                    df = batches[0]
+                else:
+                    # .xls 或没有数据行时仍用 pd.read_excel，只保留所有候选列名，由预处理按候选顺序取用
+                    wanted = set(usecols or ())
+                    df = pd.read_excel(file_path, dtype={**(dtype_mapping or {}), **str_dtypes},
+                                       usecols=(lambda name: name in wanted) if usecols else None)
+                if prep_func:
+                    df = prep_func(df)
             print(f"✅ 成功加载: {os.path.basename(file_path)} ({len(df)} 条记录)")
             return df
         except Exception as e:
-            messagebox.showerror("文件加载错误", f"加载文件 '{os.path.basename(file_path)}' 时出错:\n{e}")
+            self.notifier.error("文件加载错误", f"加载文件 '{os.path.basename(file_path)}' 时出错:\n{e}")
             return pd.DataFrame()
 
     @staticmethod
-    def load_excel_chunked(file_path, dtype_mapping=None, chunk_size=50000):
-        """分块读取大文件"""
+    def load_excel_chunked(file_path, dtype_mapping=None, chunk_size=50000, prep_func=None, source=None):
+        """流式读取大文件
+
+        pd.read_excel 不支持分块读取，这里用 openpyxl 只读模式逐行解析，
+        每 chunk_size 行组装为一个批次并立即预处理，只保留预处理后的结果，
+        避免同时持有原始对象表和多份清洗副本。
+        """
+        print(f"📦 文件大于{Config.CHUNKED_LOAD['threshold_mb']}MB，开始流式加载: {os.path.basename(file_path)}")
         chunks = []
-        print(f"📦 文件大于50MB，开始分块加载: {os.path.basename(file_path)}")
-        for i, chunk in enumerate(pd.read_excel(file_path, chunksize=chunk_size, dtype=dtype_mapping or {})):
+        for i, chunk in enumerate(DataProcessor.iter_excel_batches(file_path, dtype_mapping, chunk_size, source=source)):
             print(f"  - 加载块 {i+1}...")
-            chunks.append(chunk)
-        df = pd.concat(chunks, ignore_index=True)
+            chunks.append(prep_func(chunk) if prep_func else chunk)
+        if not chunks:
+            return pd.DataFrame()
+        df = DataProcessor.concat_frames(chunks)
         print(f"✅ 分块加载完成: {len(df)} 条记录")
         return df
 
+    @staticmethod
+    def iter_excel_batches(file_path, dtype_mapping=None, chunk_size=50000, skip_rows=0, expected=None, row_state=None,
+                           source=None):
+        """逐批产出首个工作表的数据
+
+        Args:
+            file_path (str): Excel 文件路径
+            dtype_mapping (dict, optional): 需要按字符串读取的列. Defaults to None.
+            chunk_size (int, optional): 每批行数. Defaults to 50000.
+            skip_rows (int, optional): 跳过表头之后的前若干数据行（不组装、不产出）. Defaults to 0.
+            expected (dict, optional): 上次读取记录的 row_state；跳过的行须与之完全一致
+                （表头、首/末行及全部行的摘要），否则说明历史数据被改写，抛出 ValueError. Defaults to None.
+            row_state (dict, optional): 输出参数，记录表头、数据行数、首/末行内容及全部行的摘要. Defaults to None.
+            source (str, optional): 源文件类型；给定时先读表头，按 Config.SOURCE_COLUMNS 解析出需要的列，
+                只组装这些列（表头校验和行摘要仍覆盖整行）. Defaults to None.
+
+        Yields:
+            pd.DataFrame: 每批数据，列名取自表头行
+        """
+        from openpyxl import load_workbook
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = DataProcessor._make_unique_columns(header)
+            width = len(columns)
+            if expected and expected.get('header') != [str(c) for c in columns]:
+                raise ValueError("表头已变化")
+            selected, str_dtypes = DataProcessor.source_columns(source, columns)
+            selected = selected if selected is not None else columns
+            indices = [columns.index(c) for c in selected]
+            str_cols = [c for c, t in {**(dtype_mapping or {}), **str_dtypes}.items() if t is str and c in selected]
+            buffers = [[] for _ in selected]
+            count = seen = 0
+            first_row = last_row = None
+            digest = hashlib.sha1() if (row_state is not None or expected) else None
+            for row in rows:
+                if not any(v is not None for v in row):
+                    continue  # 与 pd.read_excel 一致，跳过空行
+                seen += 1
+                last_row = row
+                if digest:
+                    digest.update(repr(row[:width]).encode('utf-8'))
+                if seen == 1:
+                    first_row = row
+                if seen <= skip_rows:
+                    if expected and seen in (1, skip_rows):
+                        key = 'first_row' if seen == 1 else 'last_row'
+                        if DataProcessor._row_signature(row, width) != expected.get(key):
+                            raise ValueError(f"第 {seen} 行数据与上次加载时不一致")
+                    if expected and seen == skip_rows and digest.hexdigest() != expected.get('rows_hash'):
+                        raise ValueError(f"前 {skip_rows} 行数据与上次加载时不一致")
+                    continue
+                n = len(row)
+                for buf, i in zip(buffers, indices):
+                    buf.append(row[i] if i < n else None)
+                count += 1
+                if count == chunk_size:
+                    yield DataProcessor._buffers_to_frame(selected, buffers, str_cols)
+                    buffers = [[] for _ in selected]
+                    count = 0
+            if seen < skip_rows:
+                raise ValueError(f"数据行数由 {skip_rows} 减少为 {seen}")
+            if row_state is not None:
+                row_state.update({
+                    'header': [str(c) for c in columns], 'rows': seen,
+                    'first_row': DataProcessor._row_signature(first_row, width),
+                    'last_row': DataProcessor._row_signature(last_row, width),
+                    'rows_hash': digest.hexdigest()
+                })
+            if count:
+                yield DataProcessor._buffers_to_frame(selected, buffers, str_cols)
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _row_signature(row, width):
+        if row is None:
+            return None
+        return [None if v is None else str(v) for v in row[:width]]
+
+    @staticmethod
+    def _make_unique_columns(header):
+        columns, seen = [], {}
+        for i, name in enumerate(header):
+            name = f"Unnamed: {i}" if name is None else name
+            if name in seen:
+                seen[name] += 1
+                name = f"{name}.{seen[name]}"
+            else:
+                seen[name] = 0
+            columns.append(name)
+        return columns
+
+    @staticmethod
+    def _buffers_to_frame(columns, buffers, str_cols):
+        # 每列缓冲区一次性转换为带类型的列，字符串列中整数值浮点数去掉小数部分
+        df = pd.DataFrame({col: pd.Series(buf, dtype=object) for col, buf in zip(columns, buffers)}).infer_objects()
+        for col in str_cols:
+            df[col] = df[col].map(lambda v: str(int(v)) if isinstance(v, float) and v.is_integer() else str(v),
+                                  na_action='ignore')
+        return df
+
     @staticmethod
     def find_file_in_data_folder(pattern):
         data_folder = Config.FOLDERS['data']
@@ -191,9 +1130,242 @@ class DataProcessor:
             print(f"❌ 查找文件失败 ({pattern}): {e}")
             return None
 
+class SalesIndex:
+    """销售数据的时间索引
+
+    保存按销售时间稳定排序后的时间数组，时间窗口 [开始, 结束] 通过两次二分查找
+    得到。销售流水通常按时间追加，此时窗口就是原表的一段连续行，直接切片；
+    原表无序时借助排序排列取行，并按原行顺序返回，使后续汇总的累加顺序不变。
+    另有按 (条码, 时间) 排序的行号排列和每个条码的起止偏移，用于只取少量商品的行。
+    """
+    _instances = {}
+
+    def __init__(self, sales_df):
+        C = Config.STD_COLS
+        self.df = sales_df
+        times = sales_df[C['SALES_TIME']].to_numpy(dtype='datetime64[ns]')
+        self._times = times
+        if sales_df[C['SALES_TIME']].is_monotonic_increasing:
+            self._order = None
+            self._sorted_times = times
+        else:
+            # NaT 排在最后，不会落入任何时间窗口
+            self._order = np.argsort(times, kind='stable')
+            self._sorted_times = times[self._order]
+        self._valid_rows = len(times) - int(np.isnat(times).sum())
+        self._barcode_order = None
+        self._barcode_offsets = None
+
+    @classmethod
+    def for_frame(cls, sales_df):
+        """获取（或创建）某个销售数据表的索引；数据表被替换或长度变化后自动重建"""
+        key = id(sales_df)
+        entry = cls._instances.get(key)
+        if entry is not None and entry[0]() is sales_df and len(entry[1].df) == len(sales_df):
+            return entry[1]
+        index = cls(sales_df)
+        cls._instances = {k: v for k, v in cls._instances.items() if v[0]() is not None}
+        cls._instances[key] = (weakref.ref(sales_df), index)
+        return index
+
+    def bounds(self, start=None, end=None):
+        """返回 [start, end]（均含）时间窗口在排序后时间数组中的范围 (lo, hi)"""
+        times = self._sorted_times
+        lo = np.searchsorted(times, np.datetime64(pd.Timestamp(start), 'ns'), side='left') if start is not None else 0
+        hi = np.searchsorted(times, np.datetime64(pd.Timestamp(end), 'ns'), side='right') if end is not None else self._valid_rows
+        return int(lo), int(max(min(hi, self._valid_rows), lo))
+
+    def window(self, start=None, end=None):
+        """取 [start, end] 时间窗口内的销售记录，行顺序与原表一致"""
+        lo, hi = self.bounds(start, end)
+        if self._order is None:
+            return self.df.iloc[lo:hi]
+        return self.df.iloc[np.sort(self._order[lo:hi])]
+
+    def _build_barcode_index(self):
+        codes = self.df[Config.STD_COLS['BARCODE']].cat.codes.to_numpy()
+        # 同一条码内按时间排序，时间相同时保持原行顺序
+        self._barcode_order = np.lexsort((self._times, codes))
+        n_missing = int((codes < 0).sum())
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.df[Config.STD_COLS['BARCODE']].cat.categories))
+        self._barcode_offsets = np.r_[n_missing, n_missing + np.cumsum(counts)]
+
+    def select(self, barcodes, start=None, end=None):
+        """取指定条码在 [start, end] 时间窗口内的销售记录，行顺序与原表一致
+
+        所选商品的总行数少于时间窗口的行数时，按条码行号范围逐个二分查找；
+        否则先按时间取窗口，再按条码筛选。
+        """
+        C = Config.STD_COLS
+        lo, hi = self.bounds(start, end)
+        if isinstance(self.df[C['BARCODE']].dtype, pd.CategoricalDtype) and hi > lo:
+            if self._barcode_order is None:
+                self._build_barcode_index()
+            codes = self.df[C['BARCODE']].cat.categories.get_indexer(pd.Index(pd.unique(np.asarray(barcodes, dtype=object))))
+            codes = codes[codes >= 0]
+            offsets = self._barcode_offsets
+            if (offsets[codes + 1] - offsets[codes]).sum() < hi - lo:
+                first, last = self._sorted_times[lo], self._sorted_times[hi - 1]
+                rows = []
+                for code in codes:
+                    segment = self._barcode_order[offsets[code]:offsets[code + 1]]
+                    segment_times = self._times[segment]
+                    a = np.searchsorted(segment_times, first, side='left')
+                    b = np.searchsorted(segment_times, last, side='right')
+                    rows.append(segment[a:b])
+                positions = np.sort(np.concatenate(rows)) if rows else np.array([], dtype=np.int64)
+                return self.df.iloc[positions]
+        window = self.window(start, end)
+        return window[DataProcessor.barcode_mask(window[C['BARCODE']], barcodes)]
+
+class SalesRollup:
+    """销售日汇总立方体 (条码 × 日)
+
+    数据加载后把销售流水按 (条码, 日) 预先汇总为销售额、销量和订单数，
+    报表的总计、周度列、工作日/周末拆分和图表都是按日可加的量，直接对
+    所选日期范围内的日汇总行求和即可，无需再聚合原始流水。
+
+    订单数只有在没有任何订单跨日时才可按日相加；否则日汇总不含订单数列，
+    订单数改由 DistinctOrderIndex 统计。日汇总按日期排序，可用 SalesIndex 切片。
+    销售数据有门店列时按 (条码, 日, 门店) 汇总，报表可再按门店筛选。
+    """
+    ORDER_COUNT = '订单数'
+    # 汇总结果保留的小数位：与报表金额格式一致，消除求和顺序不同带来的浮点尾差
+    DECIMALS = 2
+
+    @classmethod
+    def round_totals(cls, values):
+        """按报表精度取整求和结果，使日汇总路径与流水路径得到逐位相同的数值"""
+        return values.round(cls.DECIMALS)
+
+    @staticmethod
+    def build(sales_df):
+        """由销售流水构建日汇总
+
+        Args:
+            sales_df (pd.DataFrame): 预处理后的销售数据
+
+        Returns:
+            pd.DataFrame | None: 日汇总（条码、销售时间(当日零点)、[门店]、实收金额、销售数量、[订单数]），
+                销售数据为空或缺少必要列时返回 None
+        """
+        C = Config.STD_COLS
+        required = [C['BARCODE'], C['SALES_TIME'], C['REVENUE'], C['SALES_QTY'], C['ORDER_ID']]
+        if sales_df is None or sales_df.empty or any(col not in sales_df.columns for col in required):
+            return None
+        started = time.perf_counter()
+        days = sales_df[C['SALES_TIME']].dt.normalize()
+        keys = [sales_df[C['BARCODE']], days] + ([sales_df[C['STORE']]] if C['STORE'] in sales_df.columns else [])
+        grouped = sales_df.groupby(keys, observed=True, sort=False)
+        parts = [grouped[C['REVENUE']].sum(), grouped[C['SALES_QTY']].sum()]
+        daily_orders = grouped[C['ORDER_ID']].nunique()
+        # 每日去重数之和等于整体去重数，说明没有订单跨日，订单数可按日相加
+        if daily_orders.sum() == sales_df.groupby(C['BARCODE'], observed=True)[C['ORDER_ID']].nunique().sum():
+            parts.append(daily_orders.rename(SalesRollup.ORDER_COUNT))
+        else:
+            print("ℹ️ 存在跨日订单，订单数将由订单去重索引统计")
+        daily = pd.concat(parts, axis=1).reset_index()
+        daily = daily.sort_values([C['SALES_TIME'], C['BARCODE']], kind='stable', ignore_index=True)
+        print(f"🧊 销售日汇总完成: {len(sales_df)} 条流水 -> {len(daily)} 行 ({time.perf_counter() - started:.2f}s)")
+        return daily
+
+    @staticmethod
+    def order_counts(order_rows, daily_sales, keys, approximate=False):
+        """按 keys 分组统计订单数
+
+        日汇总含订单数列时对每日订单数求和，否则对订单行（订单去重索引或原始流水）
+        去重计数，见 DistinctOrderIndex.count。
+        """
+        if daily_sales is not None and SalesRollup.ORDER_COUNT in daily_sales.columns:
+            return daily_sales.groupby(keys, observed=True)[SalesRollup.ORDER_COUNT].sum()
+        return DistinctOrderIndex.count(order_rows, keys, approximate)
+
+class DistinctOrderIndex:
+    """订单去重索引 (条码 × 日 × 流水号)
+
+    流水号去重数不能按日相加。本索引保存每个 (条码, 日) 出现过的流水号集合
+    （展开为去重后的行），任意日期范围的订单数等于范围内各日集合的并集大小，
+    即对切片后的行按商品再去重计数，行数少于原始流水且只有三列。
+
+    每行另存流水号的哈希值。近似模式只保留哈希值落在抽样比例内的订单：
+    同一流水号在任何日期都被一致地保留或舍弃，因此抽样集合同样可以跨日合并，
+    去重数除以抽样比例即为估计值。
+    """
+    HASH = '订单哈希'
+
+    @staticmethod
+    def build(sales_df, daily_df):
+        """构建订单去重索引；日汇总的订单数已可按日相加时不需要，返回 None"""
+        C = Config.STD_COLS
+        if daily_df is None or SalesRollup.ORDER_COUNT in daily_df.columns:
+            return None
+        started = time.perf_counter()
+        orders = sales_df[C['ORDER_ID']]
+        if not isinstance(orders.dtype, pd.CategoricalDtype):
+            orders = orders.astype('category')
+        columns = {
+            C['BARCODE']: sales_df[C['BARCODE']],
+            C['SALES_TIME']: sales_df[C['SALES_TIME']].dt.normalize(),
+            C['ORDER_ID']: orders,
+        }
+        if C['STORE'] in sales_df.columns:
+            columns[C['STORE']] = sales_df[C['STORE']]
+        index = pd.DataFrame(columns).drop_duplicates()
+        hashes = pd.util.hash_pandas_object(pd.Series(orders.cat.categories), index=False).to_numpy()
+        codes = index[C['ORDER_ID']].cat.codes.to_numpy()
+        index[DistinctOrderIndex.HASH] = np.where(codes >= 0, hashes[codes.clip(0)], np.iinfo(np.uint64).max)
+        index = index.sort_values(C['SALES_TIME'], kind='stable', ignore_index=True)
+        print(f"🧮 订单去重索引完成: {len(index)} 行 ({time.perf_counter() - started:.2f}s)")
+        return index
+
+    @staticmethod
+    def count(order_rows, keys, approximate=False):
+        """按 keys 分组统计去重订单数
+
+        Args:
+            order_rows (pd.DataFrame): 订单去重索引切片或原始销售流水
+            keys (str | list): 分组列
+            approximate (bool, optional): 允许抽样估算（还需配置开启且日期跨度足够长）. Defaults to False.
+
+        Returns:
+            pd.Series: 各分组的订单数
+        """
+        C, settings = Config.STD_COLS, Config.DISTINCT_ORDERS
+        rows = order_rows
+        if approximate and settings['approximate'] and DistinctOrderIndex.HASH in rows.columns and not rows.empty:
+            times = rows[C['SALES_TIME']]
+            if (times.max() - times.min()).days + 1 >= settings['approximate_min_days']:
+                rate = settings['sample_rate']
+                threshold = np.uint64(min(int(rate * 2 ** 64), 2 ** 64 - 1))
+                sampled = rows[rows[DistinctOrderIndex.HASH].to_numpy() < threshold]
+                sampled = sampled.groupby(keys, observed=True)[C['ORDER_ID']].nunique()
+                large = sampled[sampled >= settings['min_sampled_orders']]
+                if not large.empty:
+                    row_keys = pd.MultiIndex.from_frame(rows[keys]) if isinstance(keys, list) else pd.Index(rows[keys])
+                    exact = rows[~row_keys.isin(large.index)].groupby(keys, observed=True)[C['ORDER_ID']].nunique()
+                    estimate = (large / rate).round().astype(exact.dtype)
+                    print(f"📐 {len(large)} 个分组的订单数按 {rate:.2%} 抽样估算")
+                    return pd.concat([exact, estimate]).sort_index()
+        return rows.groupby(keys, observed=True)[C['ORDER_ID']].nunique()
+
 class InventoryCalculator:
     def __init__(self, data_processor):
         self.data_processor = data_processor
+        self._ledger_key, self._ledger = None, None
+
+    def get_ledger(self, flow_df, check_df, sales_df):
+        """获取库存台账；同一组数据只构建一次
+
+        Returns:
+            InventoryLedger | None: 货流数据缺少日期列时无法按日期截止，返回 None
+        """
+        if not flow_df.empty and '日期' not in flow_df.columns:
+            return None
+        key = tuple((id(df), len(df)) for df in (flow_df, check_df, sales_df))
+        if self._ledger_key != key:
+            self._ledger = InventoryLedger(flow_df, check_df, sales_df)
+            self._ledger_key = key
+        return self._ledger
 
     # V7.0 MODIFIED: 移除缓存机制，直接计算
     def calculate_inventory(self, product_barcodes, flow_df, check_df, sales_df, end_date=None):
@@ -204,15 +1376,15 @@ class InventoryCalculator:
         if end_date:
             end_date_inclusive = datetime.combine(end_date, datetime.max.time())
             if not sales_df.empty and C['SALES_TIME'] in sales_df.columns:
-                sales_df = sales_df[sales_df[C['SALES_TIME']] <= end_date_inclusive].copy()
+                sales_df = SalesIndex.for_frame(sales_df).window(end=end_date_inclusive).copy()
             if not flow_df.empty and '日期' in flow_df.columns:
                 flow_df = flow_df[flow_df['日期'] <= end_date_inclusive].copy()
             if not check_df.empty and '日期' in check_df.columns:
                 check_df = check_df[check_df['日期'] <= end_date_inclusive].copy()
 
-        flow_s = flow_df.groupby(C['BARCODE'])['库存变动量'].sum() if not flow_df.empty else pd.Series(name='库存变动量')
-        sales_s = sales_df.groupby(C['BARCODE'])[C['SALES_QTY']].sum() if not sales_df.empty else pd.Series(name=C['SALES_QTY'])
-        check_s = check_df.groupby(C['BARCODE'])['差异库存'].sum() if not check_df.empty else pd.Series(name='差异库存')
+        flow_s = flow_df.groupby(C['BARCODE'], observed=True)['库存变动量'].sum() if not flow_df.empty else pd.Series(name='库存变动量')
+        sales_s = sales_df.groupby(C['BARCODE'], observed=True)[C['SALES_QTY']].sum() if not sales_df.empty else pd.Series(name=C['SALES_QTY'])
+        check_s = check_df.groupby(C['BARCODE'], observed=True)['差异库存'].sum() if not check_df.empty else pd.Series(name='差异库存')
         
         inventory_df = pd.DataFrame({C['BARCODE']: product_barcodes}).set_index(C['BARCODE'])
         inventory_df = inventory_df.join(flow_s).join(sales_s).join(check_s).fillna(0).reset_index()
@@ -221,7 +1393,7 @@ class InventoryCalculator:
         
         last_inbound_info = self._get_last_inbound_info(flow_df, product_barcodes)
         inventory_df = inventory_df.merge(last_inbound_info, on=C['BARCODE'], how='left')
-        inventory_df[C['REMARK']] = inventory_df.apply(lambda row: self._get_remark(row, flow_df), axis=1).fillna('')
+        inventory_df[C['REMARK']] = self._get_remarks(inventory_df, flow_df)
         
         print(f"✅ 库存计算完成: {len(inventory_df)} 个商品")
         result = inventory_df[[C['BARCODE'], C['STOCK'], C['LAST_INBOUND_DATE'], C['REMARK']]]
@@ -235,77 +1407,367 @@ class InventoryCalculator:
         if inbound_records.empty:
             return pd.DataFrame({C['BARCODE']: product_barcodes, C['LAST_INBOUND_DATE']: ''})
         inbound_records['日期'] = pd.to_datetime(inbound_records['日期'])
-        last_inbound = inbound_records.loc[inbound_records.groupby(C['BARCODE'])['日期'].idxmax()]
+        last_inbound = inbound_records.loc[inbound_records.groupby(C['BARCODE'], observed=True)['日期'].idxmax()]
         last_inbound[C['LAST_INBOUND_DATE']] = last_inbound.apply(
             lambda r: f"{r['日期'].strftime('%Y-%m-%d')} ({int(r['库存变动量'])}件)", axis=1)
         return last_inbound[[C['BARCODE'], C['LAST_INBOUND_DATE']]]
 
-    def _get_remark(self, row, flow_df) -> str:
-        """获取备注：检查商品是否可能已退库
+    def _get_remarks(self, inventory_df, flow_df) -> pd.Series:
+        """批量获取备注：检查商品是否可能已退库
+
+        库存不大于0、且该条码按日期排序后的最后一条货流记录为减库存时，提示可能已退库。
+        对全部货流做一次稳定排序并取每个条码的最后一条记录，代替逐个条码筛选排序。
 
         Args:
-            row (pd.Series): 当前行数据
+            inventory_df (pd.DataFrame): 含条码和库存量的库存数据
             flow_df (pd.DataFrame): 库存流动数据
 
         Returns:
-            str: 备注信息
+            pd.Series: 与 inventory_df 行对齐的备注信息
+        """
+        C = Config.STD_COLS
+        remarks = pd.Series('', index=inventory_df.index, dtype=object)
+        if flow_df.empty or inventory_df.empty:
+            return remarks
+        is_candidate = inventory_df[C['STOCK']] <= 0
+        candidate_flow = flow_df[flow_df[C['BARCODE']].isin(inventory_df.loc[is_candidate, C['BARCODE']])]
+        has_date = '日期' in candidate_flow.columns
+        ordered = candidate_flow.sort_values('日期', kind='mergesort') if has_date else candidate_flow
+        last_records = ordered.drop_duplicates(subset=C['BARCODE'], keep='last')
+        returned = set(last_records.loc[last_records['库存变动量'] < 0, C['BARCODE']])
+
+        if has_date:
+            # 最后日期有多条记录且增减方向不一致时，结果取决于原逐条码 sort_values 的排序实现，
+            # 这类条码（通常极少）仍按原方式单独判断，保证与逐行计算的结果一致
+            last_dates = ordered[C['BARCODE']].map(last_records.set_index(C['BARCODE'])['日期'])
+            tied = ordered[ordered['日期'] == last_dates]
+            tied_range = tied.groupby(C['BARCODE'], observed=True)['库存变动量'].agg(['min', 'max'])
+            ambiguous = tied_range[(tied_range['min'] < 0) & (tied_range['max'] >= 0)].index
+            if len(ambiguous):
+                ambiguous_flow = candidate_flow[candidate_flow[C['BARCODE']].isin(ambiguous)]
+                group_rows = ambiguous_flow.groupby(C['BARCODE'], observed=True).indices
+            for barcode in ambiguous:
+                last_record = ambiguous_flow.iloc[group_rows[barcode]].sort_values('日期').iloc[-1]
+                if last_record['库存变动量'] < 0:
+                    returned.add(barcode)
+                else:
+                    returned.discard(barcode)
+
+        remarks[is_candidate & inventory_df[C['BARCODE']].isin(returned)] = '商品可能已退库'
+        return remarks
+
+class InventoryLedger:
+    """按条码累计的库存台账
+
+    将货流、销售、盘点三类库存变动按 (条码, 时间) 排序后一次性累计。之后任意一组
+    (条码, 截止日期) 的库存量、最后进货日和退库备注都通过一次二分查找得到，
+    周度报表不必为每一周重新筛选全部历史数据。结果与 calculate_inventory(end_date=...) 一致。
+    """
+    # 没有日期的记录（盘点数据缺少日期列时）使用的天序号，早于任何真实日期，始终计入；
+    # 直接以整数表示，不经过 datetime64[ns]（其表示范围之外的哨兵日期转换时会溢出）
+    UNDATED_DAY = -(1 << 38)
+
+    def __init__(self, flow_df, check_df, sales_df):
+        print("📒 正在构建库存台账...")
+        C = Config.STD_COLS
+        frames = [df[C['BARCODE']] for df in (flow_df, check_df, sales_df) if not df.empty]
+        dtypes = {series.dtype for series in frames}
+        if len(dtypes) == 1 and isinstance(frames[0].dtype, pd.CategoricalDtype):
+            # 三个表共用同一份条码字典时，直接使用其整数编码
+            self._barcodes = frames[0].cat.categories
+        else:
+            self._barcodes = pd.Index(pd.unique(pd.concat([f.astype(object) for f in frames], ignore_index=True))) if frames else pd.Index([])
+        self._flow_df = flow_df
+
+        flow_times = flow_df['日期'] if not flow_df.empty else None
+        self._flow = self._build_track(flow_df, flow_times, '库存变动量')
+        self._sales = self._build_track(sales_df, sales_df.get(C['SALES_TIME']) if not sales_df.empty else None, C['SALES_QTY'])
+        # 盘点数据没有日期列时不按日期筛选，视为始终计入
+        check_times = check_df['日期'] if not check_df.empty and '日期' in check_df.columns else None
+        self._check = self._build_track(check_df, check_times, '差异库存', undated_always=True)
+        inbound_df = flow_df[flow_df['库存变动量'] > 0] if not flow_df.empty else flow_df
+        # 同一时间的多条进货记录取原顺序中的第一条，与 groupby().idxmax() 一致
+        self._inbound = self._build_track(inbound_df, inbound_df['日期'] if not inbound_df.empty else None,
+                                          '库存变动量', first_of_ties=True)
+        self._flow_start = self._flow['times'].min() if len(self._flow['times']) else None
+        self._inbound_start = self._inbound['times'].min() if len(self._inbound['times']) else None
+
+        # 最后一条货流记录所在的同时间组若增减方向不一致，备注需按原方式单独判断
+        values, codes, times = self._flow['values'], self._flow['codes'], self._flow['times']
+        self._flow_tie_mixed = np.zeros(len(values), dtype=bool)
+        if len(values):
+            boundary = (codes[1:] != codes[:-1]) | (times[1:] != times[:-1])
+            group_start = np.r_[0, np.flatnonzero(boundary) + 1]
+            group_id = np.repeat(np.arange(len(group_start)), np.diff(np.r_[group_start, len(values)]))
+            has_neg = np.maximum.reduceat(values < 0, group_start)
+            has_non_neg = np.maximum.reduceat(values >= 0, group_start)
+            self._flow_tie_mixed = (has_neg & has_non_neg)[group_id]
+        self._flow_rows = None
+
+    def _build_track(self, df, times, value_col, undated_always=False, first_of_ties=False):
+        C = Config.STD_COLS
+        empty = {'keys': np.array([], dtype=np.int64), 'codes': np.array([], dtype=np.int64),
+                 'times': np.array([], dtype='datetime64[ns]'), 'values': np.array([], dtype=float),
+                 'cumsum': np.array([], dtype=float)}
+        if df.empty:
+            return empty
+        barcodes = df[C['BARCODE']]
+        if isinstance(barcodes.dtype, pd.CategoricalDtype) and barcodes.cat.categories is self._barcodes:
+            codes = barcodes.cat.codes.to_numpy().astype(np.int64)
+        else:
+            codes = self._barcodes.get_indexer(barcodes)
+        values = pd.to_numeric(df[value_col], errors='coerce').fillna(0).to_numpy(dtype=float)
+        if times is None:
+            if not undated_always:
+                return empty
+            t = np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+            days = np.full(len(df), self.UNDATED_DAY, dtype=np.int64)
+        else:
+            t = pd.to_datetime(times).to_numpy(dtype='datetime64[ns]')
+            keep = ~np.isnat(t)
+            codes, values, t = codes[keep], values[keep], t[keep]
+            days = t.astype('datetime64[D]').astype(np.int64)
+        positions = np.arange(len(codes))
+        tie_order = -positions if first_of_ties else positions
+        order = np.lexsort((tie_order, t, codes))
+        codes, values, t, days = codes[order], values[order], t[order], days[order]
+        return {
+            'keys': self._compose(codes, days), 'codes': codes, 'times': t, 'values': values,
+            'cumsum': pd.Series(values).groupby(codes).cumsum().to_numpy()
+        }
+
+    @staticmethod
+    def _compose(codes, days):
+        # (条码序号, 天序号) 组合为单个可二分查找的整数键
+        return (codes.astype(np.int64) << 40) + (days.astype(np.int64) + (1 << 39))
+
+    def _lookup(self, track, codes, days):
+        """返回每个查询在台账中的最后一条记录位置，无记录时为 -1"""
+        if len(track['keys']) == 0:
+            return np.full(len(codes), -1)
+        pos = np.searchsorted(track['keys'], self._compose(codes, days), side='right') - 1
+        valid = (pos >= 0) & (codes >= 0)
+        valid &= track['codes'][pos.clip(0)] == codes
+        return np.where(valid, pos, -1)
+
+    def _cumulative(self, track, codes, days):
+        pos = self._lookup(track, codes, days)
+        return np.where(pos >= 0, track['cumsum'][pos.clip(0)], 0.0)
+
+    def as_of(self, barcodes, end_dates):
+        """查询条码在截止日期（含当天）的库存量、最后进货日和备注
+
+        Args:
+            barcodes (array-like): 条码
+            end_dates (array-like | date): 与条码等长的截止日期，或所有条码共用的单个日期
+
+        Returns:
+            pd.DataFrame: 条码、库存量、最后进货日、备注，行顺序与输入一致
         """
         C = Config.STD_COLS
-        if flow_df.empty or row[C['STOCK']] > 0:
-            return ''
-        barcode_flow = flow_df[flow_df[C['BARCODE']] == row[C['BARCODE']]]
-        if barcode_flow.empty:
-            return ''
-        last_record = barcode_flow.sort_values('日期').iloc[-1]
-        if last_record.get('库存变动量', 0) < 0:
-            return '商品可能已退库'
-        return ''
+        barcodes = pd.Series(barcodes, dtype=object).reset_index(drop=True)
+        if np.ndim(end_dates) == 0:
+            end_dates = [end_dates] * len(barcodes)
+        ends = pd.to_datetime(pd.Series(end_dates)).to_numpy(dtype='datetime64[D]')
+        days = ends.astype(np.int64)
+        codes = self._barcodes.get_indexer(barcodes)
+
+        stock = (self._cumulative(self._flow, codes, days) - self._cumulative(self._sales, codes, days)
+                 + self._cumulative(self._check, codes, days)).astype(int)
+        result = pd.DataFrame({C['BARCODE']: barcodes, C['STOCK']: stock})
+        result[C['LAST_INBOUND_DATE']] = self._last_inbound_labels(codes, days, ends)
+        result[C['REMARK']] = self._remarks(codes, days, ends, stock, barcodes)
+        return result
+
+    def _last_inbound_labels(self, codes, days, ends):
+        labels = np.full(len(codes), np.nan, dtype=object)
+        pos = self._lookup(self._inbound, codes, days)
+        found = pos >= 0
+        if found.any():
+            times = pd.to_datetime(self._inbound['times'][pos[found]])
+            qty = self._inbound['values'][pos[found]].astype(int)
+            labels[found] = [f"{t.strftime('%Y-%m-%d')} ({q}件)" for t, q in zip(times, qty)]
+        # 截止日期前没有任何货流/进货记录时，原逻辑对所有条码返回空字符串而不是空值
+        for start in (self._flow_start, self._inbound_start):
+            no_records = ends < start.astype('datetime64[D]') if start is not None else np.ones(len(ends), dtype=bool)
+            labels[no_records] = ''
+        return labels
+
+    def _remarks(self, codes, days, ends, stock, barcodes):
+        remarks = np.full(len(codes), '', dtype=object)
+        pos = self._lookup(self._flow, codes, days)
+        candidate = (pos >= 0) & (stock <= 0)
+        returned = candidate & (self._flow['values'][pos.clip(0)] < 0)
+        remarks[returned] = '商品可能已退库'
+        ambiguous = np.flatnonzero(candidate & self._flow_tie_mixed[pos.clip(0)])
+        if len(ambiguous):
+            if self._flow_rows is None:
+                self._flow_rows = self._flow_df.groupby(Config.STD_COLS['BARCODE'], observed=True).indices
+            for i in ambiguous:
+                end_inclusive = datetime.combine(pd.Timestamp(ends[i]).date(), datetime.max.time())
+                barcode_flow = self._flow_df.iloc[self._flow_rows[barcodes[i]]]
+                barcode_flow = barcode_flow[barcode_flow['日期'] <= end_inclusive]
+                last_record = barcode_flow.sort_values('日期').iloc[-1]
+                remarks[i] = '商品可能已退库' if last_record['库存变动量'] < 0 else ''
+        return remarks
+
+class WeekBucketer:
+    """周度期间分桶
+
+    将周度期间的起止日期转为天序号，用二分查找一次性为所有销售记录计算周序号
+    （对应 week_periods 的下标，不属于任何期间时为 -1），代替逐行扫描期间列表。
+    """
+    def __init__(self, week_periods):
+        self.week_periods = week_periods
+        self.labels = self.make_labels(week_periods)
+        self._starts = np.array([np.datetime64(pd.Timestamp(s).date(), 'D') for s, _ in week_periods], dtype='datetime64[D]')
+        self._ends = np.array([np.datetime64(pd.Timestamp(e).date(), 'D') for _, e in week_periods], dtype='datetime64[D]')
+
+    @staticmethod
+    def make_labels(week_periods):
+        return [f"{start.month}.{start.day}-{end.month}.{end.day}" for start, end in week_periods]
+
+    def assign(self, times):
+        """计算每个时间所属的周序号
+
+        Args:
+            times (pd.Series): 销售时间
+
+        Returns:
+            np.ndarray: int32 周序号数组，-1 表示不在任何期间内
+        """
+        days = pd.to_datetime(times).to_numpy().astype('datetime64[D]')
+        if len(self._starts) == 0:
+            return np.full(len(days), -1, dtype=np.int32)
+        codes = np.searchsorted(self._starts, days, side='right') - 1
+        valid = (codes >= 0) & ~np.isnat(days)
+        valid &= days <= self._ends[codes.clip(0)]
+        return np.where(valid, codes, -1).astype(np.int32)
+
+    def ensure_codes(self, sales_df):
+        """为销售数据添加周序号列（已存在则直接复用）"""
+        C = Config.STD_COLS
+        if C['WEEK_CODE'] not in sales_df.columns:
+            sales_df[C['WEEK_CODE']] = self.assign(sales_df[C['SALES_TIME']])
+        return sales_df[C['WEEK_CODE']].to_numpy()
+
+    def weekly_totals(self, sales_df, value_col):
+        """按周序号汇总某一数值列，返回与期间一一对应的合计数组"""
+        codes = self.ensure_codes(sales_df)
+        valid = codes >= 0
+        totals = np.bincount(codes[valid], weights=sales_df[value_col].to_numpy()[valid], minlength=len(self.labels))
+        return SalesRollup.round_totals(totals)
+
+    def weekly_summaries(self, sales_df, daily_sales=None):
+        """一次分组聚合得到所有周的商品销售汇总
+
+        按 (条码, 周序号, 是否周末) 对期间内的销售记录只扫描一次，
+        同时得到销售额、订单数、销量以及工作日/周末销量。提供日汇总时
+        改为扫描日汇总行。
+
+        Args:
+            sales_df (pd.DataFrame): 销售数据
+            daily_sales (pd.DataFrame, optional): 同一范围的销售日汇总. Defaults to None.
+
+        Returns:
+            dict: 周序号 -> 该周的商品汇总（条码、总销售额、总订单数、总销量、工作日销量、周末销量）
+        """
+        C = Config.STD_COLS
+        if sales_df.empty:
+            return {}
+        source = sales_df if daily_sales is None else daily_sales
+        codes = self.ensure_codes(source)
+        in_period = source[codes >= 0]
+        if in_period.empty:
+            return {}
+
+        # 1970-01-01 为周四，由天序号直接推算星期，避免逐行构造 datetime
+        days = in_period[C['SALES_TIME']].to_numpy().astype('datetime64[D]').astype(np.int64)
+        in_period = in_period.assign(_weekend=(days + 3) % 7 >= 5)
+
+        keys = [C['BARCODE'], C['WEEK_CODE']]
+        if daily_sales is None:
+            orders = SalesRollup.order_counts(in_period, None, keys)
+        elif SalesRollup.ORDER_COUNT in daily_sales.columns:
+            orders = SalesRollup.order_counts(None, in_period, keys)
+        else:
+            orders = SalesRollup.order_counts(sales_df[self.ensure_codes(sales_df) >= 0], None, keys)
+        grouped = in_period.groupby(keys, observed=True)
+        summary = pd.concat([
+            grouped[C['REVENUE']].sum().rename(C['TOTAL_REVENUE']),
+            orders.rename(C['TOTAL_ORDERS']),
+            grouped[C['SALES_QTY']].sum().rename(C['TOTAL_SALES_QTY']),
+        ], axis=1)
+        split = in_period.groupby(keys + ['_weekend'], observed=True)[C['SALES_QTY']].sum().unstack()
+        split = split.reindex(columns=[False, True])
+        split.columns = ['工作日销量', '周末销量']
+        summary = SalesRollup.round_totals(summary.join(split).fillna(0))
+
+        return {int(code): part.droplevel(C['WEEK_CODE']).reset_index()
+                for code, part in summary.groupby(level=C['WEEK_CODE'], sort=True)}
 
 class SalesAnalyzer:
     def __init__(self, data_processor):
         self.data_processor = data_processor
 
     # V7.0 MODIFIED: 移除缓存机制，直接分析
-    def analyze_sales(self, filtered_sales, product_barcodes, week_periods):
+    def analyze_sales(self, filtered_sales, product_barcodes, week_periods, bucketer=None, daily_sales=None):
         print("💰 正在按周分析销售数据...")
         C = Config.STD_COLS
         if filtered_sales.empty:
             return self._create_empty_sales_result(product_barcodes, week_periods)
 
-        def get_period_label(sale_date):
-            for start, end in week_periods:
-                if start.date() <= sale_date.date() <= end.date():
-                    return f"{start.month}.{start.day}-{end.month}.{end.day}"
-            return None
-
-        filtered_sales[C['WEEK_PERIOD']] = filtered_sales[C['SALES_TIME']].apply(get_period_label)
-
-        sales_summary = filtered_sales.groupby(C['BARCODE']).agg({
-            C['REVENUE']: 'sum',
-            C['ORDER_ID']: 'nunique',
-            C['SALES_QTY']: 'sum'
-        }).rename(columns={
-            C['REVENUE']: C['TOTAL_REVENUE'],
-            C['ORDER_ID']: C['TOTAL_ORDERS'],
-            C['SALES_QTY']: C['TOTAL_SALES_QTY']
-        })
-
-        weekly_sales_pivot = filtered_sales.pivot_table(
-            index=C['BARCODE'],
-            columns=C['WEEK_PERIOD'],
-            values=C['SALES_QTY'],
-            aggfunc='sum',
-            fill_value=0
-        )
-        
-        week_labels = [f"{start.month}.{start.day}-{end.month}.{end.day}" for start, end in week_periods]
-        weekly_sales_pivot = weekly_sales_pivot.reindex(columns=week_labels, fill_value=0)
+        bucketer = bucketer or WeekBucketer(week_periods)
+        # 有日汇总时销售额、销量和周销量都从日汇总行求和
+        source = filtered_sales if daily_sales is None else daily_sales
+        codes = bucketer.ensure_codes(source)
+
+        grouped = source.groupby(C['BARCODE'], observed=True)
+        sales_summary = pd.concat([
+            grouped[C['REVENUE']].sum().rename(C['TOTAL_REVENUE']),
+            SalesRollup.order_counts(filtered_sales, daily_sales, C['BARCODE'], approximate=True).rename(C['TOTAL_ORDERS']),
+            grouped[C['SALES_QTY']].sum().rename(C['TOTAL_SALES_QTY'])
+        ], axis=1)
+        sales_summary = SalesRollup.round_totals(sales_summary)
+
+        in_period = source[codes >= 0]
+        weekly_sales_pivot = in_period.groupby([C['BARCODE'], C['WEEK_CODE']], observed=True)[C['SALES_QTY']].sum().unstack(fill_value=0)
+        week_labels = bucketer.labels
+        weekly_sales_pivot.columns = [week_labels[c] for c in weekly_sales_pivot.columns]
+        if weekly_sales_pivot.columns.has_duplicates:
+            # 跨年范围内月日相同的期间共用一个标签，与按标签透视的结果保持一致
+            weekly_sales_pivot = weekly_sales_pivot.T.groupby(level=0).sum().T
+        weekly_sales_pivot = SalesRollup.round_totals(weekly_sales_pivot.reindex(columns=week_labels, fill_value=0))
 
         all_products_sales = pd.DataFrame({C['BARCODE']: product_barcodes}).set_index(C['BARCODE']).join(
             sales_summary).join(weekly_sales_pivot).fillna(0).reset_index()
         print(f"✅ 周度销售分析完成: {len(all_products_sales)} 个商品")
         return all_products_sales
 
+    def analyze_store_sales(self, sales_rows, product_barcodes):
+        """按门店拆分各商品的销量
+
+        Args:
+            sales_rows (pd.DataFrame): 已按期间（和门店）筛选的日汇总或销售流水
+            product_barcodes (list): 报表商品条码
+
+        Returns:
+            tuple: (条码 + 各门店销量列的 DataFrame, 门店销量列名列表)；
+                没有门店列或只有一个门店时为 (None, [])
+        """
+        C = Config.STD_COLS
+        if sales_rows is None or sales_rows.empty or C['STORE'] not in sales_rows.columns:
+            return None, []
+        pivot = sales_rows.groupby([C['BARCODE'], C['STORE']], observed=True)[C['SALES_QTY']].sum().unstack(fill_value=0)
+        pivot = SalesRollup.round_totals(pivot)
+        if len(pivot.columns) < 2:
+            return None, []
+        columns = [f"{store}销量" for store in pivot.columns]
+        pivot.columns = columns
+        result = pd.DataFrame({C['BARCODE']: product_barcodes}).set_index(C['BARCODE']).join(pivot).fillna(0).reset_index()
+        print(f"🏬 门店销量拆分完成: {len(columns)} 个门店")
+        return result, columns
+
     def _create_empty_sales_result(self, product_barcodes, week_periods):
         C = Config.STD_COLS
         result = pd.DataFrame({
@@ -314,34 +1776,290 @@ class SalesAnalyzer:
             C['TOTAL_ORDERS']: 0,
             C['TOTAL_SALES_QTY']: 0
         })
-        week_labels = [f"{start.month}.{start.day}-{end.month}.{end.day}" for start, end in week_periods]
-        for label in week_labels:
+        for label in WeekBucketer.make_labels(week_periods):
             result[label] = 0
         return result
 
 class ProductManager:
     def __init__(self, data_processor):
         self.data_processor = data_processor
+        self.monitor = StageTimer('load')
+        self.data_version = None
+
+    def load_and_prep_data(self, progress_callback=None):
+        """并行加载并预处理商品、销售、货流、盘点源文件
 
-    def load_and_prep_data(self):
-        # 直接从文件加载数据，不使用缓存
+        销售数据可以由多个文件组成（见 Config.SALES_SOURCES），每个文件是一个独立的
+        加载任务并单独缓存，未变化的文件直接读取缓存，全部加载后再合并。
+
+        Args:
+            progress_callback (callable, optional): 进度回调 (百分比, 状态文本)，
+                每完成一个文件按已完成文件的大小占比汇报 10%~55%；回调抛出
+                OperationCancelled 时中止加载. Defaults to None.
+
+        Returns:
+            tuple: (数据表字典, 商品资料文件路径)；各阶段耗时记录在 self.monitor
+        """
+        dp = self.data_processor
+        monitor = self.monitor = StageTimer('load').start()
         product_file_path = Config.get_file_path('product')
-        product_df = self.data_processor.load_excel_with_mapping(product_file_path)
-        sales_df = self.data_processor.load_excel_with_mapping(
-            Config.FILE_PATTERNS['sales'], chunked=True)
-        flow_df = self.data_processor.load_excel_with_mapping(
-            Config.FILE_PATTERNS['inventory_flow'], dtype_mapping={'商品条码': str, '条码': str})
-        check_df = self.data_processor.load_excel_with_mapping(
-            Config.FILE_PATTERNS['inventory_check'], dtype_mapping={'商品条码': str})
-        sales_df = self._prep_sales_df(sales_df)
-        flow_df = self._prep_flow_df(flow_df)
-        check_df = self._prep_check_df(check_df)
-        return {
-            'product': product_df,
+        sales_paths = Config.get_sales_paths()
+        source_paths = {
+            'product': product_file_path,
+            'sales': sales_paths,
+            'inventory_flow': dp.resolve_file_path(Config.FILE_PATTERNS['inventory_flow']),
+            'inventory_check': dp.resolve_file_path(Config.FILE_PATTERNS['inventory_check'])
+        }
+        # 每个加载任务为 (数据类型, 文件路径)
+        tasks = [(file_type, path) for file_type, paths in source_paths.items()
+                 for path in (paths if isinstance(paths, list) else [paths])]
+        sizes = {task: os.path.getsize(task[1]) if task[1] and os.path.exists(task[1]) else 0 for task in tasks}
+        self.data_version = self.source_fingerprint(source_paths)
+        total_size = sum(sizes.values()) or 1
+        loaded = {}
+        last_progress = [10, f"正在加载 {len(tasks)} 个数据文件..."]
+
+        def report(task):
+            if progress_callback:
+                done_size = sum(sizes[t] for t in loaded)
+                name = os.path.basename(task[1] or '') or task[0]
+                last_progress[:] = [10 + int(45 * done_size / total_size), f"已加载 {name} ({len(loaded)}/{len(tasks)})"]
+                progress_callback(*last_progress)
+
+        settings = Config.PARALLEL_LOAD
+        workers = min(settings['max_workers'], len(tasks), os.cpu_count() or 1)
+        # 性能分析只能覆盖本进程，开启时改为顺序加载
+        if settings['enabled'] and workers > 1 and not monitor.profile:
+            try:
+                pool = ProcessPoolExecutor(max_workers=workers)
+                cancelled = False
+                try:
+                    futures = {pool.submit(_load_source_worker, *task): task for task in tasks}
+                    pending = set(futures)
+                    while pending:
+                        done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                        if not done and progress_callback:
+                            # 子进程解析大文件期间也定期回调，使取消请求能及时生效
+                            progress_callback(*last_progress)
+                        for future in done:
+                            task = futures[future]
+                            try:
+                                loaded[task], messages, stages = future.result()
+                                monitor.merge(stages)
+                                for message in messages:
+                                    dp.notifier.notify(**message)
+                            except Exception as e:
+                                print(f"⚠️ 并行加载 {task[0]} 失败，改为在主进程加载: {e}")
+                                loaded[task] = self._load_source_timed(monitor, *task)
+                            report(task)
+                except OperationCancelled:
+                    cancelled = True
+                    raise
+                finally:
+                    # 取消时不等待仍在解析文件的子进程，未开始的任务直接撤销
+                    pool.shutdown(wait=not cancelled, cancel_futures=cancelled)
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                print(f"⚠️ 进程池不可用，改为顺序加载: {e}")
+
+        for task in tasks:
+            if task not in loaded:
+                loaded[task] = self._load_source_timed(monitor, *task)
+                report(task)
+
+        with monitor.stage('合并销售文件') as record:
+            sales_df = self.combine_sales_frames([(path, loaded[('sales', path)]) for path in sales_paths])
+            record['rows_out'] = len(sales_df)
+        data_frames = {
+            'product': loaded[('product', product_file_path)],
             'sales': sales_df,
-            'inventory_flow': flow_df,
-            'inventory_check': check_df
-        }, product_file_path
+            'inventory_flow': loaded[('inventory_flow', source_paths['inventory_flow'])],
+            'inventory_check': loaded[('inventory_check', source_paths['inventory_check'])]
+        }
+        with monitor.stage('统一条码字典'):
+            dp.share_barcode_dictionary(data_frames)
+        with monitor.stage('销售日汇总') as record:
+            data_frames['sales_daily'] = SalesRollup.build(data_frames['sales'])
+            record['rows_in'] = len(data_frames['sales'])
+            record['rows_out'] = len(data_frames['sales_daily']) if data_frames['sales_daily'] is not None else 0
+        with monitor.stage('订单去重索引') as record:
+            data_frames['sales_orders'] = DistinctOrderIndex.build(data_frames['sales'], data_frames['sales_daily'])
+            if data_frames['sales_orders'] is not None:
+                record['rows_out'] = len(data_frames['sales_orders'])
+        monitor.stop()
+        monitor.save({'sources': source_paths})
+        print(monitor.summary_text("数据加载"))
+        return data_frames, product_file_path
+
+    @staticmethod
+    def source_fingerprint(source_paths):
+        """源文件路径、大小和修改时间的指纹，作为报表缓存键中的数据版本"""
+        def describe(path):
+            if path and os.path.exists(path):
+                stat = os.stat(path)
+                return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+            return None
+
+        state = {'cache_version': Config.CACHE_SETTINGS['version'], 'distinct_orders': Config.DISTINCT_ORDERS,
+                 'sales_sources': Config.SALES_SOURCES}
+        for file_type, paths in sorted(source_paths.items()):
+            state[file_type] = [describe(p) for p in paths] if isinstance(paths, list) else describe(paths)
+        return hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def store_names(paths):
+        """按 Config.SALES_SOURCES 从文件路径推断每个销售文件所属的门店
+
+        Returns:
+            dict: 文件路径 -> 门店名；只有一个文件或推断不出时为 None
+        """
+        settings = Config.SALES_SOURCES
+        if len(paths) < 2:
+            return {path: None for path in paths}
+        stores = {}
+        if settings['store_from'] == 'folder':
+            # 各文件所在文件夹的公共上级之下的第一级子文件夹即门店
+            folders = {path: os.path.dirname(os.path.abspath(path)) for path in paths}
+            root = os.path.commonpath(list(folders.values()))
+            for path, folder in folders.items():
+                relative = os.path.relpath(folder, root)
+                stores[path] = None if relative == os.curdir else relative.split(os.sep)[0]
+        elif settings['store_from'] == 'filename':
+            for path in paths:
+                match = re.match(settings['filename_pattern'], os.path.basename(path))
+                stores[path] = match.group('store') if match else None
+        else:
+            stores = {path: None for path in paths}
+        return stores
+
+    def combine_sales_frames(self, parts):
+        """合并各销售文件的预处理结果，并补齐门店列
+
+        文件本身没有门店列时按路径推断门店；存在多个门店时流水号前加上门店，
+        避免不同门店的同号流水在订单去重时被合并。
+
+        Args:
+            parts (list): [(文件路径, 预处理后的 DataFrame)]
+
+        Returns:
+            pd.DataFrame: 合并后的销售数据
+        """
+        C, settings = Config.STD_COLS, Config.SALES_SOURCES
+        stores = self.store_names([path for path, _ in parts])
+        frames = []
+        for path, df in parts:
+            if df is None or df.empty:
+                continue
+            if stores[path] is not None and C['STORE'] not in df.columns:
+                df[C['STORE']] = stores[path]
+            frames.append(df)
+        if not frames:
+            return pd.DataFrame()
+        if len(frames) == 1:
+            df = frames[0]
+        else:
+            # 各文件的字典编码不同，合并后重新转换为紧凑列类型
+            df = self.data_processor.compact_frame(DataProcessor.concat_frames(frames))
+            print(f"🏬 已合并 {len(frames)} 个销售文件: 共 {len(df)} 条记录")
+        if C['STORE'] in df.columns:
+            store = df[C['STORE']].astype('string').str.strip().replace('', pd.NA)
+            df[C['STORE']] = store.fillna(settings['unknown_store']).astype(object).astype('category')
+            if len(df[C['STORE']].cat.categories) > 1 and C['ORDER_ID'] in df.columns:
+                df[C['ORDER_ID']] = self.qualify_order_ids(df[C['STORE']], df[C['ORDER_ID']])
+        return df
+
+    @staticmethod
+    def qualify_order_ids(stores, orders):
+        """把流水号改写为“门店|流水号”（字典编码），只对不同的 (门店, 流水号) 组合拼接字符串"""
+        orders = orders if isinstance(orders.dtype, pd.CategoricalDtype) else orders.astype(object).astype('category')
+        width = len(orders.cat.categories)
+        if not width:
+            return orders
+        order_codes = orders.cat.codes.to_numpy().astype(np.int64)
+        valid = order_codes >= 0
+        keys = stores.cat.codes.to_numpy().astype(np.int64) * width + order_codes
+        pairs = np.unique(keys[valid])
+        codes = np.where(valid, np.searchsorted(pairs, keys), -1)
+        store_names = pd.Index(stores.cat.categories.astype(str))[pairs // width]
+        order_names = pd.Index(orders.cat.categories.astype(str))[pairs % width]
+        return pd.Series(pd.Categorical.from_codes(codes, categories=store_names + '|' + order_names), index=orders.index)
+
+    def _load_source_timed(self, monitor, file_type, file_path):
+        with monitor.stage(f"加载 {file_type}") as record:
+            df = self.load_source(file_type, file_path)
+            record['rows_out'] = len(df)
+        return df
+
+    def load_source(self, file_type, file_path):
+        """加载并预处理单个源文件，源文件未变化时直接读取缓存"""
+        dp = self.data_processor
+        loaders = {
+            'product': lambda: dp.load_excel_with_mapping(file_path, source='product'),
+            'inventory_flow': lambda: dp.compact_frame(dp.load_excel_with_mapping(
+                file_path, chunked=True, prep_func=self._prep_flow_df, source='inventory_flow')),
+            'inventory_check': lambda: dp.compact_frame(dp.load_excel_with_mapping(
+                file_path, chunked=True, prep_func=self._prep_check_df, source='inventory_check'))
+        }
+        if not file_path:
+            return pd.DataFrame()
+        if file_type == 'sales':
+            return dp.cache_manager.get_or_load(
+                file_type, file_path,
+                lambda: self._load_sales_full(file_path),
+                append_loader=lambda previous, state: self._load_sales_append(file_path, previous, state))
+        return dp.cache_manager.get_or_load(file_type, file_path, loaders[file_type])
+
+    def _load_sales_full(self, file_path):
+        """全量流式加载销售数据，并记录增量加载所需的高水位状态"""
+        row_state = {}
+        df = self.data_processor.compact_frame(self._read_sales_batches(file_path, row_state=row_state))
+        return df, self._sales_append_state(df, row_state)
+
+    def _load_sales_append(self, file_path, previous, state):
+        """增量加载：只读取并预处理上次高水位之后新增的行，与已缓存的预处理结果合并
+
+        销售数据每天只在末尾追加新的流水。跳过已加载的行时校验表头、首行和
+        上次的最后一行（即 销售时间/流水号 高水位所在行），任一不一致说明历史被改写，
+        抛出异常由 CacheManager 回退为全量重建。
+        """
+        high_water = state.get('high_water') or {}
+        print(f"🔁 增量加载 {os.path.basename(file_path)}: 高水位 {high_water.get('time')} / 流水号 {high_water.get('order_id')}")
+        row_state = {}
+        tail = self._read_sales_batches(file_path, skip_rows=state['rows'], expected=state, row_state=row_state,
+                                        raise_errors=True)
+        # 新旧两部分的字典编码不同，合并后重新转换为紧凑列类型
+        df = self.data_processor.compact_frame(DataProcessor.concat_frames([previous, tail])) if not tail.empty else previous
+        print(f"✅ 增量加载完成: 新增 {len(tail)} 条记录，共 {len(df)} 条")
+        return df, self._sales_append_state(df, row_state)
+
+    def _read_sales_batches(self, file_path, skip_rows=0, expected=None, row_state=None, raise_errors=False):
+        dp = self.data_processor
+        try:
+            chunks = [self._prep_sales_df(chunk) for chunk in dp.iter_excel_batches(
+                file_path, chunk_size=Config.CHUNKED_LOAD['chunk_size'],
+                skip_rows=skip_rows, expected=expected, row_state=row_state, source='sales')]
+        except Exception as e:
+            if raise_errors:
+                raise
+            dp.notifier.error("文件加载错误", f"加载文件 '{os.path.basename(file_path)}' 时出错:\n{e}")
+            return pd.DataFrame()
+        df = dp.concat_frames(chunks) if chunks else pd.DataFrame()
+        if not skip_rows:
+            print(f"✅ 成功加载: {os.path.basename(file_path)} ({len(df)} 条记录)")
+        return df
+
+    @staticmethod
+    def _sales_append_state(df, row_state):
+        if not row_state or df.empty:
+            return None
+        C = Config.STD_COLS
+        last_order = df[C['ORDER_ID']].iloc[-1] if C['ORDER_ID'] in df.columns else None
+        row_state['high_water'] = {
+            'time': df[C['SALES_TIME']].max().isoformat(),
+            'order_id': None if pd.isna(last_order) else str(last_order)
+        }
+        return row_state
 
     def _prep_sales_df(self, df):
         if df.empty:
@@ -351,18 +2069,37 @@ class ProductManager:
             self.data_processor.find_column(df, M['barcode']): C['BARCODE'],
             self.data_processor.find_column(df, M['brand']): C['BRAND'],
             self.data_processor.find_column(df, D['sales']): C['SALES_TIME'],
+            self.data_processor.find_column(df, M['store']): C['STORE'],
             '实收金额': C['REVENUE'],
             '销售数量': C['SALES_QTY'],
             '流水号': C['ORDER_ID']
         }
         df.rename(columns={k: v for k, v in rename_map.items() if k}, inplace=True)
-        df[C['SALES_TIME']] = pd.to_datetime(df.get(C['SALES_TIME']), errors='coerce')
+        raw_times = df.get(C['SALES_TIME'])
+        df[C['SALES_TIME']] = pd.to_datetime(raw_times, errors='coerce')
         df[C['REVENUE']] = self.data_processor.clean_numeric_column(df.get(C['REVENUE']))
         df[C['SALES_QTY']] = self.data_processor.clean_numeric_column(df.get(C['SALES_QTY']))
+        if raw_times is not None and C['BARCODE'] in df.columns:
+            # 按原因记录将被丢弃的行数，供数据质量检查报告
+            bad_time = df[C['SALES_TIME']].isna()
+            DataProcessor.record_dropped_rows(df, {
+                'unparseable_time': (bad_time & raw_times.notna()).sum(),
+                'missing_time': raw_times.isna().sum(),
+                'missing_barcode': (~bad_time & df[C['BARCODE']].isna()).sum()})
         df.dropna(subset=[C['SALES_TIME'], C['BARCODE']], inplace=True)
         df[C['BARCODE']] = df[C['BARCODE']].astype(str)
         return df
 
+    @staticmethod
+    def parse_received_qty(df):
+        """解析货流数据的实收量，退货单的无效实收量返回 NaN"""
+        # 处理退货单的实收量格式："-", "0", "0.00" 等都视为无效值
+        received_qty_raw = df['实收量'].astype(str).str.strip()
+        # 将 "-", "0", "0.00", 空字符串等视为无效值
+        invalid_values = ['-', '0', '0.00', '', 'nan', 'NaN', 'None']
+        received_qty_clean = received_qty_raw.replace(invalid_values, np.nan)
+        return pd.to_numeric(received_qty_clean, errors='coerce')
+
     def _prep_flow_df(self, df):
         if df.empty:
             return df
@@ -373,17 +2110,13 @@ class ProductManager:
             df.rename(columns={date_col: '日期'}, inplace=True)
             df['日期'] = pd.to_datetime(df['日期'], errors='coerce')
         if '实收量' in df.columns and '货流量' in df.columns:
-            # 处理退货单的实收量格式："-", "0", "0.00" 等都视为无效值
-            received_qty_raw = df['实收量'].astype(str).str.strip()
-            # 将 "-", "0", "0.00", 空字符串等视为无效值
-            invalid_values = ['-', '0', '0.00', '', 'nan', 'NaN', 'None']
-            received_qty_clean = received_qty_raw.replace(invalid_values, np.nan)
-            received_qty = pd.to_numeric(received_qty_clean, errors='coerce')
+            received_qty = self.parse_received_qty(df)
             flow_qty = pd.to_numeric(df['货流量'], errors='coerce').fillna(0)
             # 当实收量为无效值时，使用负的货流量（退货减库存）
             df['库存变动量'] = np.where(received_qty.isna() | (received_qty == 0), -flow_qty, received_qty)
         else:
             df['库存变动量'] = 0
+        DataProcessor.record_dropped_rows(df, {'missing_barcode': df[C['BARCODE']].isna().sum()})
         df.dropna(subset=[C['BARCODE']], inplace=True)
         df[C['BARCODE']] = df[C['BARCODE']].astype(str)
         return df
@@ -398,6 +2131,7 @@ class ProductManager:
             df.rename(columns={date_col: '日期'}, inplace=True)
             df['日期'] = pd.to_datetime(df['日期'], errors='coerce')
         df['差异库存'] = pd.to_numeric(df.get('差异库存'), errors='coerce').fillna(0)
+        DataProcessor.record_dropped_rows(df, {'missing_barcode': df[C['BARCODE']].isna().sum()})
         df.dropna(subset=[C['BARCODE']], inplace=True)
         df[C['BARCODE']] = df[C['BARCODE']].astype(str)
         return df
@@ -413,80 +2147,366 @@ class ProductManager:
         # 过滤掉空值或仅包含空格的品牌
         return sorted([b for b in brands if pd.notna(b) and str(b).strip()])
 
-    def build_master_product_data(self, product_df, selected_brands):
-        C, M = Config.STD_COLS, Config.COLUMN_MAPPINGS
-        if product_df.empty:
-            messagebox.showwarning("警告", "商品资料文件为空，报表将缺少名称、规格和定价信息。")
-            return pd.DataFrame(columns=[C['BRAND'], C['BARCODE'], C['NAME'], C['SPEC'], C['PRICE']])
-        b_col = self.data_processor.find_column(product_df, M['brand'])
-        bc_col = self.data_processor.find_column(product_df, M['barcode'])
-        n_col = self.data_processor.find_column(product_df, M['name'])
-        if not all([b_col, bc_col, n_col]):
-            messagebox.showerror("错误", "商品资料文件缺少必要列（品牌、条码、名称）。")
-            return pd.DataFrame()
-        master_data = product_df[product_df[b_col].isin(selected_brands)].copy()
-        result = pd.DataFrame()
-        result[C['BRAND']] = master_data[b_col]
-        result[C['BARCODE']] = master_data[bc_col].astype(str)
-        result[C['NAME']] = master_data[n_col]
-        spec_col = self.data_processor.find_column(product_df, M['spec'])
-        result[C['SPEC']] = master_data[spec_col] if spec_col is not None else ''
-        price_col = self.data_processor.find_column(product_df, M['price'])
-        result[C['PRICE']] = self.data_processor.clean_numeric_column(master_data.get(price_col)) if price_col is not None else 0
-        result.drop_duplicates(subset=[C['BARCODE']], inplace=True)
-        print(f"✅ 商品主数据构建完成: {len(result)} 个商品")
-        return result.reset_index(drop=True)
+    @staticmethod
+    def get_all_stores(sales_df):
+        """销售数据中出现的门店；没有门店列时返回空列表"""
+        C = Config.STD_COLS
+        if sales_df is None or C['STORE'] not in sales_df.columns:
+            return []
+        return sorted(str(s) for s in pd.unique(sales_df[C['STORE']].dropna()))
+
+    def build_master_product_data(self, product_df, selected_brands):
+        C, M = Config.STD_COLS, Config.COLUMN_MAPPINGS
+        if product_df.empty:
+            self.data_processor.notifier.warning("警告", "商品资料文件为空，报表将缺少名称、规格和定价信息。")
+            return pd.DataFrame(columns=[C['BRAND'], C['BARCODE'], C['NAME'], C['SPEC'], C['PRICE']])
+        b_col = self.data_processor.find_column(product_df, M['brand'])
+        bc_col = self.data_processor.find_column(product_df, M['barcode'])
+        n_col = self.data_processor.find_column(product_df, M['name'])
+        if not all([b_col, bc_col, n_col]):
+            self.data_processor.notifier.error("错误", "商品资料文件缺少必要列（品牌、条码、名称）。")
+            return pd.DataFrame()
+        master_data = product_df[product_df[b_col].isin(selected_brands)].copy()
+        result = pd.DataFrame()
+        result[C['BRAND']] = master_data[b_col]
+        result[C['BARCODE']] = master_data[bc_col].astype(str)
+        result[C['NAME']] = master_data[n_col]
+        spec_col = self.data_processor.find_column(product_df, M['spec'])
+        result[C['SPEC']] = master_data[spec_col] if spec_col is not None else ''
+        price_col = self.data_processor.find_column(product_df, M['price'])
+        result[C['PRICE']] = self.data_processor.clean_numeric_column(master_data.get(price_col)) if price_col is not None else 0
+        result.drop_duplicates(subset=[C['BARCODE']], inplace=True)
+        print(f"✅ 商品主数据构建完成: {len(result)} 个商品")
+        return result.reset_index(drop=True)
+
+def _load_source_worker(file_type, file_path):
+    """进程池任务：在子进程中加载并预处理单个源文件（需为模块级函数以便序列化）
+
+    子进程不弹出对话框，通知消息和阶段计时随结果返回，由主进程转交给它自己的 notifier 和计时器。
+    """
+    notifier = ConsoleNotifier()
+    monitor = StageTimer('load', profile=False).start()
+    df = ProductManager(DataProcessor(notifier))._load_source_timed(monitor, file_type, file_path)
+    monitor.stop()
+    return df, notifier.messages, monitor.results()
+
+# ==================== 数据质量检查 ====================
+class DataQualityChecker:
+    """数据质量检查规则引擎
+
+    逐行规则对每个数据表只在同一份（必要时抽样的）数据上依次求值：规则函数返回
+    标记问题行的布尔数组，由引擎统一计数并取示例行。只能在加载时发现的问题（如
+    无法解析而被丢弃的销售时间）由预处理记录在 DataFrame.attrs['dropped_rows'] 中；
+    负库存、时间跨度等整表规则另行计算。
+
+    行数超过 sample_threshold 的表按 sample_rate 抽样检查，计数按实际抽样比例放大为
+    估计值。销售数据按流水号哈希抽样，同一订单的行同进同出，重复行检查仍然有效。
+    """
+    # (数据表, 规则, 级别, 说明, 检查函数)；检查函数返回布尔数组，规则不适用时返回 None
+    ROW_RULES = [
+        ('product', 'duplicate_barcode', 'warning', '商品条码重复（报表只取第一条）', '_duplicate_product_barcode'),
+        ('sales', 'unknown_barcode', 'warning', '销售条码不在商品资料中', '_unknown_barcode'),
+        ('sales', 'duplicate_line', 'warning', '同一流水号下完全相同的重复销售行', '_duplicate_sales_line'),
+        ('inventory_flow', 'missing_date', 'warning', '日期为空或无法解析（不计入按日期截止的库存）', '_missing_date'),
+        ('inventory_flow', 'received_fallback', 'info', '实收量无效，已按负的货流量计入库存', '_received_fallback'),
+        ('inventory_flow', 'zero_change', 'info', '零库存变动记录', '_zero_change'),
+        ('inventory_check', 'missing_date', 'warning', '日期为空或无法解析', '_missing_date'),
+    ]
+    DROPPED_REASONS = {
+        'unparseable_time': '销售时间无法解析，加载时已丢弃',
+        'missing_time': '销售时间为空，加载时已丢弃',
+        'missing_barcode': '条码为空，加载时已丢弃',
+    }
+    FRAME_NAMES = {'product': '商品资料', 'sales': '销售数据', 'inventory_flow': '货流数据', 'inventory_check': '盘点数据'}
+    LEVEL_ICONS = {'error': '❌', 'warning': '⚠️', 'info': 'ℹ️'}
+
+    @staticmethod
+    def check_data_quality(data_frames):
+        """检查数据质量，返回供界面显示的问题描述列表"""
+        return [DataQualityChecker.describe(result) for result in DataQualityChecker.run(data_frames)]
+
+    @classmethod
+    def run(cls, data_frames, settings=None):
+        """对全部数据表执行检查规则
+
+        Args:
+            data_frames (dict): 加载后的数据表
+            settings (dict, optional): 抽样和示例设置. Defaults to Config.DATA_QUALITY.
+
+        Returns:
+            list[dict]: 发现的问题，每项含 frame、rule、level、message、count、unit、
+                estimated（计数是否为抽样估计）、rows_checked 和 examples（示例行 DataFrame）
+        """
+        settings = settings or Config.DATA_QUALITY
+        started = time.perf_counter()
+        context = {'data_frames': data_frames}
+        results = []
+        for key in cls.FRAME_NAMES:
+            df = data_frames.get(key)
+            if df is None or df.empty:
+                continue
+            for reason, count in df.attrs.get('dropped_rows', {}).items():
+                results.append(cls._result(key, f'dropped_{reason}', 'warning',
+                                           cls.DROPPED_REASONS.get(reason, reason), count))
+            sample, rate = cls._sample(key, df, settings)
+            for frame_key, rule, level, message, func in cls.ROW_RULES:
+                if frame_key != key:
+                    continue
+                mask = getattr(cls, func)(sample, context)
+                count = int(mask.sum()) if mask is not None else 0
+                if count:
+                    results.append(cls._result(
+                        key, rule, level, message, count if rate == 1 else int(round(count / rate)),
+                        estimated=rate < 1, rows_checked=len(sample), examples=sample[mask].head(settings['max_examples'])))
+        results.extend(cls._frame_rules(data_frames, settings))
+
+        print(f"🔍 数据质量检查完成: 发现 {len(results)} 类问题 ({time.perf_counter() - started:.2f}s)")
+        for result in results:
+            print(f"  {cls.LEVEL_ICONS.get(result['level'], '')} {cls.describe(result)}")
+        return results
+
+    @staticmethod
+    def _result(frame, rule, level, message, count, unit='条', estimated=False, rows_checked=None, examples=None):
+        return {'frame': frame, 'rule': rule, 'level': level, 'message': message, 'count': count, 'unit': unit,
+                'estimated': estimated, 'rows_checked': rows_checked, 'examples': examples}
+
+    @classmethod
+    def describe(cls, result):
+        """生成一条问题的文字描述，附最多 3 个示例条码"""
+        name = cls.FRAME_NAMES.get(result['frame'], result['frame'])
+        if result['count'] is None:
+            return f"{name}{result['message']}"
+        text = f"{name}: {result['message']} {'约 ' if result['estimated'] else ''}{result['count']:,} {result['unit']}"
+        examples = result['examples']
+        if examples is not None and not examples.empty:
+            col = Config.STD_COLS['BARCODE']
+            if col not in examples.columns:
+                col = DataProcessor.find_column(examples, Config.COLUMN_MAPPINGS['barcode']) or examples.columns[0]
+            values = pd.unique(examples[col].astype(str).to_numpy())[:3]
+            text += f"（如 {', '.join(values)}）"
+        return text
+
+    @staticmethod
+    def _sample(key, df, settings):
+        """行数超过阈值时抽样，返回 (样本, 实际抽样比例)"""
+        if len(df) <= settings['sample_threshold']:
+            return df, 1.0
+        rate = settings['sample_rate']
+        C = Config.STD_COLS
+        if key == 'sales' and C['ORDER_ID'] in df.columns:
+            # 按流水号哈希抽样，与订单去重索引的抽样方式相同
+            orders = df[C['ORDER_ID']]
+            if isinstance(orders.dtype, pd.CategoricalDtype):
+                hashes = pd.util.hash_pandas_object(pd.Series(orders.cat.categories), index=False).to_numpy()
+                codes = orders.cat.codes.to_numpy()
+                row_hashes = np.where(codes >= 0, hashes[codes.clip(0)], 0)
+            else:
+                row_hashes = pd.util.hash_pandas_object(orders, index=False).to_numpy()
+            keep = row_hashes < np.uint64(min(int(rate * 2 ** 64), 2 ** 64 - 1))
+        else:
+            keep = np.zeros(len(df), dtype=bool)
+            keep[::max(1, int(round(1 / rate)))] = True
+        sample = df[keep]
+        print(f"🎲 {DataQualityChecker.FRAME_NAMES.get(key, key)} {len(df):,} 行，抽样 {len(sample):,} 行检查")
+        return sample, len(sample) / len(df)
+
+    # ---------- 逐行规则 ----------
+    @staticmethod
+    def _duplicate_product_barcode(df, context):
+        col = DataProcessor.find_column(df, Config.COLUMN_MAPPINGS['barcode'])
+        if col is None:
+            return None
+        return (df[col].duplicated() & df[col].notna()).to_numpy()
+
+    @staticmethod
+    def _unknown_barcode(df, context):
+        product_df = context['data_frames'].get('product')
+        if product_df is None or product_df.empty:
+            return None
+        col = DataProcessor.find_column(product_df, Config.COLUMN_MAPPINGS['barcode'])
+        if col is None:
+            return None
+        if 'product_barcodes' not in context:
+            context['product_barcodes'] = product_df[col].dropna().astype(str).unique()
+        return ~DataProcessor.barcode_mask(df[Config.STD_COLS['BARCODE']], context['product_barcodes'])
+
+    @staticmethod
+    def _duplicate_sales_line(df, context):
+        C = Config.STD_COLS
+        cols = [C['ORDER_ID'], C['BARCODE'], C['SALES_TIME'], C['SALES_QTY'], C['REVENUE']]
+        if not all(col in df.columns for col in cols):
+            return None
+        return (df.duplicated(subset=cols) & df[C['ORDER_ID']].notna()).to_numpy()
+
+    @staticmethod
+    def _missing_date(df, context):
+        return df['日期'].isna().to_numpy() if '日期' in df.columns else None
+
+    @staticmethod
+    def _received_fallback(df, context):
+        if '实收量' not in df.columns or '货流量' not in df.columns:
+            return None
+        received_qty = ProductManager.parse_received_qty(df)
+        return (received_qty.isna() | (received_qty == 0)).to_numpy()
 
-# ==================== 数据质量检查 ====================
-class DataQualityChecker:
-    """数据质量检查工具"""
-    
     @staticmethod
-    def check_data_quality(data_frames):
-        """检查数据质量"""
-        issues = []
+    def _zero_change(df, context):
+        return (df['库存变动量'] == 0).to_numpy() if '库存变动量' in df.columns else None
+
+    # ---------- 整表规则 ----------
+    @classmethod
+    def _frame_rules(cls, data_frames, settings):
         C = Config.STD_COLS
-        
-        # 检查销售数据
-        sales_df = data_frames.get('sales', pd.DataFrame())
-        if not sales_df.empty:
-            # 移除了对负销售额和负销售数量的检查，因为退货是正常业务场景
-            
-            # 检查时间范围
-            if C['SALES_TIME'] in sales_df.columns:
-                min_date = sales_df[C['SALES_TIME']].min()
-                max_date = sales_df[C['SALES_TIME']].max()
-                if (max_date - min_date).days > 365 * 2:
-                    issues.append(f"销售数据时间跨度较长 ({min_date.date()} 到 {max_date.date()})，可能影响性能")
-        
-        # 检查库存流动数据
-        flow_df = data_frames.get('inventory_flow', pd.DataFrame())
-        if not flow_df.empty:
-            # 检查零库存变动记录
-            zero_flow = flow_df[flow_df['库存变动量'] == 0]
-            if not zero_flow.empty:
-                issues.append(f"库存流动数据中发现 {len(zero_flow)} 条零库存变动记录")
-        
-        return issues
+        results = []
+        sales_df = data_frames.get('sales')
+        if sales_df is not None and not sales_df.empty and C['SALES_TIME'] in sales_df.columns:
+            min_date, max_date = sales_df[C['SALES_TIME']].min(), sales_df[C['SALES_TIME']].max()
+            if (max_date - min_date).days > settings['max_span_days']:
+                results.append(cls._result('sales', 'long_time_span', 'info',
+                                           f"时间跨度较长 ({min_date.date()} 到 {max_date.date()})，可能影响性能", None))
+
+        stock = cls._current_stock(data_frames)
+        if stock is not None:
+            negative = stock[stock < 0].sort_values()
+            if not negative.empty:
+                examples = negative.head(settings['max_examples']).rename(C['STOCK']).reset_index()
+                results.append(cls._result('inventory_flow', 'negative_stock', 'warning',
+                                           '按全部货流、销售和盘点计算的当前库存为负', len(negative), unit='个商品',
+                                           rows_checked=len(stock), examples=examples))
+        return results
+
+    @staticmethod
+    def _current_stock(data_frames):
+        """按条码汇总的当前库存（货流 - 销售 + 盘点差异），没有货流数据时返回 None"""
+        C = Config.STD_COLS
+        flow_df = data_frames.get('inventory_flow')
+        if flow_df is None or flow_df.empty or '库存变动量' not in flow_df.columns:
+            return None
+        parts = []
+        for key, col, sign in (('inventory_flow', '库存变动量', 1), ('sales', C['SALES_QTY'], -1),
+                               ('inventory_check', '差异库存', 1)):
+            df = data_frames.get(key)
+            if df is not None and not df.empty and col in df.columns:
+                parts.append(df.groupby(C['BARCODE'], observed=True)[col].sum().astype(float) * sign)
+        return pd.concat(parts, axis=1).fillna(0).sum(axis=1).round(6)
 
 # ==================== 报表生成器 ====================
 class ReportGenerator:
-    def __init__(self, data_processor, inventory_calc, sales_analyzer, product_manager):
+    def __init__(self, data_processor, inventory_calc, sales_analyzer, product_manager, report_cache=None):
         self.data_processor = data_processor
+        self.report_cache = report_cache
         self.inventory_calc = inventory_calc
         self.sales_analyzer = sales_analyzer
         self.product_manager = product_manager
         self.progress_callback = None
+        self.monitor = StageTimer('report')
 
     def set_progress_callback(self, callback):
         """设置进度回调函数"""
         self.progress_callback = callback
 
-    def generate_report(self, data_frames, selected_brands, start_date, end_date, sort_params, export_format='excel'):
+    def generate_report(self, data_frames, selected_brands, start_date, end_date, sort_params, export_format='excel',
+                        stores=None):
+        """生成报表，各阶段耗时记录在 self.monitor 并写入运行日志
+
+        每次进度回调都是取消检查点：回调抛出 OperationCancelled 时报表在该处
+        中止，异常原样抛给调用方。stores 为空时包含全部门店；否则销售指标只统计
+        所选门店，库存仍按全部数据计算（货流和盘点数据不区分门店）。
+
+        Returns:
+            tuple: (是否成功, 报表路径)
+        """
+        self.monitor = StageTimer('report').start()
+        try:
+            return self._generate_report(data_frames, selected_brands, start_date, end_date, sort_params, export_format,
+                                         stores)
+        finally:
+            self.monitor.stop()
+            self.monitor.save({'brands': list(selected_brands), 'start_date': str(start_date), 'end_date': str(end_date),
+                               'format': export_format, 'stores': list(stores or [])})
+            print(self.monitor.summary_text("报表生成"))
+
+    def _generate_report(self, data_frames, selected_brands, start_date, end_date, sort_params, export_format, stores=None):
+        monitor = self.monitor
         print("🔄 开始生成报表...")
         if self.progress_callback:
             self.progress_callback(0, "开始生成报表...")
         C = Config.STD_COLS
+
+        # 同一品牌、期间和数据版本的中间结果可直接复用，只重新排序和写出
+        cache_key, result = None, None
+        if self.report_cache is not None and self.product_manager.data_version:
+            cache_key = ReportCache.make_key(selected_brands, start_date, end_date, self.product_manager.data_version, stores)
+            with monitor.stage('报表缓存') as record:
+                result = self.report_cache.get(cache_key)
+                record['rows_out'] = len(result['final_data']) if result is not None else 0
+        if result is None:
+            result = self._compute_report(data_frames, selected_brands, start_date, end_date, stores)
+            if result is None:
+                return False, None
+            if cache_key:
+                self.report_cache.put(cache_key, result)
+        else:
+            print(f"⚡ 命中报表缓存: {len(result['final_data'])} 个商品，跳过库存和销售计算")
+
+        week_bucketer = WeekBucketer(result['week_periods'])
+        if self.progress_callback:
+            self.progress_callback(75, "应用排序规则...")
+        with monitor.stage('排序') as record:
+            final_data = self._apply_sorting(result['final_data'], sort_params)
+            record['rows_in'] = record['rows_out'] = len(final_data)
+
+        # V6.5 MODIFIED: Pass all necessary dataframes for weekly calculations
+        if self.progress_callback:
+            self.progress_callback(80, "创建报表文件...")
+        with monitor.stage('写出报表') as record:
+            record['rows_in'] = len(final_data)
+            if export_format.lower() == 'excel':
+                report_path = self._create_and_save_excel(
+                    report_data=final_data,
+                    master_products=result['master_products'],
+                    filtered_sales=result['filtered_sales'],
+                    daily_sales=result['daily_sales'],
+                    week_bucketer=week_bucketer,
+                    selected_brands=selected_brands,
+                    start_date=start_date,
+                    end_date=end_date,
+                    full_sales_df=data_frames['sales'],
+                    full_flow_df=data_frames['inventory_flow'],
+                    full_check_df=data_frames['inventory_check'],
+                    report_result=result,
+                    stores=stores
+                )
+                if cache_key and 'weekly_frames' in result:
+                    self.report_cache.put(cache_key, result)  # 周度报表数据首次算出，更新条目大小
+            elif export_format.lower() == 'csv':
+                report_path = self._create_and_save_csv(
+                    report_data=final_data,
+                    selected_brands=selected_brands,
+                    start_date=start_date,
+                    end_date=end_date,
+                    stores=stores
+                )
+            else:
+                raise ValueError(f"不支持的导出格式: {export_format}")
+
+        if self.progress_callback:
+            self.progress_callback(100, "完成")
+        if report_path:
+            print(f"✅ 报表生成成功: {report_path}")
+            return True, report_path
+        return False, None
+
+    def _compute_report(self, data_frames, selected_brands, start_date, end_date, stores=None):
+        """计算与排序和导出格式无关的报表中间结果
+
+        Returns:
+            dict | None: 包含 master_products、filtered_sales、daily_sales、week_periods、
+                store_columns（门店销量列名）和排序前的 final_data；没有有效商品时返回 None。
+                Excel 导出时还会补充 weekly_frames（周序号 -> 周度报表数据）
+        """
+        monitor = self.monitor
+        C = Config.STD_COLS
         product_df = data_frames['product']
         sales_df = data_frames['sales'] # This is the full, unprepared sales_df
         flow_df = data_frames['inventory_flow']
@@ -494,10 +2514,12 @@ class ReportGenerator:
 
         if self.progress_callback:
             self.progress_callback(5, "构建商品主数据...")
-        master_products = self.product_manager.build_master_product_data(product_df, selected_brands)
+        with monitor.stage('商品主数据') as record:
+            master_products = self.product_manager.build_master_product_data(product_df, selected_brands)
+            record['rows_out'] = len(master_products)
         if master_products.empty:
-            messagebox.showerror("错误", "无任何有效的商品数据。")
-            return False, None
+            self.data_processor.notifier.error("错误", "无任何有效的商品数据。")
+            return None
 
         end_date_inclusive = datetime.combine(end_date, datetime.max.time())
         start_date_inclusive = datetime.combine(start_date, datetime.min.time())
@@ -505,72 +2527,81 @@ class ReportGenerator:
 
         if self.progress_callback:
             self.progress_callback(10, f"筛选销售时段: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-        # Filter sales for the selected date range for reporting purposes
-        filtered_sales = sales_df[
-            (sales_df[C['BARCODE']].astype(str).isin(selected_barcodes)) &
-            (sales_df[C['SALES_TIME']] >= start_date_inclusive) &
-            (sales_df[C['SALES_TIME']] <= end_date_inclusive)
-        ].copy()
-        print(f"📋 筛选时段: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}, 共 {len(filtered_sales)} 条记录")
+        # 报表指标从日汇总取数；订单数不可按日相加时由订单去重索引统计，
+        # 都不可用时退回筛选原始销售流水
+        with monitor.stage('筛选销售') as record:
+            daily_df = data_frames.get('sales_daily')
+            if daily_df is None:
+                daily_sales = None
+                filtered_sales = SalesIndex.for_frame(sales_df).select(
+                    selected_barcodes, start_date_inclusive, end_date_inclusive).copy()
+                print(f"📋 筛选时段: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}, 共 {len(filtered_sales)} 条记录")
+            else:
+                daily_sales = SalesIndex.for_frame(daily_df).select(
+                    selected_barcodes, start_date_inclusive, end_date_inclusive).copy()
+                orders_df = data_frames.get('sales_orders')
+                filtered_sales = daily_sales if orders_df is None else SalesIndex.for_frame(orders_df).select(
+                    selected_barcodes, start_date_inclusive, end_date_inclusive).copy()
+                print(f"📋 筛选时段: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}, 共 {len(daily_sales)} 条日汇总记录")
+            if stores:
+                filtered_sales, daily_sales = self._filter_stores(filtered_sales, stores), self._filter_stores(daily_sales, stores)
+                print(f"🏬 筛选门店: {', '.join(map(str, stores))}")
+            record['rows_in'] = len(sales_df)
+            record['rows_out'] = len(filtered_sales if daily_sales is None else daily_sales)
 
         week_periods = self._get_week_periods(start_date, end_date)
-        week_labels = [f"{start.month}.{start.day}-{end.month}.{end.day}" for start, end in week_periods]
+        week_bucketer = WeekBucketer(week_periods)
+        week_labels = week_bucketer.labels
 
         # V6.5: Calculate final inventory for the main report (up to the latest data)
         if self.progress_callback:
             self.progress_callback(20, "计算库存数据...")
-        inventory_data = self.inventory_calc.calculate_inventory(
-            master_products[C['BARCODE']].tolist(), flow_df, check_df, sales_df
-        )
+        with monitor.stage('计算库存', unit='products') as record:
+            inventory_data = self.inventory_calc.calculate_inventory(
+                master_products[C['BARCODE']].tolist(), flow_df, check_df, sales_df
+            )
+            record['rows_in'], record['rows_out'] = len(master_products), len(inventory_data)
         if self.progress_callback:
             self.progress_callback(40, "分析销售数据...")
-        sales_data = self.sales_analyzer.analyze_sales(filtered_sales, master_products[C['BARCODE']].tolist(), week_periods)
+        with monitor.stage('分析销售') as record:
+            sales_data = self.sales_analyzer.analyze_sales(
+                filtered_sales, master_products[C['BARCODE']].tolist(), week_periods, week_bucketer, daily_sales)
+            record['rows_in'] = len(filtered_sales if daily_sales is None else daily_sales)
+            record['rows_out'] = len(sales_data)
+        store_sales, store_columns = None, []
+        if Config.SALES_SOURCES['store_columns']:
+            store_sales, store_columns = self.sales_analyzer.analyze_store_sales(
+                filtered_sales if daily_sales is None else daily_sales, master_products[C['BARCODE']].tolist())
 
         if self.progress_callback:
             self.progress_callback(70, "合并数据...")
-        final_data = master_products.merge(inventory_data, on=C['BARCODE'], how='left').merge(sales_data, on=C['BARCODE'], how='left')
-
-        final_cols = [C['BRAND'], C['BARCODE'], C['NAME'], C['SPEC'], C['STOCK'], C['PRICE'],
-                      C['LAST_INBOUND_DATE'], C['REMARK'], C['TOTAL_REVENUE'], C['TOTAL_ORDERS'], C['TOTAL_SALES_QTY']] + week_labels
-        final_data = final_data.reindex(columns=final_cols, fill_value=0)
-        final_data[C['REMARK']] = final_data[C['REMARK']].fillna('')
+        with monitor.stage('合并数据') as record:
+            final_data = master_products.merge(inventory_data, on=C['BARCODE'], how='left').merge(sales_data, on=C['BARCODE'], how='left')
+            if store_sales is not None:
+                final_data = final_data.merge(store_sales, on=C['BARCODE'], how='left')
 
-        if self.progress_callback:
-            self.progress_callback(75, "应用排序规则...")
-        final_data = self._apply_sorting(final_data, sort_params)
+            final_cols = [C['BRAND'], C['BARCODE'], C['NAME'], C['SPEC'], C['STOCK'], C['PRICE'],
+                          C['LAST_INBOUND_DATE'], C['REMARK'], C['TOTAL_REVENUE'], C['TOTAL_ORDERS'], C['TOTAL_SALES_QTY']] + store_columns + week_labels
+            final_data = final_data.reindex(columns=final_cols, fill_value=0)
+            final_data[C['REMARK']] = final_data[C['REMARK']].fillna('')
+            record['rows_out'] = len(final_data)
 
-        # V6.5 MODIFIED: Pass all necessary dataframes for weekly calculations
-        if self.progress_callback:
-            self.progress_callback(80, "创建报表文件...")
-        if export_format.lower() == 'excel':
-            report_path = self._create_and_save_excel(
-                report_data=final_data,
-                master_products=master_products,
-                filtered_sales=filtered_sales,
-                week_periods=week_periods,
-                selected_brands=selected_brands,
-                start_date=start_date,
-                end_date=end_date,
-                full_sales_df=sales_df,
-                full_flow_df=flow_df,
-                full_check_df=check_df
-            )
-        elif export_format.lower() == 'csv':
-            report_path = self._create_and_save_csv(
-                report_data=final_data,
-                selected_brands=selected_brands,
-                start_date=start_date,
-                end_date=end_date
-            )
-        else:
-            raise ValueError(f"不支持的导出格式: {export_format}")
+        return {
+            'master_products': master_products,
+            'filtered_sales': filtered_sales,
+            'daily_sales': daily_sales,
+            'week_periods': week_periods,
+            'store_columns': store_columns,
+            'final_data': final_data
+        }
 
-        if self.progress_callback:
-            self.progress_callback(100, "完成")
-        if report_path:
-            print(f"✅ 报表生成成功: {report_path}")
-            return True, report_path
-        return False, None
+    @staticmethod
+    def _filter_stores(sales_rows, stores):
+        """只保留所选门店的行；数据没有门店列时原样返回"""
+        C = Config.STD_COLS
+        if sales_rows is None or C['STORE'] not in sales_rows.columns:
+            return sales_rows
+        return sales_rows[sales_rows[C['STORE']].isin(stores).to_numpy()]
 
     def _get_week_periods(self, start_date, end_date):
         periods = []
@@ -596,69 +2627,88 @@ class ReportGenerator:
         return data.reset_index(drop=True)
 
     # V6.5 MODIFIED: Added full dataframes to the signature
-    def _create_and_save_excel(self, report_data, master_products, filtered_sales, week_periods, selected_brands, start_date, end_date, full_sales_df, full_flow_df, full_check_df):
-        wb = Workbook()
-        ws = wb.active
+    def _create_and_save_excel(self, report_data, master_products, filtered_sales, week_bucketer, selected_brands, start_date, end_date, full_sales_df, full_flow_df, full_check_df, daily_sales=None, report_result=None, stores=None):
+        from openpyxl import Workbook
+        write_only = Config.EXCEL_WRITER['write_only']
+        wb = Workbook(write_only=write_only)
+        if not write_only:
+            wb.remove(wb.active)
         sheet_title = f"{start_date.strftime('%y%m%d')}-{end_date.strftime('%y%m%d')}总销售"
-        ws.title = sheet_title[:31]
+        ws = wb.create_sheet(title=sheet_title[:31])
 
-        styles = self._define_styles()
-        week_labels = [f"{start.month}.{start.day}-{end.month}.{end.day}" for start, end in week_periods]
+        styles = self._define_styles(wb)
+        week_labels = week_bucketer.labels
         if self.progress_callback:
             self.progress_callback(85, "写入总销售表...")
-        self._write_sheet_data(ws, "总销售表", report_data, styles, week_labels)
+        with self.monitor.stage('总销售表') as record:
+            # 门店销量列与周度销量列一样按整数格式写出并合计
+            store_columns = (report_result or {}).get('store_columns', [])
+            self._write_sheet_data(ws, "总销售表", report_data, styles, week_labels + store_columns)
+            record['rows_in'] = len(report_data)
 
         # V6.5 MODIFIED: Pass the full dataframes to the weekly sheet generator
-        self._add_weekly_sheets(
-            wb=wb,
-            master_products=master_products,
-            filtered_sales=filtered_sales,
-            week_periods=week_periods,
-            styles=styles,
-            full_sales_df=full_sales_df,
-            full_flow_df=full_flow_df,
-            full_check_df=full_check_df
-        )
+        with self.monitor.stage('周度报表', unit='weeks') as record:
+            self._add_weekly_sheets(
+                wb=wb,
+                master_products=master_products,
+                filtered_sales=filtered_sales,
+                week_bucketer=week_bucketer,
+                styles=styles,
+                full_sales_df=full_sales_df,
+                full_flow_df=full_flow_df,
+                full_check_df=full_check_df,
+                daily_sales=daily_sales,
+                report_result=report_result
+            )
+            record['rows_in'] = len(week_bucketer.week_periods)
         
         if self.progress_callback:
             self.progress_callback(95, "添加可视化图表...")
-        # 添加可视化图表工作表
-        self._add_visualization_sheet(wb, report_data, week_periods, styles)
+        # 添加可视化图表工作表（周度销量按日可加，有日汇总时直接用日汇总）
+        with self.monitor.stage('可视化图表'):
+            self._add_visualization_sheet(wb, report_data, filtered_sales if daily_sales is None else daily_sales, week_bucketer, styles)
 
         if self.progress_callback:
             self.progress_callback(98, "保存并增强兼容性...")
         # V8.0 MODIFIED: Use the enhanced save method
-        return self._save_and_enhance_compatibility(wb, selected_brands, start_date, end_date)
+        with self.monitor.stage('保存'):
+            return self._save_and_enhance_compatibility(wb, selected_brands, start_date, end_date, stores)
     
-    def _add_visualization_sheet(self, wb, report_data, week_periods, styles):
-        """添加可视化图表工作表"""
+    def _add_visualization_sheet(self, wb, report_data, filtered_sales, week_bucketer, styles):
+        """添加可视化图表工作表
+
+        流式工作表只能按行顺序追加，因此先把各区域的单元格收集到
+        (行, 列) 映射中，最后统一按行写出。
+        """
+        from openpyxl.chart import BarChart, LineChart, Reference
+        from openpyxl.styles import Font
         if report_data.empty:
             return
             
         C = Config.STD_COLS
+        week_periods = week_bucketer.week_periods
         ws_chart = wb.create_sheet(title="可视化图表")
+        cells = {}
         
         # 添加标题
         title_font = Font(name='微软雅黑', size=14, bold=True)
-        ws_chart['A1'] = "销售数据分析可视化"
-        ws_chart['A1'].font = title_font
+        cells[(1, 1)] = ("销售数据分析可视化", title_font)
         
         # 1. 销量前10名商品柱状图
         top_products = report_data.nlargest(10, C['TOTAL_SALES_QTY'])
         if not top_products.empty:
             # 写入数据到A50以下
             data_start_row = 50
-            ws_chart.cell(row=data_start_row, column=1, value="商品名称")
-            ws_chart.cell(row=data_start_row, column=2, value="总销量")
-            ws_chart.cell(row=data_start_row, column=3, value="总销售额")
+            cells[(data_start_row, 1)] = "商品名称"
+            cells[(data_start_row, 2)] = "总销量"
+            cells[(data_start_row, 3)] = "总销售额"
             
             for i, (_, row) in enumerate(top_products.iterrows(), 1):
-                ws_chart.cell(row=data_start_row+i, column=1, value=str(row[C['NAME']])[:15])  # 限制名称长度
-                ws_chart.cell(row=data_start_row+i, column=2, value=row[C['TOTAL_SALES_QTY']])
-                ws_chart.cell(row=data_start_row+i, column=3, value=row[C['TOTAL_REVENUE']])
+                cells[(data_start_row+i, 1)] = str(row[C['NAME']])[:15]  # 限制名称长度
+                cells[(data_start_row+i, 2)] = row[C['TOTAL_SALES_QTY']]
+                cells[(data_start_row+i, 3)] = row[C['TOTAL_REVENUE']]
             
             # 创建销量柱状图
-            from openpyxl.chart import BarChart, Reference
             chart1 = BarChart()
             chart1.title = "销量前10名商品"
             chart1.x_axis.title = "商品"
@@ -697,26 +2747,22 @@ class ReportGenerator:
         if week_periods:
             # 将周度数据也放在A50以下，但与上面的数据分开
             trend_start_row = 50 + 15  # 在销量数据之后
-            ws_chart.cell(row=trend_start_row, column=1, value="周度期间")
-            ws_chart.cell(row=trend_start_row, column=2, value="总销量")
+            cells[(trend_start_row, 1)] = "周度期间"
+            cells[(trend_start_row, 2)] = "总销量"
             
-            # 计算每周总销量
-            week_labels = [f"{start.month}.{start.day}-{end.month}.{end.day}" for start, end in week_periods]
-            weekly_totals = []
-            for label in week_labels:
-                if label in report_data.columns:
-                    total = report_data[label].sum()
-                    weekly_totals.append(total)
-                else:
-                    weekly_totals.append(0)
+            # 计算每周总销量：直接按销售记录的周序号汇总
+            week_labels = week_bucketer.labels
+            if filtered_sales.empty:
+                weekly_totals = [0] * len(week_labels)
+            else:
+                weekly_totals = week_bucketer.weekly_totals(filtered_sales, C['SALES_QTY']).tolist()
             
             # 写入周度数据
             for i, (label, total) in enumerate(zip(week_labels, weekly_totals), 1):
-                ws_chart.cell(row=trend_start_row+i, column=1, value=label)
-                ws_chart.cell(row=trend_start_row+i, column=2, value=total)
+                cells[(trend_start_row+i, 1)] = label
+                cells[(trend_start_row+i, 2)] = total
             
             # 创建折线图
-            from openpyxl.chart import LineChart
             line_chart = LineChart()
             line_chart.title = "周度销量趋势"
             line_chart.x_axis.title = "周度期间"
@@ -740,8 +2786,7 @@ class ReportGenerator:
         stockout_start_row = 2  # 第2行
         stockout_start_col = 17  # Q列是第17列
         
-        ws_chart.cell(row=stockout_start_row, column=stockout_start_col, value="断货提醒")
-        ws_chart.cell(row=stockout_start_row, column=stockout_start_col).font = Font(name='微软雅黑', size=12, bold=True)
+        cells[(stockout_start_row, stockout_start_col)] = ("断货提醒", Font(name='微软雅黑', size=12, bold=True))
         
         # 筛选断货商品的优化逻辑：
         # 1. 库存为0且总销量>0的商品
@@ -763,48 +2808,90 @@ class ReportGenerator:
             
             if not stockout_products.empty:
                 # 显示表头
-                headers = [C['NAME'], C['TOTAL_SALES_QTY'], C['TOTAL_REVENUE'], C['STOCK'], '平均周销量']
                 header_names = ['商品名称', '总销量', '总销售额', '库存量', '平均周销量']
+                header_font = Font(name='微软雅黑', size=10, bold=True)
                 
                 for col_offset, header_name in enumerate(header_names):
-                    ws_chart.cell(row=stockout_start_row+1, column=stockout_start_col+col_offset, value=header_name)
-                    ws_chart.cell(row=stockout_start_row+1, column=stockout_start_col+col_offset).font = Font(name='微软雅黑', size=10, bold=True)
+                    cells[(stockout_start_row+1, stockout_start_col+col_offset)] = (header_name, header_font)
                 
                 # 填充数据
                 for row_offset, (_, product) in enumerate(stockout_products.iterrows(), stockout_start_row+2):
-                    ws_chart.cell(row=row_offset, column=stockout_start_col, value=str(product[C['NAME']])[:20])
-                    ws_chart.cell(row=row_offset, column=stockout_start_col+1, value=product[C['TOTAL_SALES_QTY']])
-                    ws_chart.cell(row=row_offset, column=stockout_start_col+2, value=product[C['TOTAL_REVENUE']])
-                    ws_chart.cell(row=row_offset, column=stockout_start_col+3, value=product[C['STOCK']])
-                    ws_chart.cell(row=row_offset, column=stockout_start_col+4, value=round(product['avg_weekly_sales'], 2))
+                    cells[(row_offset, stockout_start_col)] = str(product[C['NAME']])[:20]
+                    cells[(row_offset, stockout_start_col+1)] = product[C['TOTAL_SALES_QTY']]
+                    cells[(row_offset, stockout_start_col+2)] = product[C['TOTAL_REVENUE']]
+                    cells[(row_offset, stockout_start_col+3)] = product[C['STOCK']]
+                    cells[(row_offset, stockout_start_col+4)] = round(product['avg_weekly_sales'], 2)
                     
                     # 对库存为0或极低的单元格添加特殊格式
                     if product[C['STOCK']] <= 2:
-                        ws_chart.cell(row=row_offset, column=stockout_start_col+3).font = Font(color="FF0000", bold=True)  # 红色加粗显示
+                        cells[(row_offset, stockout_start_col+3)] = (product[C['STOCK']], Font(color="FF0000", bold=True))  # 红色加粗显示
 
-    def _create_and_save_csv(self, report_data, selected_brands, start_date, end_date):
+        self._write_cell_map(ws_chart, cells)
+
+    @staticmethod
+    def _write_cell_map(ws, cells):
+        """按行顺序写出 (行, 列) -> 值 的单元格映射
+
+        Args:
+            ws: 工作表（普通或流式）
+            cells (dict): (行, 列) -> 值，或 (值, Font) 表示需要设置字体的单元格
+        """
+        from openpyxl.cell import WriteOnlyCell
+        rows = {}
+        for (r, c), content in cells.items():
+            rows.setdefault(r, {})[c] = content
+
+        for r in range(1, max(rows, default=0) + 1):
+            row_cells = rows.get(r, {})
+            row = [None] * max(row_cells, default=0)
+            for c, content in row_cells.items():
+                if isinstance(content, tuple):
+                    value, font = content
+                    content = WriteOnlyCell(ws, value)
+                    content.font = font
+                row[c - 1] = content
+            ws.append(row)
+
+    @staticmethod
+    def _report_file_name(selected_brands, start_date, end_date, extension, stores=None):
+        """报表文件名：首个品牌（多品牌加“等”）[_首个门店(多门店加“等”)]_期间_时间"""
+        def label(names):
+            text = re.sub(r'[<>:"/\\|?*]', '', str(names[0]))
+            return text + "等" if len(names) > 1 else text
+
+        name = label(selected_brands) + (f"_{label(stores)}" if stores else '')
+        ts = datetime.now().strftime('%H%M%S')
+        return f"{name}_{start_date.strftime('%Y%m%d')}-{end_date.strftime('%m%d')}_{ts}.{extension}"
+
+    def _create_and_save_csv(self, report_data, selected_brands, start_date, end_date, stores=None):
         """创建并保存CSV格式报表"""
         try:
-            brand_name = re.sub(r'[<>:"/\\|?*]', '', selected_brands[0])
-            if len(selected_brands) > 1:
-                brand_name += "等"
-            ts = datetime.now().strftime('%H%M%S')
-            filename = f"{brand_name}_{start_date.strftime('%Y%m%d')}-{end_date.strftime('%m%d')}_{ts}.csv"
+            filename = self._report_file_name(selected_brands, start_date, end_date, 'csv', stores)
             report_path = Config.get_report_path(filename)
             
             # 保存CSV文件
             report_data.to_csv(report_path, index=False, encoding='utf-8-sig')
             return report_path
         except PermissionError:
-            messagebox.showerror("文件保存失败", f"请关闭已打开的CSV文件 '{os.path.basename(filename)}' 后重试。")
+            self.data_processor.notifier.error("文件保存失败", f"请关闭已打开的CSV文件 '{os.path.basename(filename)}' 后重试。")
             return None
         except Exception as e:
-            messagebox.showerror("文件保存失败", f"无法保存CSV文件:\n{e}")
+            self.data_processor.notifier.error("文件保存失败", f"无法保存CSV文件:\n{e}")
             return None
 
-    def _define_styles(self):
+    def _define_styles(self, wb):
+        """在工作簿中注册报表使用的命名样式
+
+        每种基础样式再各派生一个整数格式和金额格式的版本，单元格写出时只需
+        按名称引用，不再逐个单元格设置字体、边框、对齐和数字格式。
+
+        Returns:
+            dict: 基础样式键 -> 样式名；(基础样式键, 数字格式) -> 带数字格式的样式名
+        """
+        from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
         b = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        return {
+        body_alignment = Alignment(shrink_to_fit=True, vertical='center')
+        bases = {
             'header': {
                 'font': Font(name='微软雅黑', size=11, bold=True, color='FFFFFF'),
                 'fill': PatternFill(start_color='4F81BD', end_color='4F81BD', fill_type='solid'),
@@ -814,7 +2901,7 @@ class ReportGenerator:
             'normal': {
                 'font': Font(name='微软雅黑', size=10),
                 'border': b,
-                'alignment': Alignment(shrink_to_fit=True, vertical='center')
+                'alignment': body_alignment
             },
             'totals': {
                 'font': Font(name='微软雅黑', size=10, bold=True),
@@ -822,27 +2909,66 @@ class ReportGenerator:
             },
             'remark_special': {
                 'font': Font(name='微软雅黑', size=10, color='FF6600', bold=True),
-                'fill': PatternFill(start_color='FFF2E6', end_color='FFF2E6', fill_type='solid')
+                'fill': PatternFill(start_color='FFF2E6', end_color='FFF2E6', fill_type='solid'),
+                'border': b,
+                'alignment': body_alignment
             },
             'low_stock': {
                 'font': Font(name='微软雅黑', size=10, color='FF0000'),
-                'fill': PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')
+                'fill': PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid'),
+                'border': b,
+                'alignment': body_alignment
             }
         }
 
+        styles = {}
+        for key, attrs in bases.items():
+            name = f"报表_{key}"
+            wb.add_named_style(NamedStyle(name=name, **attrs))
+            styles[key] = name
+            for fmt_key in ('integer', 'currency'):
+                fmt = EXCEL_FORMATS[fmt_key]
+                fmt_name = f"{name}_{fmt_key}"
+                wb.add_named_style(NamedStyle(name=fmt_name, number_format=fmt, **attrs))
+                styles[(key, fmt)] = fmt_name
+        return styles
+
+    @staticmethod
+    def _column_width(header, values, week_labels):
+        """根据表头和列值计算列宽（中文按 GBK 字节数计）"""
+        C = Config.STD_COLS
+        if header in week_labels:
+            return 10
+        fixed = {'工作日销量': 11, '周末销量': 11, C['REMARK']: 13, C['TOTAL_REVENUE']: 12}
+        if header in fixed:
+            return fixed[header]
+
+        max_length = 0
+        for text in set(map(str, filter(None, [header, *values]))):
+            cell_len = len(text.encode('gbk', 'ignore')) if CJK_PATTERN.search(text) else len(text)
+            max_length = max(max_length, cell_len)
+
+        adjusted_width = min(max(max_length + 2, 8), 50)
+        if header == C['NAME']:
+            adjusted_width = max(adjusted_width, 40)
+        return adjusted_width
+
     def _write_sheet_data(self, ws, table_name, report_data, styles, week_labels=None):
+        """写出一张带表格、合计行和高亮的数据工作表
+
+        单元格的值（规格为0、整数列的0留空）和样式都按列一次算好，再逐行写出。
+        流式工作表要求在写第一行之前设置列宽，因此列宽同样由算好的值预先得出；
+        同一列同一样式的单元格对象在流式写出时被复用。
+        """
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.utils import get_column_letter
+        from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
         if week_labels is None:
             week_labels = []
 
-        headers = list(report_data.columns)
-        for c, h in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=c, value=h)
-            cell.font = styles['header']['font']
-            cell.fill = styles['header']['fill']
-            cell.alignment = styles['header']['alignment']
-            cell.border = styles['header']['border']
-
         C = Config.STD_COLS
+        headers = list(report_data.columns)
+        n_rows = len(report_data)
         formats = {
             C['STOCK']: EXCEL_FORMATS['integer'],
             C['PRICE']: EXCEL_FORMATS['currency'],
@@ -854,113 +2980,100 @@ class ReportGenerator:
             **{label: EXCEL_FORMATS['integer'] for label in week_labels}
         }
 
-        for r_idx, row in enumerate(report_data.itertuples(index=False), 2):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx)
-                col_name = headers[c_idx - 1]
-
-                if col_name == C['SPEC'] and (value == 0 or str(value) == '0' or pd.isna(value)):
-                    cell.value = None
-                else:
-                    cell.value = value
-
-                cell.font = styles['normal']['font']
-                cell.border = styles['normal']['border']
-                cell.alignment = styles['normal']['alignment']
-                
-                if col_name == C['REMARK'] and value == '商品可能已退库':
-                    cell.font = styles['remark_special']['font']
-                    cell.fill = styles['remark_special']['fill']
-                
-                is_low_stock = row[headers.index(C['STOCK'])] < 2
-                is_not_returned = row[headers.index(C['REMARK'])] != '商品可能已退库'
-                if col_name == C['STOCK'] and is_low_stock and is_not_returned:
-                     cell.font = styles['low_stock']['font']
-                     cell.fill = styles['low_stock']['fill']
-
-                if col_name in formats and isinstance(value, (int, float, np.number)):
-                    if value == 0 and formats[col_name] == EXCEL_FORMATS['integer'] and col_name != C['STOCK']:
-                        cell.value = None
+        no_highlight = np.zeros(n_rows, dtype=bool)
+        is_returned = (report_data[C['REMARK']] == '商品可能已退库').to_numpy() if C['REMARK'] in headers else no_highlight
+        is_low_stock = (report_data[C['STOCK']] < 2).to_numpy() & ~is_returned if C['STOCK'] in headers else no_highlight
+
+        column_values, column_styles = [], []
+        for col_name in headers:
+            values = report_data[col_name].tolist()
+            if col_name == C['SPEC']:
+                values = [None if (v == 0 or str(v) == '0' or pd.isna(v)) else v for v in values]
+
+            bases = np.full(n_rows, 'normal', dtype=object)
+            if col_name == C['REMARK']:
+                bases[is_returned] = 'remark_special'
+            if col_name == C['STOCK']:
+                bases[is_low_stock] = 'low_stock'
+
+            fmt = formats.get(col_name)
+            if fmt is None:
+                names = [styles[base] for base in bases]
+            else:
+                blank_zero = fmt == EXCEL_FORMATS['integer'] and col_name != C['STOCK']
+                names = []
+                for i, (value, base) in enumerate(zip(values, bases)):
+                    if not isinstance(value, (int, float, np.number)):
+                        names.append(styles[base])
+                    elif blank_zero and value == 0:
+                        values[i] = None
+                        names.append(styles[base])
                     else:
-                        cell.number_format = formats[col_name]
-        
+                        names.append(styles[(base, fmt)])
+            column_values.append(values)
+            column_styles.append(names)
+
+        # 流式工作表的列宽必须在写入任何行之前设置
+        for c_idx, col_name in enumerate(headers, 1):
+            ws.column_dimensions[get_column_letter(c_idx)].width = self._column_width(col_name, column_values[c_idx - 1], week_labels)
+
+        reuse_cells = ws.parent.write_only
+        templates = {}
+
+        def styled_cell(c_idx, style, value):
+            # 流式写出时单元格在 append 时即被序列化，同列同样式的单元格可以复用
+            key = (c_idx, style, isinstance(value, datetime))
+            cell = templates.get(key) if reuse_cells else None
+            if cell is None:
+                cell = WriteOnlyCell(ws)
+                cell.style = style
+                if reuse_cells:
+                    templates[key] = cell
+            cell.value = value
+            return cell
+
+        ws.append([styled_cell(c_idx, styles['header'], h) for c_idx, h in enumerate(headers)])
+        for row_values, row_styles in zip(zip(*column_values), zip(*column_styles)):
+            ws.append([styled_cell(c_idx, style, value) for c_idx, (value, style) in enumerate(zip(row_values, row_styles))])
+
         # V8.0 MODIFIED: Adopted the summation logic from v7.1
         if not report_data.empty:
-            totals_row_index = len(report_data) + 2
             sum_cols = [
                 C['STOCK'], C['TOTAL_REVENUE'], C['TOTAL_ORDERS'],
                 C['TOTAL_SALES_QTY'], '工作日销量', '周末销量'
             ] + week_labels
-            
-            for c_idx, col_name in enumerate(headers, 1):
-                total_cell = ws.cell(row=totals_row_index, column=c_idx)
-
-                total_cell.font = styles['totals']['font']
-                total_cell.border = styles['totals']['border']
 
+            totals_row = []
+            for col_name in headers:
+                total_cell = WriteOnlyCell(ws)
+                total_cell.style = styles['totals']
                 if col_name == C['NAME']:
                     total_cell.value = f'=SUBTOTAL(103,[{C["NAME"]}])&"个SKU"'
                 elif col_name in sum_cols:
                     total_cell.value = f'=SUBTOTAL(109,[{col_name}])'
                     if col_name in formats:
-                        total_cell.number_format = formats[col_name]
-        
+                        total_cell.style = styles[('totals', formats[col_name])]
+                totals_row.append(total_cell)
+            ws.append(totals_row)
+
         table_columns = [
             TableColumn(id=i + 1, name=col_name) for i, col_name in enumerate(headers)
         ]
 
-        table_ref = f"A1:{get_column_letter(len(headers))}{len(report_data) + 2}"
+        table_ref = f"A1:{get_column_letter(len(headers))}{n_rows + 2}"
         table = Table(displayName=table_name.replace(" ", ""), ref=table_ref, tableColumns=table_columns, totalsRowCount=1, totalsRowShown=True)
         style = TableStyleInfo(name="TableStyleLight9", showFirstColumn=False,
                                showLastColumn=False, showRowStripes=False, showColumnStripes=False)
         table.tableStyleInfo = style
-        ws.add_table(table)
-
-        for column_cells in ws.columns:
-            header_cell = column_cells[0]
-            header_text = header_cell.value
-            column_letter = header_cell.column_letter
-            
-            if header_text in week_labels:
-                ws.column_dimensions[column_letter].width = 10
-                continue
-            if header_text in ['工作日销量', '周末销量']:
-                ws.column_dimensions[column_letter].width = 11
-                continue
-            if header_text == C['REMARK']:
-                ws.column_dimensions[column_letter].width = 13
-                continue
-            if header_text == C['TOTAL_REVENUE']:
-                ws.column_dimensions[column_letter].width = 12
-                continue
-
-            max_length = 0
-            for cell in column_cells:
-                try:
-                    if cell.row == len(report_data) + 2:
-                        continue
-                    if cell.value:
-                        cell_len = len(str(cell.value).encode('gbk', 'ignore')) if any('\u4e00' <= char <= '\u9fff' for char in str(cell.value)) else len(str(cell.value))
-                        if cell_len > max_length:
-                            max_length = cell_len
-                except:
-                    pass
-            
-            adjusted_width = min(max(max_length + 2, 8), 50) 
-            
-            if header_text == C['NAME']:
-                adjusted_width = max(adjusted_width, 40)
-                
-            ws.column_dimensions[column_letter].width = adjusted_width
+        with warnings.catch_warnings():
+            # 表格列已在上面显式给出，openpyxl 在流式模式下仍会提示需手动添加列
+            warnings.filterwarnings('ignore', message='In write-only mode you must add table columns manually')
+            ws.add_table(table)
 
     # V8.0 MODIFIED: Replaced _save_workbook with _save_and_enhance_compatibility from v7.1
-    def _save_and_enhance_compatibility(self, wb, selected_brands, start_date, end_date):
+    def _save_and_enhance_compatibility(self, wb, selected_brands, start_date, end_date, stores=None):
         try:
-            brand_name = re.sub(r'[<>:"/\\|?*]', '', selected_brands[0])
-            if len(selected_brands) > 1:
-                brand_name += "等"
-            ts = datetime.now().strftime('%H%M%S')
-            filename = f"{brand_name}_{start_date.strftime('%Y%m%d')}-{end_date.strftime('%m%d')}_{ts}.xlsx"
+            filename = self._report_file_name(selected_brands, start_date, end_date, 'xlsx', stores)
             report_path = Config.get_report_path(filename)
 
             # 步骤1: 先由 openpyxl 保存文件
@@ -1002,66 +3115,73 @@ class ReportGenerator:
 
             return report_path
         except PermissionError:
-            messagebox.showerror("文件保存失败", f"请关闭已打开的Excel文件 '{os.path.basename(filename)}' 后重试。")
+            self.data_processor.notifier.error("文件保存失败", f"请关闭已打开的Excel文件 '{os.path.basename(filename)}' 后重试。")
             return None
         except Exception as e:
-            messagebox.showerror("文件保存失败", f"无法保存Excel文件:\n{e}")
+            self.data_processor.notifier.error("文件保存失败", f"无法保存Excel文件:\n{e}")
             return None
 
     # V6.5 MODIFIED: Added full dataframes to signature for weekly calculation
-    def _add_weekly_sheets(self, wb, master_products, filtered_sales, week_periods, styles, full_sales_df, full_flow_df, full_check_df):
+    def _add_weekly_sheets(self, wb, master_products, filtered_sales, week_bucketer, styles, full_sales_df, full_flow_df, full_check_df, daily_sales=None, report_result=None):
+        """为每个周度期间添加一张工作表
+
+        report_result 为报表缓存条目时，周度报表数据优先从中读取，首次计算后写回。
+        """
         print("📅 正在生成周度报表(v6.5 独立库存模式)...")
-        C = Config.STD_COLS
+        week_periods = week_bucketer.week_periods
 
         if not week_periods:
             print("ℹ️ 在选定范围内未找到任何期间。")
             return
 
+        weekly_frames = report_result.get('weekly_frames') if report_result is not None else None
+        if weekly_frames is None:
+            weekly_frames = self._build_weekly_frames(
+                master_products, filtered_sales, week_bucketer, full_sales_df, full_flow_df, full_check_df, daily_sales)
+            if report_result is not None:
+                report_result['weekly_frames'] = weekly_frames
+
         num_weeks = len(week_periods)
         for i, (week_start, week_end) in enumerate(week_periods):
             if self.progress_callback and num_weeks > 0:
                 progress = 85 + int(((i + 1) / num_weeks) * 10) # 85% to 95%
                 self.progress_callback(progress, f"正在生成周度报表: {i+1}/{num_weeks}")
 
-            week_start_inclusive = datetime.combine(week_start, datetime.min.time())
-            week_end_inclusive = datetime.combine(week_end, datetime.max.time())
-
-            weekly_sales = filtered_sales[
-                (filtered_sales[C['SALES_TIME']] >= week_start_inclusive) &
-                (filtered_sales[C['SALES_TIME']] <= week_end_inclusive)
-            ].copy()
-
-            if weekly_sales.empty:
+            if i not in weekly_frames:
                 continue
+            sheet_name = f"W_{week_start.strftime('%m%d')}-{week_end.strftime('%m%d')}"
+            ws_week = wb.create_sheet(title=sheet_name[:31])
+            print(f"  - 创建工作表: {sheet_name}")
 
-            weekly_summary = weekly_sales.groupby(C['BARCODE']).agg(
-                total_revenue=(C['REVENUE'], 'sum'),
-                total_orders=(C['ORDER_ID'], 'nunique'),
-                total_sales_qty=(C['SALES_QTY'], 'sum')
-            ).rename(columns={
-                'total_revenue': C['TOTAL_REVENUE'],
-                'total_orders': C['TOTAL_ORDERS'],
-                'total_sales_qty': C['TOTAL_SALES_QTY']
-            })
+            self._write_sheet_data(ws_week, f"WeekTable{i}", weekly_frames[i], styles)
 
-            weekly_sales['weekday'] = weekly_sales[C['SALES_TIME']].dt.weekday
-            weekday_sales_series = weekly_sales[weekly_sales['weekday'] < 5].groupby(C['BARCODE'])[C['SALES_QTY']].sum().rename('工作日销量')
-            weekend_sales_series = weekly_sales[weekly_sales['weekday'] >= 5].groupby(C['BARCODE'])[C['SALES_QTY']].sum().rename('周末销量')
-            
-            weekly_sales_summary = pd.concat([weekly_summary, weekday_sales_series, weekend_sales_series], axis=1).fillna(0).reset_index()
+    def _build_weekly_frames(self, master_products, filtered_sales, week_bucketer, full_sales_df, full_flow_df, full_check_df, daily_sales=None):
+        """计算各周的报表数据（已按备注、总销量排序）
 
-            sold_barcodes = weekly_sales_summary[C['BARCODE']].unique()
-            if len(sold_barcodes) == 0:
+        Returns:
+            dict: {周序号: 周度报表 DataFrame}，当周无销售的期间不含在内
+        """
+        C = Config.STD_COLS
+        week_periods = week_bucketer.week_periods
+
+        # 一次分组聚合得到所有周的汇总，每张周表只取其中一段
+        with self.monitor.stage('周度汇总') as record:
+            weekly_summaries = week_bucketer.weekly_summaries(filtered_sales, daily_sales)
+            record['rows_out'] = sum(len(summary) for summary in weekly_summaries.values())
+
+        # 各周周末的库存：从库存台账一次性查询全部 (条码, 周结束日)，代替逐周重新计算
+        with self.monitor.stage('周度库存') as record:
+            weekly_inventory = self._calculate_weekly_inventory(
+                weekly_summaries, week_periods, full_sales_df, full_flow_df, full_check_df)
+            record['rows_out'] = sum(len(inventory) for inventory in weekly_inventory.values())
+
+        weekly_frames = {}
+        for i in range(len(week_periods)):
+            if i not in weekly_summaries:
                 continue
-            
-            # V6.5 MODIFIED: Calculate inventory specifically for this week's end date
-            weekly_inventory_data = self.inventory_calc.calculate_inventory(
-                product_barcodes=sold_barcodes,
-                flow_df=full_flow_df,
-                check_df=full_check_df,
-                sales_df=full_sales_df,
-                end_date=week_end  # Pass the end date of the current week
-            )
+            weekly_sales_summary = weekly_summaries[i]
+            sold_barcodes = weekly_sales_summary[C['BARCODE']].unique()
+            weekly_inventory_data = weekly_inventory[i]
 
             weekly_report_data = master_products[master_products[C['BARCODE']].isin(sold_barcodes)].copy()
             # V6.5 MODIFIED: Merge the newly calculated weekly inventory
@@ -1076,13 +3196,497 @@ class ReportGenerator:
             weekly_report_data = weekly_report_data.reindex(columns=weekly_cols, fill_value=0)
             weekly_report_data[C['REMARK']] = weekly_report_data[C['REMARK']].fillna('')
 
-            weekly_report_data = self._apply_sorting(weekly_report_data, [{'field': C['REMARK'], 'order': '升序'}, {'field': C['TOTAL_SALES_QTY'], 'order': '降序'}])
+            weekly_frames[i] = self._apply_sorting(weekly_report_data, [{'field': C['REMARK'], 'order': '升序'}, {'field': C['TOTAL_SALES_QTY'], 'order': '降序'}])
+        return weekly_frames
 
-            sheet_name = f"W_{week_start.strftime('%m%d')}-{week_end.strftime('%m%d')}"
-            ws_week = wb.create_sheet(title=sheet_name[:31])
-            print(f"  - 创建工作表: {sheet_name}")
+    def _calculate_weekly_inventory(self, weekly_summaries, week_periods, full_sales_df, full_flow_df, full_check_df):
+        """计算每周销售过的商品在该周结束日的库存
+
+        Returns:
+            dict: 周序号 -> 库存数据（条码、库存量、最后进货日、备注）
+        """
+        C = Config.STD_COLS
+        ledger = self.inventory_calc.get_ledger(full_flow_df, full_check_df, full_sales_df)
+        if ledger is None:
+            return {
+                i: self.inventory_calc.calculate_inventory(
+                    product_barcodes=summary[C['BARCODE']].unique(), flow_df=full_flow_df,
+                    check_df=full_check_df, sales_df=full_sales_df, end_date=week_periods[i][1])
+                for i, summary in weekly_summaries.items()
+            }
+        if not weekly_summaries:
+            return {}
+        week_codes, barcodes, end_dates = [], [], []
+        for i, summary in weekly_summaries.items():
+            sold_barcodes = summary[C['BARCODE']].unique()
+            week_codes.append(np.full(len(sold_barcodes), i))
+            barcodes.append(sold_barcodes)
+            end_dates.extend([week_periods[i][1]] * len(sold_barcodes))
+        week_codes = np.concatenate(week_codes)
+        inventory = ledger.as_of(np.concatenate(barcodes), end_dates)
+        print(f"✅ 周度库存查询完成: {len(inventory)} 个 (商品, 周) 组合")
+        return {i: inventory[week_codes == i].reset_index(drop=True) for i in weekly_summaries}
+
+
+# ==================== 批量报表（命令行） ====================
+# 批处理工作进程的共享状态：数据在进程启动时传入一次，之后各任务复用
+_BATCH_STATE = {}
+
+def _init_batch_worker(data_frames, instrumentation=None):
+    """进程池初始化：保存已加载的数据并创建各组件（库存台账在同一进程的任务间复用）
+
+    子进程以 spawn 方式启动时不会继承主进程修改过的配置，运行监测设置随参数传入。
+    """
+    Config.INSTRUMENTATION.update(instrumentation or {})
+    dp = DataProcessor(ConsoleNotifier())
+    _BATCH_STATE.update(
+        data_frames=data_frames,
+        data_processor=dp,
+        product_manager=ProductManager(dp),
+        inventory_calc=InventoryCalculator(dp),
+        sales_analyzer=SalesAnalyzer(dp)
+    )
+
+def _batch_report_worker(brands, start_date, end_date, sort_params, export_format, stores=None):
+    """进程池任务：生成一份报表，并以字典返回结构化结果
+
+    Returns:
+        dict: brands、status（success / failed）、report_path、seconds、stages（各阶段计时）、error、messages
+    """
+    state = _BATCH_STATE
+    notifier = ConsoleNotifier()
+    state['data_processor'].notifier = notifier
+    started = time.perf_counter()
+    result = {'brands': list(brands), 'status': 'failed', 'report_path': None, 'error': None}
+    generator = ReportGenerator(state['data_processor'], state['inventory_calc'],
+                                state['sales_analyzer'], state['product_manager'])
+    try:
+        success, report_path = generator.generate_report(
+            state['data_frames'], list(brands), start_date, end_date, sort_params, export_format, stores)
+        if success:
+            result.update(status='success', report_path=os.path.abspath(report_path))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    if result['status'] == 'failed' and not result['error']:
+        errors = [m['message'] for m in notifier.messages if m['level'] == 'error']
+        result['error'] = errors[-1] if errors else "报表生成失败"
+    result['seconds'] = round(time.perf_counter() - started, 2)
+    result['stages'] = generator.monitor.results()
+    result['messages'] = notifier.messages
+    return result
+
+def default_sort_params(brand_count):
+    """与界面一致的默认排序规则：多品牌报表额外按品牌排序"""
+    C = Config.STD_COLS
+    rules = [{'field': C['REMARK'], 'order': '升序'}]
+    if brand_count > 1:
+        rules.append({'field': C['BRAND'], 'order': '升序'})
+    rules.append({'field': C['TOTAL_SALES_QTY'], 'order': '降序'})
+    return rules
+
+def parse_cli_args(argv=None):
+    parser = argparse.ArgumentParser(description="供应商销售报表生成器（不带参数运行时启动图形界面）")
+    parser.add_argument('--batch', action='store_true', help="无界面批量生成报表")
+    parser.add_argument('--brands', nargs='+', metavar='品牌', help="要生成报表的品牌（默认全部品牌）")
+    parser.add_argument('--combined', action='store_true', help="所选品牌合并为一份报表，而不是每个品牌一份")
+    parser.add_argument('--stores', nargs='+', metavar='门店', help="只统计这些门店的销售（默认全部门店）")
+    parser.add_argument('--start', help="开始日期 YYYY-MM-DD（默认结束日期前29天）")
+    parser.add_argument('--end', help="结束日期 YYYY-MM-DD（默认最后销售日）")
+    parser.add_argument('--format', choices=['excel', 'csv'], default='excel', help="导出格式")
+    parser.add_argument('--sort', nargs='+', metavar='字段:升序|降序', help="排序规则，如 备注:升序 总销量:降序")
+    parser.add_argument('--workers', type=int, help=f"并行进程数（默认 {Config.BATCH_REPORT['max_workers']}）")
+    parser.add_argument('--results', help="结构化结果输出路径（JSON，默认保存到报表文件夹）")
+    parser.add_argument('--profile', action='store_true', help="用 cProfile 分析并保存每次运行中最慢的阶段（保存在 缓存/profiles）")
+    parser.add_argument('--trace-memory', action='store_true', help="用 tracemalloc 记录各阶段内存峰值（会明显变慢）")
+    bench = parser.add_argument_group("性能基准")
+    bench.add_argument('--benchmark', action='store_true', help="用合成数据运行完整流程的性能基准")
+    bench.add_argument('--bench-sales', type=int, default=100000, help="销售流水行数（默认 100000）")
+    bench.add_argument('--bench-skus', type=int, default=5000, help="商品数（默认 5000）")
+    bench.add_argument('--bench-brands', type=int, default=20, help="品牌数（默认 20）")
+    bench.add_argument('--bench-days', type=int, default=365, help="销售数据覆盖的天数（默认 365）")
+    bench.add_argument('--bench-seed', type=int, default=0, help="随机种子（默认 0）")
+    bench.add_argument('--bench-report-brands', type=int, default=1, help="报表包含的品牌数，取商品最多的品牌（默认 1）")
+    bench.add_argument('--bench-report-days', type=int, default=90, help="报表日期范围天数，截至数据最后一天（默认 90）")
+    bench.add_argument('--bench-dir', help="基准数据和结果文件夹（默认 缓存/benchmark）")
+    bench.add_argument('--bench-regenerate', action='store_true', help="强制重新生成基准数据")
+    bench.add_argument('--bench-no-memory', action='store_true', help="不跟踪内存峰值（tracemalloc 会拖慢纯 Python 代码）")
+    bench.add_argument('--compare', metavar='JSON', help="与之前的基准结果对比耗时")
+    return parser.parse_args(argv)
+
+def run_batch(args):
+    """命令行批处理：数据只加载一次，再按品牌并行生成报表
+
+    Returns:
+        int: 进程退出码，全部成功为 0，有失败的报表为 1，数据无法加载为 2
+    """
+    Config.ensure_folders()
+    dp = DataProcessor(ConsoleNotifier())
+    data_frames, _ = ProductManager(dp).load_and_prep_data(
+        progress_callback=lambda value, status: print(f"⏳ {value}% {status}"))
+    sales_df = data_frames.get('sales')
+    if sales_df is None or sales_df.empty:
+        print(f"❌ 销售数据 ({Config.FILE_PATTERNS['sales']}) 未找到或为空。")
+        return 2
+
+    all_brands = ProductManager(dp).get_all_brands(data_frames['product'], sales_df)
+    brands = args.brands or all_brands
+    unknown = [b for b in brands if b not in all_brands]
+    if unknown:
+        print(f"⚠️ 以下品牌不在商品资料中: {', '.join(unknown)}")
+    if not brands:
+        print("❌ 无法找到品牌信息。")
+        return 2
+
+    last_sale = sales_df[Config.STD_COLS['SALES_TIME']].max()
+    end_date = datetime.strptime(args.end, "%Y-%m-%d") if args.end else datetime(last_sale.year, last_sale.month, last_sale.day)
+    start_date = datetime.strptime(args.start, "%Y-%m-%d") if args.start else end_date - timedelta(days=29)
+
+    stores = args.stores
+    if stores:
+        all_stores = ProductManager.get_all_stores(sales_df)
+        unknown = [s for s in stores if s not in all_stores]
+        if unknown:
+            print(f"⚠️ 以下门店不在销售数据中: {', '.join(unknown)}")
+
+    tasks = [brands] if args.combined else [[b] for b in brands]
+    sort_rules = None
+    if args.sort:
+        sort_rules = []
+        for rule in args.sort:
+            field, _, order = rule.partition(':')
+            sort_rules.append({'field': field, 'order': order or '升序'})
+
+    workers = min(args.workers or Config.BATCH_REPORT['max_workers'], len(tasks), os.cpu_count() or 1)
+    print(f"🚀 批量生成 {len(tasks)} 份报表: {start_date:%Y-%m-%d} 至 {end_date:%Y-%m-%d}，{workers} 个进程")
+    started = time.perf_counter()
+    results = []
+
+    def task_args(task):
+        return (task, start_date, end_date, sort_rules or default_sort_params(len(task)), args.format, stores)
+
+    def collect(result):
+        results.append(result)
+        mark = '✅' if result['status'] == 'success' else '❌'
+        detail = os.path.basename(result['report_path']) if result['report_path'] else result['error']
+        print(f"{mark} [{len(results)}/{len(tasks)}] {'、'.join(result['brands'])}: {detail} ({result['seconds']}s)")
+
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                     initargs=(data_frames, dict(Config.INSTRUMENTATION))) as pool:
+                futures = [pool.submit(_batch_report_worker, *task_args(task)) for task in tasks]
+                for future in as_completed(futures):
+                    collect(future.result())
+        except Exception as e:
+            print(f"⚠️ 进程池不可用，改为顺序生成: {e}")
+    if len(results) < len(tasks):
+        done = {tuple(r['brands']) for r in results}
+        _init_batch_worker(data_frames)
+        for task in tasks:
+            if tuple(task) not in done:
+                collect(_batch_report_worker(*task_args(task)))
+
+    failed = [r for r in results if r['status'] != 'success']
+    summary = {
+        'start_date': start_date.strftime("%Y-%m-%d"),
+        'end_date': end_date.strftime("%Y-%m-%d"),
+        'format': args.format,
+        'stores': stores or [],
+        'total': len(results),
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+        'seconds': round(time.perf_counter() - started, 2),
+        'results': sorted(results, key=lambda r: r['brands'])
+    }
+    results_path = args.results or Config.get_report_path(f"batch_results_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"📋 完成: 成功 {summary['succeeded']}，失败 {summary['failed']}，耗时 {summary['seconds']}s，结果已保存至 {results_path}")
+    return 1 if failed else 0
+
+
+# ==================== 性能基准 ====================
+# Excel 单个工作表最多 1,048,576 行（含表头）
+EXCEL_MAX_ROWS = 1048575
+BENCHMARK_START = datetime(2024, 1, 1)
+
+def generate_benchmark_frames(sales_rows, skus, brands, days, seed=0):
+    """生成可复现的合成数据（商品资料、销售流水、货流、盘点），列名与真实导出文件一致
+
+    品牌规模和商品热度均为长尾分布；每笔订单平均 2 行，少量退货为负数。
+
+    Returns:
+        dict: 'product' / 'sales' / 'inventory_flow' / 'inventory_check' -> 原始列名的 DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    barcodes = np.char.add('69', np.char.zfill(np.arange(skus).astype(str), 11))
+    brand_names = np.array([f"品牌{i:03d}" for i in range(brands)])
+    brand_weights = 1 / np.arange(1, brands + 1)
+    sku_brand = rng.choice(brands, skus, p=brand_weights / brand_weights.sum())
+    price = np.round(rng.lognormal(2.5, 0.8, skus), 1).clip(0.5, 999)
+    product = pd.DataFrame({
+        '商品品牌': brand_names[sku_brand],
+        '商品条码': barcodes,
+        '名称（必填）': np.char.add('商品', np.arange(skus).astype(str)),
+        '规格': rng.choice(['500ml', '1L', '250g', '1kg', '10片'], skus),
+        '销售价（必填）': price,
+    })
+
+    n_orders = max(1, sales_rows // 2)
+    order_seconds = np.sort(rng.integers(0, days * 86400, n_orders))
+    line_orders = np.sort(rng.integers(0, n_orders, sales_rows))
+    sku_weights = 1 / np.arange(1, skus + 1) ** 0.9
+    line_skus = rng.permutation(skus)[rng.choice(skus, sales_rows, p=sku_weights / sku_weights.sum())]
+    qty = rng.choice(np.array([1, 1, 1, 1, 2, 2, 3, -1], dtype=float), sales_rows)
+    sales = pd.DataFrame({
+        '销售时间': np.datetime64(BENCHMARK_START, 's') + order_seconds[line_orders].astype('timedelta64[s]'),
+        '商品条码': pd.Categorical.from_codes(line_skus, barcodes),
+        '商品品牌': pd.Categorical.from_codes(sku_brand[line_skus], brand_names),
+        '实收金额': np.round(qty * price[line_skus] * rng.uniform(0.8, 1.0, sales_rows), 2),
+        '销售数量': qty,
+        '流水号': pd.Categorical.from_codes(line_orders, np.char.add('POS', np.char.zfill(np.arange(n_orders).astype(str), 10))),
+    })
+
+    n_flow = min(skus * max(1, days // 14), EXCEL_MAX_ROWS)
+    flow_qty = rng.integers(6, 121, n_flow)
+    received = flow_qty.astype(str).astype(object)
+    received[rng.random(n_flow) < 0.15] = '-'
+    flow = pd.DataFrame({
+        '商品条码': barcodes[rng.integers(0, skus, n_flow)],
+        '下单时间': np.datetime64(BENCHMARK_START, 's') + rng.integers(-30 * 86400, days * 86400, n_flow).astype('timedelta64[s]'),
+        '实收量': received,
+        '货流量': flow_qty,
+    })
+
+    n_check = min(skus, EXCEL_MAX_ROWS)
+    check = pd.DataFrame({
+        '商品条码': barcodes[rng.integers(0, skus, n_check)],
+        '盘点时间': np.datetime64(BENCHMARK_START, 's') + rng.integers(0, days * 86400, n_check).astype('timedelta64[s]'),
+        '差异库存': rng.integers(-3, 4, n_check),
+    })
+    return {'product': product, 'sales': sales, 'inventory_flow': flow, 'inventory_check': check}
+
+def write_benchmark_sheet(path, frame, chunk_size=50000):
+    """用流式工作簿分块写出 DataFrame，内存占用与总行数无关"""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(frame.columns))
+    for begin in range(0, len(frame), chunk_size):
+        chunk = frame.iloc[begin:begin + chunk_size]
+        columns = [chunk[col].dt.to_pydatetime().tolist() if pd.api.types.is_datetime64_any_dtype(chunk[col])
+                   else np.asarray(chunk[col]).tolist() for col in chunk.columns]
+        for row in zip(*columns):
+            ws.append(row)
+    wb.save(path)
+
+def prepare_benchmark_data(data_dir, params, regenerate=False):
+    """在基准数据文件夹中生成源文件；参数未变且文件齐全时直接复用
+
+    销售行数超过 Excel 单表上限时不写销售文件，由基准测试直接把内存中的
+    销售数据交给预处理（此时加载阶段不含销售文件的 Excel 解析）。
+
+    Returns:
+        tuple: (数据说明字典, 内存中的原始销售数据或 None)
+    """
+    marker = os.path.join(data_dir, 'benchmark.json')
+    sales_in_memory = params['sales_rows'] > EXCEL_MAX_ROWS
+    info = None
+    if not regenerate and os.path.exists(marker):
+        with open(marker, encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get('params') != params or not all(os.path.exists(os.path.join(data_dir, name)) for name in info['files']):
+            info = None
+    if info is not None and not sales_in_memory:
+        print(f"♻️ 复用基准数据: {data_dir}")
+        return info, None
+
+    frames = generate_benchmark_frames(params['sales_rows'], params['skus'], params['brands'], params['days'], params['seed'])
+    if info is None:
+        print(f"🧪 生成基准数据: 销售 {params['sales_rows']} 行, 商品 {params['skus']} 个, 品牌 {params['brands']} 个 -> {data_dir}")
+        if os.path.exists(data_dir):
+            shutil.rmtree(data_dir)
+        os.makedirs(data_dir)
+        files = {'product': '商品资料_benchmark.xlsx', 'inventory_flow': Config.FILE_PATTERNS['inventory_flow'],
+                 'inventory_check': Config.FILE_PATTERNS['inventory_check']}
+        if not sales_in_memory:
+            files['sales'] = Config.FILE_PATTERNS['sales']
+        for kind, name in files.items():
+            started = time.perf_counter()
+            write_benchmark_sheet(os.path.join(data_dir, name), frames[kind])
+            print(f"  - {name}: {len(frames[kind])} 行 ({time.perf_counter() - started:.1f}s)")
+        product_counts = frames['product']['商品品牌'].value_counts()
+        info = {
+            'params': params,
+            'files': list(files.values()),
+            'rows': {kind: len(frame) for kind, frame in frames.items()},
+            'largest_brands': product_counts.index.tolist(),
+            'sales_source': 'memory' if sales_in_memory else 'excel',
+        }
+        with open(marker, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+    return info, frames['sales'] if sales_in_memory else None
+
+def check_ledger_consistency(data_frames, end_dates, max_products=500):
+    """回归检查：库存台账的截止日期查询须与 calculate_inventory(end_date=...) 完全一致
 
-            self._write_sheet_data(ws_week, f"WeekTable{i}", weekly_report_data, styles)
+    盘点数据按原样和去掉日期列（所有盘点记录始终计入）各检查一次。
+
+    Returns:
+        list: 每种情况一项 {'case', 'end_dates', 'products', 'mismatches'}，mismatches 为
+            库存量、最后进货日或备注不一致的 (商品, 截止日期) 数
+    """
+    C, M = Config.STD_COLS, Config.COLUMN_MAPPINGS
+    calc = InventoryCalculator(DataProcessor(ConsoleNotifier()))
+    product_df, flow_df, sales_df = data_frames['product'], data_frames['inventory_flow'], data_frames['sales']
+    barcode_col = DataProcessor.find_column(product_df, M['barcode'])
+    barcodes = list(pd.unique(product_df[barcode_col].astype(str).to_numpy()))[:max_products] if barcode_col else []
+    check_df = data_frames['inventory_check']
+    cases = {'盘点有日期': check_df, '盘点无日期': check_df.drop(columns=['日期'], errors='ignore')}
+    columns = [C['STOCK'], C['LAST_INBOUND_DATE'], C['REMARK']]
+    results = []
+    for case, check in cases.items():
+        ledger = InventoryLedger(flow_df, check, sales_df)
+        mismatches = 0
+        for end_date in end_dates:
+            expected = calc.calculate_inventory(barcodes, flow_df, check, sales_df, end_date=end_date)
+            actual = ledger.as_of(barcodes, end_date)
+            for col in columns:
+                differs = expected[col].fillna('').astype(str).to_numpy() != actual[col].fillna('').astype(str).to_numpy()
+                mismatches += int(differs.sum())
+        mark = '✅' if mismatches == 0 else '❌'
+        print(f"{mark} 库存台账一致性（{case}）: {len(barcodes)} 个商品 × {len(end_dates)} 个截止日期，不一致 {mismatches} 处")
+        results.append({'case': case, 'end_dates': [str(d) for d in end_dates], 'products': len(barcodes),
+                        'mismatches': mismatches})
+    return results
+
+def _benchmark_pass(info, memory_sales, params, args, trace_memory):
+    """跑一遍冷启动加载、缓存加载和一份报表；不跟踪内存时另做库存台账一致性检查
+
+    Returns:
+        tuple: (StageTimer, 报表是否成功, 报表品牌, 报表内部各阶段结果, 一致性检查结果)
+    """
+    if os.path.exists(Config.FOLDERS['cache']):
+        shutil.rmtree(Config.FOLDERS['cache'])
+    Config.ensure_folders()
+    timer = StageTimer('benchmark', trace_memory=False, profile=False)
+    dp = DataProcessor(ConsoleNotifier())
+    pm = ProductManager(dp)
+    if memory_sales is not None:
+        # 内存中的销售数据只能在主进程交给预处理；空的占位文件使路径解析和缓存照常工作
+        Config.PARALLEL_LOAD['enabled'] = False
+        pm._read_sales_batches = lambda *a, **k: pm._prep_sales_df(memory_sales.copy())
+        open(Config.get_file_path('sales'), 'w').close()
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with timer.stage('load_and_prep_data') as record:
+            data_frames, _ = pm.load_and_prep_data()
+            record['rows_out'] = len(data_frames['sales'])
+        with timer.stage('load_and_prep_data (缓存)') as record:
+            data_frames, _ = pm.load_and_prep_data()
+            record['rows_out'] = len(data_frames['sales'])
+
+        inventory_calc, sales_analyzer = InventoryCalculator(dp), SalesAnalyzer(dp)
+        generator = ReportGenerator(dp, inventory_calc, sales_analyzer, pm)
+        timer.wrap(inventory_calc, 'calculate_inventory', 'calculate_inventory',
+                   lambda a, k, r: (len(a[0]), len(r)), unit='products')
+        timer.wrap(sales_analyzer, 'analyze_sales', 'analyze_sales',
+                   lambda a, k, r: (len(a[4]) if len(a) > 4 and a[4] is not None else len(a[0]), len(r)), unit='rows')
+        timer.wrap(generator, '_add_weekly_sheets', '_add_weekly_sheets',
+                   lambda a, k, r: (len(k['week_bucketer'].week_periods), None), unit='weeks')
+        timer.wrap(generator, '_write_sheet_data', '_write_sheet_data',
+                   lambda a, k, r: (len(a[2]), None), unit='rows')
+        timer.wrap(generator, '_save_and_enhance_compatibility', 'save',
+                   lambda a, k, r: (timer.stages['_write_sheet_data']['rows_in'], None), unit='rows')
+
+        brands = info['largest_brands'][:args.bench_report_brands]
+        end_date = BENCHMARK_START + timedelta(days=params['days'] - 1)
+        start_date = end_date - timedelta(days=args.bench_report_days - 1)
+        with timer.stage('generate_report', unit='reports') as record:
+            success, _ = generator.generate_report(
+                data_frames, brands, start_date, end_date, default_sort_params(len(brands)), 'excel')
+            record['rows_out'] = int(bool(success))
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    checks = []
+    if not trace_memory:
+        week_ends = pd.date_range(start_date, end_date, freq='W-SUN').to_pydatetime().tolist() + [end_date]
+        checks = check_ledger_consistency(data_frames, week_ends[-4:])
+    return timer, success, brands, generator.monitor.results(), checks
+
+def run_benchmark(args):
+    """用合成数据跑完整的加载和报表流程，逐阶段记录耗时、吞吐量和内存峰值并输出 JSON 结果
+
+    tracemalloc 会让纯 Python 代码（如 openpyxl 写单元格）慢数倍，因此耗时来自
+    不跟踪内存的一遍，内存峰值来自另一遍跟踪内存的运行。
+
+    Returns:
+        int: 进程退出码，报表生成失败或库存台账一致性检查不通过为 1
+    """
+    root = args.bench_dir or os.path.join(Config.FOLDERS['cache'], 'benchmark')
+    params = {'sales_rows': args.bench_sales, 'skus': args.bench_skus, 'brands': args.bench_brands,
+              'days': args.bench_days, 'seed': args.bench_seed}
+    saved_folders, saved_parallel = dict(Config.FOLDERS), dict(Config.PARALLEL_LOAD)
+    Config.FOLDERS.update(data=os.path.join(root, '主数据'), reports=os.path.join(root, '报表'), cache=os.path.join(root, '缓存'))
+    try:
+        info, memory_sales = prepare_benchmark_data(Config.FOLDERS['data'], params, args.bench_regenerate)
+        print("⏱️ 基准测试：计时")
+        timer, success, brands, report_stages, checks = _benchmark_pass(info, memory_sales, params, args, trace_memory=False)
+        stages = timer.results()
+        if not args.bench_no_memory:
+            print("💾 基准测试：内存峰值")
+            memory_timer = _benchmark_pass(info, memory_sales, params, args, trace_memory=True)[0]
+            for stage in stages:
+                stage['peak_mb'] = memory_timer.stages.get(stage['stage'], {}).get('peak_mb')
+        else:
+            for stage in stages:
+                stage['peak_mb'] = None
+    finally:
+        Config.FOLDERS.clear()
+        Config.FOLDERS.update(saved_folders)
+        Config.PARALLEL_LOAD.clear()
+        Config.PARALLEL_LOAD.update(saved_parallel)
+
+    results = {
+        'benchmark': 'v8.0',
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                        'pandas': pd.__version__, 'numpy': np.__version__},
+        'params': dict(params, report_brands=brands, report_days=args.bench_report_days),
+        'data': {'rows': info['rows'], 'sales_source': info['sales_source']},
+        'config': {'parallel_load': saved_parallel['enabled'] and memory_sales is None,
+                   'excel_write_only': Config.EXCEL_WRITER['write_only']},
+        'report_rows': timer.stages['_write_sheet_data']['rows_in'] if '_write_sheet_data' in timer.stages else 0,
+        'stages': stages,
+        'report_stages': report_stages,
+        'checks': checks,
+    }
+    if not args.results:
+        Config.ensure_folders()
+    results_path = args.results or Config.get_report_path(f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(f"\n{'阶段':<32}{'次数':>6}{'耗时(s)':>10}{'吞吐量':>20}{'峰值内存(MB)':>14}")
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = {stage['stage']: stage for stage in json.load(f)['stages']}
+    for stage in results['stages']:
+        throughput = '-'
+        if stage['throughput']:
+            throughput = f"{stage['throughput']:.0f} {stage['unit']}/s" if stage['throughput'] >= 100 else f"{stage['throughput']:.2f} {stage['unit']}/s"
+        peak = f"{stage['peak_mb']:.1f}" if stage['peak_mb'] is not None else '-'
+        line = f"{stage['stage']:<32}{stage['calls']:>6}{stage['seconds']:>10.3f}{throughput:>20}{peak:>14}"
+        old = baseline.get(stage['stage'])
+        if old and stage['seconds'] > 0:
+            line += f"   对比基线 {old['seconds'] / stage['seconds']:.2f}x"
+        print(line)
+    print(f"📋 基准结果已保存至 {results_path}")
+    return 0 if success and not any(check['mismatches'] for check in checks) else 1
 
 
 # ==================== 主GUI界面 ====================
@@ -1107,15 +3711,17 @@ class SupplierReportGUI:
         self.inventory_calc = InventoryCalculator(self.data_processor)
         self.sales_analyzer = SalesAnalyzer(self.data_processor)
         self.data_status_manager = DataStatusManager()
-        self.data_frames, self.product_file_path, self.all_brands, self.brand_vars = {}, None, [], {}
+        self.report_cache = ReportCache() if Config.REPORT_CACHE['enabled'] else None
+        self.quality_issues = []
+        self.data_frames, self.product_file_path, self.all_brands, self.all_stores = {}, None, [], []
         self.reference_date = datetime.now()
         self.end_date = self.reference_date
         self.start_date = self.reference_date - timedelta(days=29)
         self.export_format = tk.StringVar(value="excel")  # 默认导出格式
-        self.mouse_in_brand_area = False  # 跟踪鼠标是否在品牌区域
         self.setup_ui()
         self.last_selected_brand_count = 0
-        self.load_data_with_progress()
+        # 先让主窗口显示出来，再在后台加载数据
+        self.root.after_idle(self.load_data_with_progress)
 
     def setup_ui(self):
         main_frame = ttk.Frame(self.root, padding="15")
@@ -1162,26 +3768,10 @@ class SupplierReportGUI:
         self.search_var.trace('w', lambda *args: self.filter_brands())
         ttk.Entry(search_frame, textvariable=self.search_var).pack(side=tk.LEFT, padx=(5, 0), fill=tk.X, expand=True)
 
-        canvas_frame = ttk.Frame(brand_frame)
-        canvas_frame.grid(row=1, column=0, sticky="nsew")
-        canvas_frame.grid_rowconfigure(0, weight=1)
-        canvas_frame.grid_columnconfigure(0, weight=1)
-
-        self.canvas = tk.Canvas(canvas_frame, highlightthickness=0)
-        scrollbar = ttk.Scrollbar(canvas_frame, orient="vertical", command=self.canvas.yview)
-        self.scrollable_frame = ttk.Frame(self.canvas)
-        self.scrollable_frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-        self.canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=scrollbar.set)
-        self.canvas.grid(row=0, column=0, sticky="nsew")
-        scrollbar.grid(row=0, column=1, sticky="ns")
-        
-        # 绑定鼠标进入和离开事件
-        self.canvas.bind("<Enter>", self._on_mouse_enter_brand_area)
-        self.canvas.bind("<Leave>", self._on_mouse_leave_brand_area)
-        # 只在品牌区域响应滚轮事件
-        self.canvas.bind("<MouseWheel>", self._on_mousewheel)
-        
+        # 虚拟化列表：只绘制可见行，勾选状态保存在布尔数组中
+        self.brand_list = BrandListView(brand_frame, on_change=self.on_brand_selection_change)
+        self.brand_list.grid(row=1, column=0, sticky="nsew")
+
         btn_frame = ttk.Frame(brand_frame)
         btn_frame.grid(row=2, column=0, sticky="ew", pady=(5, 0))
         ttk.Button(btn_frame, text="全选", command=self.select_all_brands).pack(side=tk.LEFT, padx=(0, 5))
@@ -1190,19 +3780,6 @@ class SupplierReportGUI:
 
         return brand_frame
 
-    def _on_mouse_enter_brand_area(self, event):
-        """鼠标进入品牌区域"""
-        self.mouse_in_brand_area = True
-
-    def _on_mouse_leave_brand_area(self, event):
-        """鼠标离开品牌区域"""
-        self.mouse_in_brand_area = False
-
-    def _on_mousewheel(self, event):
-        """只在品牌区域处理滚轮事件"""
-        if self.mouse_in_brand_area:
-            self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
-
     def _create_time_selection_area(self, parent):
         time_frame = ttk.LabelFrame(parent, text="时间范围设置", padding="10")
         self.start_date_var = tk.StringVar(value=self.start_date.strftime("%Y-%m-%d"))
@@ -1222,7 +3799,14 @@ class SupplierReportGUI:
         format_frame.grid(row=3, column=0, columnspan=2, sticky="w", pady=5)
         ttk.Radiobutton(format_frame, text="Excel (.xlsx)", variable=self.export_format, value="excel").pack(side=tk.LEFT)
         ttk.Radiobutton(format_frame, text="CSV (.csv)", variable=self.export_format, value="csv").pack(side=tk.LEFT, padx=(10, 0))
-        
+
+        # 门店筛选：多选，不选表示全部门店；销售数据不区分门店时禁用
+        ttk.Label(time_frame, text="门店（不选为全部）:").grid(row=4, column=0, sticky="w", pady=(10, 0))
+        self.store_listbox = tk.Listbox(time_frame, selectmode=tk.MULTIPLE, height=4, exportselection=False,
+                                        font=("微软雅黑", 9))
+        self.store_listbox.grid(row=5, column=0, columnspan=3, sticky="ew", pady=5)
+        self.populate_store_list()
+
         return time_frame
 
     def _create_sort_settings_area(self, parent):
@@ -1249,33 +3833,45 @@ class SupplierReportGUI:
         return btn_frame
 
     def load_data_with_progress(self):
-        progress_dialog = ProgressDialog(self.root, "正在加载数据...")
+        # 工作线程只通过通道汇报进度和投递回调，由进度对话框在主线程按帧处理
+        channel = ProgressChannel()
+        progress_dialog = ProgressDialog(self.root, "正在加载数据...", channel)
+        self.data_processor.notifier.channel = channel
 
         def load_data_thread():
             try:
-                progress_dialog.update_progress(10, "加载和预处理数据...")
-                self.data_frames, self.product_file_path = self.product_manager.load_and_prep_data()
+                channel.progress(2, "准备数据处理组件...")
+                warm_up_imports()
+                channel.progress(10, "加载和预处理数据...")
+                self.data_frames, self.product_file_path = self.product_manager.load_and_prep_data(
+                    progress_callback=channel.progress)
                 sales_df = self.data_frames.get('sales')
                 if sales_df is None or sales_df.empty:
-                    self.root.after(0, lambda: [messagebox.showerror("严重错误", "销售数据 (sales_data.xlsx) 未找到或为空。" ), progress_dialog.destroy()])
+                    channel.post(lambda: [messagebox.showerror("严重错误", f"销售数据 ({Config.FILE_PATTERNS['sales']}) 未找到或为空。"), progress_dialog.destroy()])
                     return
 
-                progress_dialog.update_progress(60, "分析品牌信息...")
+                channel.progress(60, "分析品牌信息...")
                 self.all_brands = self.product_manager.get_all_brands(self.data_frames['product'], sales_df)
+                self.all_stores = ProductManager.get_all_stores(sales_df)
                 if not self.all_brands:
-                    self.root.after(0, lambda: [messagebox.showerror("错误", "无法找到品牌信息。" ), progress_dialog.destroy()])
+                    channel.post(lambda: [messagebox.showerror("错误", "无法找到品牌信息。" ), progress_dialog.destroy()])
                     return
 
-                progress_dialog.update_progress(80, "更新数据状态...")
+                channel.progress(80, "更新数据状态...")
                 self.data_status_manager.update_all_statuses(self.data_frames, self.product_file_path)
+                channel.progress(90, "检查数据质量...")
+                self.quality_issues = DataQualityChecker.check_data_quality(self.data_frames)
                 last_sale = sales_df[Config.STD_COLS['SALES_TIME']].max()
                 self.reference_date = datetime(last_sale.year, last_sale.month, last_sale.day)
                 self.end_date, self.start_date = self.reference_date, self.reference_date - timedelta(days=29)
 
-                progress_dialog.update_progress(100, "加载完成！")
-                self.root.after(0, lambda: [self.finalize_data_loading(), progress_dialog.destroy()])
+                channel.progress(100, "加载完成！")
+                channel.post(lambda: [self.finalize_data_loading(), progress_dialog.destroy()])
+            except OperationCancelled:
+                print("⏹️ 数据加载已取消")
+                channel.post(lambda: [self.status_var.set("数据加载已取消，请重新启动程序加载数据。"), progress_dialog.destroy()])
             except Exception as e:
-                self.root.after(0, lambda: [messagebox.showerror("加载错误", f"数据加载时出错: {e}"), progress_dialog.destroy()])
+                channel.post(lambda e=e: [messagebox.showerror("加载错误", f"数据加载时出错: {e}"), progress_dialog.destroy()])
                 import traceback
                 traceback.print_exc()
 
@@ -1285,17 +3881,16 @@ class SupplierReportGUI:
         self.start_date_var.set(self.start_date.strftime("%Y-%m-%d"))
         self.end_date_var.set(self.end_date.strftime("%Y-%m-%d"))
         self.create_brand_checkboxes()
-        self.update_data_status_display(self.data_status_manager.get_status_display_text())
+        self.populate_store_list()
+        status_text = (self.data_status_manager.get_status_display_text() + "\n" +
+                       self.product_manager.monitor.summary_line("数据加载"))
+        self.update_data_status_display(status_text)
         self.status_var.set(f"数据加载完成，共找到 {len(self.all_brands)} 个品牌。")
         
-        # 执行数据质量检查
-        quality_issues = DataQualityChecker.check_data_quality(self.data_frames)
-        if quality_issues:
-            issue_text = "\n".join([f"⚠️ {issue}" for issue in quality_issues])
-            self.update_data_status_display(
-                self.data_status_manager.get_status_display_text() + 
-                f"\n\n数据质量检查发现问题:\n{issue_text}"
-            )
+        # 数据质量检查已在加载线程中完成
+        if self.quality_issues:
+            issue_text = "\n".join([f"⚠️ {issue}" for issue in self.quality_issues])
+            self.update_data_status_display(status_text + f"\n\n数据质量检查发现问题:\n{issue_text}")
 
     def update_data_status_display(self, text):
         self.status_text.config(state=tk.NORMAL)
@@ -1303,58 +3898,40 @@ class SupplierReportGUI:
         self.status_text.insert(1.0, text)
         self.status_text.config(state=tk.DISABLED)
 
-    def create_brand_checkboxes(self):
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
-        search_text = self.search_var.get().lower()
-        brands_to_show = [b for b in self.all_brands if search_text in b.lower()] if search_text else self.all_brands
-        self.brand_vars = {brand: self.brand_vars.get(brand, tk.BooleanVar()) for brand in self.all_brands}
-        for brand in brands_to_show:
-            cb = ttk.Checkbutton(self.scrollable_frame, text=brand, variable=self.brand_vars[brand])
-            cb.pack(anchor=tk.W, padx=5, pady=2)
-            self.brand_vars[brand].trace_add('write', self.on_brand_selection_change)
-        
-        # 根据显示项数量决定是否启用滚轮
-        # 当匹配项>=5时允许滚动，并设置合适的滚动范围
-        self.root.unbind_all("<MouseWheel>")  # 解除全局绑定
-        if len(brands_to_show) >= 5:
-            # 计算合适的滚动区域，避免滚动过多
-            item_height = 25  # 估算每个品牌项的高度
-            total_height = len(brands_to_show) * item_height
-            visible_height = 10 * item_height  # 假设可显示10个项目
-            if total_height > visible_height:
-                # 设置滚动区域
-                self.canvas.configure(scrollregion=(0, 0, 0, total_height))
+    def populate_store_list(self):
+        self.store_listbox.config(state=tk.NORMAL)
+        self.store_listbox.delete(0, tk.END)
+        if self.all_stores:
+            for store in self.all_stores:
+                self.store_listbox.insert(tk.END, store)
         else:
-            # 禁用滚动
-            self.canvas.configure(scrollregion=(0, 0, 0, 0))
+            self.store_listbox.insert(tk.END, "（销售数据不区分门店）")
+            self.store_listbox.config(state=tk.DISABLED)
+
+    def get_selected_stores(self):
+        if not self.all_stores:
+            return []
+        return [self.all_stores[i] for i in self.store_listbox.curselection()]
+
+    def create_brand_checkboxes(self):
+        self.brand_list.set_items(self.all_brands, self.search_var.get())
 
     def filter_brands(self):
-        self.create_brand_checkboxes()
+        self.brand_list.set_filter(self.search_var.get())
 
     def select_all_brands(self):
-        for var in self._get_visible_brand_vars():
-            var.set(True)
+        self.brand_list.select_visible(True)
 
     def clear_brand_selection(self):
-        for var in self._get_visible_brand_vars():
-            var.set(False)
+        self.brand_list.select_visible(False)
 
     def invert_brand_selection(self):
-        for var in self._get_visible_brand_vars():
-            var.set(not var.get())
-
-    def _get_visible_brand_vars(self):
-        search_text = self.search_var.get().lower()
-        if not search_text:
-            return self.brand_vars.values()
-        return [var for brand, var in self.brand_vars.items() if search_text in brand.lower()]
+        self.brand_list.select_visible(None)
 
     def get_selected_brands(self):
-        return [brand for brand, var in self.brand_vars.items() if var.get()]
+        return self.brand_list.selected_items()
 
-    def on_brand_selection_change(self, *args):
-        current_count = len(self.get_selected_brands())
+    def on_brand_selection_change(self, current_count):
         
         is_multi_now = current_count > 1
         was_multi_before = self.last_selected_brand_count > 1
@@ -1419,12 +3996,18 @@ class SupplierReportGUI:
         DatePickerWidget(self.root, self.start_date, self.end_date, on_date_selected, self.reference_date)
 
     def generate_report(self):
+        if not self.data_frames:
+            messagebox.showinfo("提示", "数据仍在加载中，请稍候。")
+            return
         selected_brands = self.get_selected_brands()
         if not selected_brands:
             messagebox.showwarning("警告", "请至少选择一个品牌。" )
             return
+        selected_stores = self.get_selected_stores()
 
-        progress_dialog = ProgressDialog(self.root, "正在生成报表...")
+        channel = ProgressChannel()
+        progress_dialog = ProgressDialog(self.root, "正在生成报表...", channel)
+        self.data_processor.notifier.channel = channel
         self.status_var.set("正在生成报表，请稍候...")
         self.root.update()
 
@@ -1432,50 +4015,73 @@ class SupplierReportGUI:
             try:
                 start_date, end_date = self.start_date, self.end_date
                 export_format = self.export_format.get()
-                report_generator = ReportGenerator(self.data_processor, self.inventory_calc, self.sales_analyzer, self.product_manager)
+                report_generator = ReportGenerator(self.data_processor, self.inventory_calc, self.sales_analyzer,
+                                                   self.product_manager, self.report_cache)
                 
-                report_generator.set_progress_callback(progress_dialog.update_progress)
+                report_generator.set_progress_callback(channel.progress)
                 
                 success, report_path = report_generator.generate_report(
-                    self.data_frames, selected_brands, start_date, end_date, self.get_sort_params(), export_format)
-                
-                self.root.after(0, progress_dialog.destroy)
+                    self.data_frames, selected_brands, start_date, end_date, self.get_sort_params(), export_format,
+                    selected_stores or None)
 
+                monitor = report_generator.monitor
                 if success and report_path:
-                    self.status_var.set(f"报表生成成功！已保存至 {os.path.basename(report_path)}")
-                    self.root.after(0, lambda: self._show_success_dialog(report_path))
+                    timing = monitor.summary_text("各阶段耗时")
+                    channel.post(lambda: [
+                        progress_dialog.destroy(),
+                        self.status_var.set(f"报表生成成功！已保存至 {os.path.basename(report_path)}（用时 {monitor.seconds:.1f}s）"),
+                        self._show_success_dialog(report_path, timing)])
                 else:
-                    self.status_var.set("报表生成失败，请检查数据文件和设置。")
+                    channel.post(lambda: [progress_dialog.destroy(), self.status_var.set("报表生成失败，请检查数据文件和设置。")])
+            except OperationCancelled:
+                print("⏹️ 报表生成已取消")
+                channel.post(lambda: [progress_dialog.destroy(), self.status_var.set("报表生成已取消。")])
             except Exception as e:
-                self.root.after(0, progress_dialog.destroy)
-                self.status_var.set(f"发生严重错误: {e}")
-                self.root.after(0, lambda: messagebox.showerror("严重错误", f"生成报表时发生意外错误:\n{e}"))
+                channel.post(lambda e=e: [
+                    progress_dialog.destroy(),
+                    self.status_var.set(f"发生严重错误: {e}"),
+                    messagebox.showerror("严重错误", f"生成报表时发生意外错误:\n{e}")])
                 import traceback
                 traceback.print_exc()
         
         threading.Thread(target=report_thread, daemon=True).start()
 
-    def _show_success_dialog(self, report_path):
+    def _show_success_dialog(self, report_path, timing=None):
         buttons = [
             ("关闭", None),
             ("打开所在文件夹", lambda: open_file_or_folder(os.path.dirname(report_path))),
             ("打开文件", lambda: open_file_or_folder(report_path))
         ]
-        dialog = CustomMessageBox(self.root, "生成成功", f"报表已成功生成！\n\n文件路径:\n{report_path}", buttons)
+        message = f"报表已成功生成！\n\n文件路径:\n{report_path}"
+        if timing:
+            message += f"\n\n{timing}"
+        dialog = CustomMessageBox(self.root, "生成成功", message, buttons)
         self.root.wait_window(dialog)
 
 # ==================== 进度条和对话框组件 ====================
 class ProgressDialog(tk.Toplevel):
-    def __init__(self, parent, title="正在加载数据..."):
+    """进度对话框
+
+    传入 ProgressChannel 时，对话框在主线程按固定帧率取出通道中的进度和回调，
+    并提供"取消"按钮请求协作式取消；进度条在各帧之间平滑过渡到目标值。
+    """
+    FRAME_MS = 50  # 刷新间隔，约 20 帧/秒
+
+    def __init__(self, parent, title="正在加载数据...", channel=None):
         super().__init__(parent)
         self.title(title)
-        self.geometry("550x200")
+        self.geometry("550x240" if channel else "550x200")
         self.resizable(False, False)
         self.transient(parent)
         self.center_window()
+        self.channel = channel
+        self.target_value = 0
         self.progress_var = tk.DoubleVar()
         self.status_var = tk.StringVar(value="准备加载...")
         self.create_widgets()
+        if channel is not None:
+            self.protocol("WM_DELETE_WINDOW", self.request_cancel)
+        self._pump_job = self.after(self.FRAME_MS, self._pump)
 
     def center_window(self):
         self.update_idletasks()
@@ -1500,29 +4106,45 @@ class ProgressDialog(tk.Toplevel):
         self.percent_label = ttk.Label(progress_frame, textvariable=self.percent_var, font=("微软雅黑", 9, "bold"), width=5, anchor='e')
         self.percent_label.pack(side=tk.RIGHT, padx=(10, 0))
 
+        if self.channel is not None:
+            self.cancel_button = ttk.Button(main_frame, text="取消", command=self.request_cancel)
+            self.cancel_button.pack(pady=(10, 0))
+
     def update_progress(self, value, status):
-        target_value = int(value)
-        current_value = int(self.progress_var.get())
-        
+        """设置目标进度和状态文本（主线程调用），进度只增不减"""
         self.status_var.set(status)
-        self.update_idletasks()
+        self.target_value = max(self.target_value, min(100, int(value)))
 
-        if target_value <= current_value:
-            if target_value == 100: # Ensure 100% is set
-                self.progress_var.set(target_value)
-                self.percent_var.set(f"{target_value}%")
-                self.update_idletasks()
+    def request_cancel(self):
+        """请求取消，工作线程在下一次汇报进度时停止"""
+        if self.channel is None or self.channel.cancelled:
             return
+        self.channel.cancel()
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_var.set("正在取消，等待当前步骤结束...")
+
+    def _pump(self):
+        """每帧处理一次：合并后的最新进度、投递的回调、进度条动画"""
+        self._pump_job = None
+        calls = []
+        if self.channel is not None:
+            latest, calls = self.channel.drain()
+            if latest is not None and not self.channel.cancelled:
+                self.update_progress(*latest)
+        current = int(self.progress_var.get())
+        if current < self.target_value:
+            current += max(1, (self.target_value - current) // 4)
+            self.progress_var.set(current)
+            self.percent_var.set(f"{current}%")
+        for callback, args in calls:
+            callback(*args)
+        if self.winfo_exists():
+            self._pump_job = self.after(self.FRAME_MS, self._pump)
 
-        # Animate the progress
-        for i in range(current_value + 1, target_value + 1):
-            self.progress_var.set(i)
-            self.percent_var.set(f"{i}%")
-            self.update_idletasks()
-            import time
-            time.sleep(0.015)
-        
     def destroy(self):
+        if self._pump_job is not None:
+            self.after_cancel(self._pump_job)
+            self._pump_job = None
         super().destroy()
 
 class CustomMessageBox(tk.Toplevel):
@@ -1564,6 +4186,240 @@ class CustomMessageBox(tk.Toplevel):
             command()
         self.destroy()
 
+class BrandSearchIndex:
+    """品牌搜索索引，支持子串、前缀与拼音首字母匹配并对结果排序。
+
+    构建时为每个品牌预先计算小写名称和拼音首字母串，并建立字符到品牌下标的
+    倒排表；查询时先用查询中最稀有字符的倒排表缩小候选范围。连续输入时新查询
+    以上一次查询为前缀，匹配集合只会缩小，因此直接在上一次结果内继续筛选。
+    """
+    # GB2312 一级汉字按拼音排序，各声母首字的区位码即为分界（二级汉字按部首排序，不在此表内）
+    GB2312_INITIALS = [
+        (0xB0A1, 'a'), (0xB0C5, 'b'), (0xB2C1, 'c'), (0xB4EE, 'd'), (0xB6EA, 'e'), (0xB7A2, 'f'),
+        (0xB8C1, 'g'), (0xB9FE, 'h'), (0xBBF7, 'j'), (0xBFA6, 'k'), (0xC0AC, 'l'), (0xC2E8, 'm'),
+        (0xC4C3, 'n'), (0xC5B6, 'o'), (0xC5BE, 'p'), (0xC6DA, 'q'), (0xC8BB, 'r'), (0xC8F6, 's'),
+        (0xCBFA, 't'), (0xCDDA, 'w'), (0xCEF4, 'x'), (0xD1B9, 'y'), (0xD4D1, 'z'),
+    ]
+    GB2312_LEVEL1_END = 0xD7F9
+    _GB2312_STARTS = [start for start, _ in GB2312_INITIALS]
+    _char_initials = {}  # 单字首字母缓存
+    _pinyin = None  # 惰性加载的 pypinyin 首字母函数，False 表示不可用
+
+    def __init__(self, brands):
+        self.brands = list(brands)
+        self._names = [str(b).lower() for b in self.brands]
+        self._initials = [self.initials(str(b)) for b in self.brands]
+        postings = {}
+        for i, (name, initials) in enumerate(zip(self._names, self._initials)):
+            for ch in set(name) | set(initials):
+                postings.setdefault(ch, []).append(i)
+        self._postings = {ch: np.array(ids, dtype=np.intp) for ch, ids in postings.items()}
+        self._last_query, self._last_matches = None, None
+
+    @classmethod
+    def initials(cls, text):
+        """返回文本的拼音首字母串（小写），字母数字原样保留，其余符号忽略
+
+        安装了 pypinyin 时使用其多音字处理；否则按 GB2312 一级汉字表推算，
+        表外汉字保留原字。
+        """
+        if cls._pinyin is None:
+            try:
+                from pypinyin import lazy_pinyin, Style
+                cls._pinyin = lambda s: ''.join(lazy_pinyin(s, style=Style.FIRST_LETTER))
+            except ImportError:
+                cls._pinyin = False  # 未安装 pypinyin 时使用 GB2312 分界表
+        if cls._pinyin:
+            text = cls._pinyin(text)
+        cache = cls._char_initials
+        return ''.join(cache[ch] if ch in cache else cls._char_initial(ch) for ch in text.lower() if ch.isalnum())
+
+    @classmethod
+    def _char_initial(cls, ch):
+        initial = ch
+        if not ch.isascii():
+            try:
+                code = int.from_bytes(ch.encode('gb2312'), 'big')
+            except UnicodeEncodeError:
+                code = 0
+            if cls.GB2312_INITIALS[0][0] <= code <= cls.GB2312_LEVEL1_END:
+                initial = cls.GB2312_INITIALS[bisect.bisect_right(cls._GB2312_STARTS, code) - 1][1]
+        cls._char_initials[ch] = initial
+        return initial
+
+    def search(self, query):
+        """返回匹配品牌的下标数组，按匹配质量排序
+
+        排序依次为：名称完全相同、名称前缀、首字母前缀、名称子串、首字母子串，
+        同级保持品牌原有顺序。空查询返回全部品牌。
+        """
+        query = query.strip().lower()
+        if not query:
+            self._last_query, self._last_matches = None, None
+            return np.arange(len(self.brands), dtype=np.intp)
+
+        if self._last_query and query.startswith(self._last_query):
+            candidates = self._last_matches
+        else:
+            lists = [self._postings.get(ch) for ch in set(query)]
+            candidates = [] if any(ids is None for ids in lists) else min(lists, key=len)
+
+        names, initials = self._names, self._initials
+        matches = [i for i in candidates if query in names[i] or query in initials[i]]
+        self._last_query, self._last_matches = query, matches
+
+        def rank(i):
+            name, ini = names[i], initials[i]
+            if name == query:
+                return 0, i
+            if name.startswith(query):
+                return 1, i
+            if ini.startswith(query):
+                return 2, i
+            return (3 if query in name else 4), i
+
+        return np.array(sorted(matches, key=rank), dtype=np.intp)
+
+class BrandListView(ttk.Frame):
+    """虚拟化的品牌勾选列表。
+
+    画布上只保留一屏可见行的图元，滚动、过滤时仅更新这些图元的内容；
+    勾选状态存放在与品牌列表对齐的布尔数组中，过滤结果是 BrandSearchIndex
+    返回的下标数组，因此上万个品牌也不会创建上万个控件和变量。
+    """
+    ROW_HEIGHT = 24
+    BOX_SIZE = 12
+    FONT = ("微软雅黑", 9)
+
+    def __init__(self, parent, on_change=None):
+        """
+        Args:
+            parent: 父容器
+            on_change: 勾选状态变化后的回调，参数为当前已选数量
+        """
+        super().__init__(parent)
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+        self.on_change = on_change
+        self.items = []
+        self.search_index = BrandSearchIndex([])
+        self.selected = np.zeros(0, dtype=bool)
+        self.visible = np.zeros(0, dtype=np.intp)
+        self.top = 0  # 首个可见行在 visible 中的位置
+        self._rows = []  # 每个可见行的图元: (复选框, 勾号, 文本)
+
+        self.canvas = tk.Canvas(self, highlightthickness=0, background="white")
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.canvas.bind("<Configure>", lambda e: self.redraw())
+        self.canvas.bind("<Button-1>", self._on_click)
+        # 滚轮只在列表区域内生效（Windows/macOS 用 MouseWheel，X11 用 Button-4/5）
+        self.canvas.bind("<MouseWheel>", self._on_mousewheel)
+        self.canvas.bind("<Button-4>", lambda e: self.yview("scroll", -1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.yview("scroll", 1, "units"))
+
+    # ---------- 数据 ----------
+    def set_items(self, items, filter_text=""):
+        """替换品牌列表，按名称保留原有勾选状态"""
+        previous = set(self.selected_items())
+        self.items = list(items)
+        self.search_index = BrandSearchIndex(self.items)
+        self.selected = np.fromiter((item in previous for item in self.items), dtype=bool, count=len(self.items))
+        self.set_filter(filter_text)
+
+    def set_filter(self, text):
+        """按名称子串或拼音首字母过滤可见品牌并排序，不影响勾选状态"""
+        self.visible = self.search_index.search(text)
+        self.top = 0
+        self.redraw()
+
+    def selected_items(self):
+        return [self.items[i] for i in np.flatnonzero(self.selected)]
+
+    def selected_count(self):
+        return int(self.selected.sum())
+
+    def select_visible(self, state):
+        """将当前可见的品牌全部设为勾选(True)、取消(False)或反选(None)"""
+        if state is None:
+            self.selected[self.visible] = ~self.selected[self.visible]
+        else:
+            self.selected[self.visible] = state
+        self.redraw()
+        self._notify()
+
+    # ---------- 绘制 ----------
+    def _page_size(self):
+        return max(1, self.canvas.winfo_height() // self.ROW_HEIGHT)
+
+    def _ensure_rows(self, count):
+        """按画布高度补足行图元池，图元只创建一次，之后只改内容"""
+        h, box = self.ROW_HEIGHT, self.BOX_SIZE
+        while len(self._rows) < count:
+            y = len(self._rows) * h + h // 2
+            rect = self.canvas.create_rectangle(8, y - box // 2, 8 + box, y + box // 2, outline="#707070", width=1)
+            mark = self.canvas.create_line(10, y, 13, y + 3, 18, y - 3, fill="white", width=2, state="hidden")
+            text = self.canvas.create_text(28, y, anchor="w", font=self.FONT)
+            self._rows.append((rect, mark, text))
+
+    def redraw(self):
+        page = self._page_size()
+        self.top = max(0, min(self.top, len(self.visible) - page))
+        self._ensure_rows(page + 1)
+        for slot, (rect, mark, text) in enumerate(self._rows):
+            pos = self.top + slot
+            if slot <= page and pos < len(self.visible):
+                self._draw_row(slot, self.visible[pos])
+                for item in (rect, text):
+                    self.canvas.itemconfigure(item, state="normal")
+            else:
+                for item in (rect, mark, text):
+                    self.canvas.itemconfigure(item, state="hidden")
+        total = len(self.visible)
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + page) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _draw_row(self, slot, index):
+        rect, mark, text = self._rows[slot]
+        checked = bool(self.selected[index])
+        self.canvas.itemconfigure(rect, fill="#0078D7" if checked else "white",
+                                  outline="#0078D7" if checked else "#707070")
+        self.canvas.itemconfigure(mark, state="normal" if checked else "hidden")
+        self.canvas.itemconfigure(text, text=self.items[index])
+
+    # ---------- 交互 ----------
+    def yview(self, *args):
+        """滚动条回调，支持 moveto 与 scroll units/pages"""
+        total, page = len(self.visible), self._page_size()
+        if args[0] == "moveto":
+            self.top = int(round(float(args[1]) * total))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            self.top += step * page if args[2] == "pages" else step
+        self.redraw()
+
+    def _on_mousewheel(self, event):
+        step = int(-1 * (event.delta / 120)) or (-1 if event.delta > 0 else 1)
+        self.yview("scroll", step, "units")
+
+    def _on_click(self, event):
+        slot = event.y // self.ROW_HEIGHT
+        pos = self.top + slot
+        if slot > self._page_size() or pos >= len(self.visible):
+            return
+        index = self.visible[pos]
+        self.selected[index] = not self.selected[index]
+        self._draw_row(slot, index)
+        self._notify()
+
+    def _notify(self):
+        if self.on_change:
+            self.on_change(self.selected_count())
+
 class DatePickerWidget(tk.Toplevel):
     def __init__(self, parent, initial_start_date=None, initial_end_date=None, callback=None, reference_date=None):
         super().__init__(parent)
@@ -1822,12 +4678,21 @@ class DataStatusManager:
         self.recent_30_days_stats = {
             'total_orders': 0, 'total_quantity': 0, 'total_amount': 0.0, 'date_range': ''
         }
+        self.memory_usage = {}
 
     def update_all_statuses(self, data_frames, product_file_path):
         self.update_sales_status(data_frames.get('sales'))
         self.update_inventory_flow_status(data_frames.get('inventory_flow'))
         self.update_inventory_check_status(data_frames.get('inventory_check'))
-        self.update_product_status(product_file_path)
+        self.update_product_status(data_frames.get('product'), product_file_path)
+        self.update_memory_usage(data_frames)
+
+    def update_memory_usage(self, data_frames):
+        """统计各数据表占用的内存（字节）"""
+        self.memory_usage = {
+            key: int(df.memory_usage(deep=True).sum())
+            for key, df in data_frames.items() if df is not None and not df.empty
+        }
 
     def update_sales_status(self, sales_df):
         C = Config.STD_COLS
@@ -1835,6 +4700,7 @@ class DataStatusManager:
             self.status_info['sales'].update({
                 'last_update': sales_df[C['SALES_TIME']].max(),
                 'record_count': len(sales_df),
+                'stores': len(ProductManager.get_all_stores(sales_df)),
                 'file_exists': True
             })
             self.calculate_recent_30_days_stats(sales_df)
@@ -1851,15 +4717,12 @@ class DataStatusManager:
         else:
             self.status_info['inventory_flow']['file_exists'] = False
 
-    def update_product_status(self, product_file_path):
+    def update_product_status(self, product_df, product_file_path):
+        # 记录数取自已加载的商品资料，更新时间取自文件元数据，不再重读文件
         if product_file_path and os.path.exists(product_file_path):
-            try:
-                count = pd.read_excel(product_file_path, usecols=[0]).shape[0]
-            except Exception:
-                count = 'N/A'
             self.status_info['product'].update({
                 'last_update': datetime.fromtimestamp(os.path.getmtime(product_file_path)),
-                'record_count': count,
+                'record_count': len(product_df) if product_df is not None else 'N/A',
                 'file_exists': True
             })
         else:
@@ -1882,7 +4745,8 @@ class DataStatusManager:
                 return
             latest_sale_date = sales_df[C['SALES_TIME']].max().date()
             start_date = latest_sale_date - timedelta(days=29)
-            recent_sales = sales_df[sales_df[C['SALES_TIME']].dt.date.between(start_date, latest_sale_date)]
+            recent_sales = SalesIndex.for_frame(sales_df).window(
+                datetime.combine(start_date, datetime.min.time()), datetime.combine(latest_sale_date, datetime.max.time()))
             if not recent_sales.empty:
                 self.recent_30_days_stats = {
                     'total_orders': recent_sales[C['ORDER_ID']].nunique(),
@@ -1904,7 +4768,8 @@ class DataStatusManager:
             if info['file_exists']:
                 update_str = info['last_update'].strftime('%Y-%m-%d %H:%M') if info['last_update'] else 'N/A'
                 count_str = f"{info['record_count']:,}" if isinstance(info['record_count'], int) else info['record_count']
-                lines.append(f"✅ {name}: 最新至 {update_str} ({count_str}条)")
+                store_str = f"，{info['stores']} 个门店" if info.get('stores', 0) > 1 else ''
+                lines.append(f"✅ {name}: 最新至 {update_str} ({count_str}条{store_str})")
             else:
                 lines.append(f"❌ {name}: 未找到或加载失败")
 
@@ -1913,10 +4778,25 @@ class DataStatusManager:
             lines.append("\n" + "─" * 50)
             lines.append(
                 f"📊 近30天 ({stats['date_range']}) 销售概览:\n   总订单: {stats['total_orders']:,} 笔 | 总销量: {stats['total_quantity']:,.0f} 件 | 总金额: {stats['total_amount']:,.2f} 元")
+        if self.memory_usage:
+            names = {'sales': '销售', 'inventory_flow': '货流', 'product': '商品', 'inventory_check': '盘点',
+                     'sales_daily': '日汇总', 'sales_orders': '订单索引'}
+            parts = [f"{names.get(k, k)} {v / 1024 ** 2:,.1f} MB" for k, v in self.memory_usage.items()]
+            total = sum(self.memory_usage.values()) / 1024 ** 2
+            lines.append(f"💾 内存占用: {' | '.join(parts)} | 合计 {total:,.1f} MB")
         return '\n'.join(lines)
 
 # ==================== 主入口 ====================
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包为 exe 时进程池子进程需要
+    cli_args = parse_cli_args()
+    Config.INSTRUMENTATION.update(
+        profile=cli_args.profile or Config.INSTRUMENTATION['profile'],
+        trace_memory=cli_args.trace_memory or Config.INSTRUMENTATION['trace_memory'])
+    if cli_args.batch:
+        sys.exit(run_batch(cli_args))
+    if cli_args.benchmark:
+        sys.exit(run_benchmark(cli_args))
     root = tk.Tk()
     app = SupplierReportGUI(root)
     root.mainloop()